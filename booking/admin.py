@@ -1,10 +1,255 @@
 # booking/admin.py
-from django.contrib import admin
-from .models import UserProfile, Staff, Service, Availability, Booking
-
-# Register each model to make it visible in the admin interface.
-admin.site.register(UserProfile)
-admin.site.register(Staff)
-admin.site.register(Service)
-admin.site.register(Availability)
-admin.site.register(Booking)
\ No newline at end of file
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import UserProfile, Staff, Service, Availability, Booking, BookingArchive, DailyRollup, OutboxMessage, ReminderJob, StripeEvent
+from .booking_logic import LONGEST_BOOKING, blocking_bookings
+from .reminders import sync_reminder_jobs
+from .rollups import record_status_changes
+from .slot_cache import bump_booking_days
+
+# Below this many rows an exact COUNT(*) is cheap, so estimates are not used.
+ESTIMATE_COUNTS_ABOVE = 10000
+
+
+def estimated_row_count(model, using):
+    """The database's own estimate of a table's size, or None if it has none.
+
+    PostgreSQL keeps one in pg_class; SQLite has one in sqlite_stat1 once
+    ANALYZE (or PRAGMA optimize) has run. Both are instant, unlike COUNT(*).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError: # e.g. SQLite before the first ANALYZE.
+        return None
+    if not row or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None # PostgreSQL says -1 before the first ANALYZE.
+
+
+class EstimatedCountPaginator(Paginator):
+    """Uses the table-size estimate for unfiltered lists of big tables.
+
+    Filtered lists (a status, a date in the hierarchy, a search) still get
+    an exact count, which the indexes keep cheap.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > ESTIMATE_COUNTS_ABOVE:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Defaults for tables that grow without bound."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False # Skips a second, unfiltered COUNT(*) on every page.
+    list_per_page = 50
+
+
+# How many selected bookings the status actions change per transaction.
+STATUS_ACTION_CHUNK_SIZE = 500
+
+
+def confirm_clashes(bookings, now=None):
+    """The ids of the bookings that would overlap another live booking if they were confirmed.
+
+    One query finds clashes with bookings that already hold their slot;
+    clashes among the given bookings themselves are found in memory.
+    """
+    now = now or timezone.now()
+    to_confirm = [booking for booking in bookings if booking.status != 'confirmed']
+    if not to_confirm:
+        return set()
+    occupying = Booking.objects.filter(
+        blocking_bookings(now), staff=OuterRef('staff'), start_time__lt=OuterRef('end_time'), end_time__gt=OuterRef('start_time'),
+        start_time__gt=OuterRef('start_time') - LONGEST_BOOKING,
+    ).exclude(pk=OuterRef('pk'))
+    clashes = set(Booking.objects.filter(Exists(occupying), pk__in=[booking.pk for booking in to_confirm]).values_list('pk', flat=True))
+    accepted = {} # staff_id -> [(start, end), ...] confirmed so far in this batch.
+    for booking in sorted(to_confirm, key=lambda booking: booking.start_time):
+        if booking.pk in clashes:
+            continue
+        taken = accepted.setdefault(booking.staff_id, [])
+        if any(start < booking.end_time and booking.start_time < end for start, end in taken):
+            clashes.add(booking.pk)
+        else:
+            taken.append((booking.start_time, booking.end_time))
+    return clashes
+
+
+def set_booking_status(modeladmin, request, queryset, status):
+    """Changes the status of the selected bookings, one UPDATE per chunk.
+
+    The selection is walked in pk order, STATUS_ACTION_CHUNK_SIZE bookings
+    per transaction, so even "select all" on the whole table never sits in
+    memory at once. Bookings that would be confirmed on top of another live
+    booking are left as they are.
+    """
+    updated, clashes, last_pk = 0, [], 0
+    queryset = queryset.order_by('pk')
+    while True:
+        # update() skips post_save, so load what the slot cache and the daily
+        # rollups need (times, price, old status) before changing anything.
+        chunk = list(queryset.filter(pk__gt=last_pk).select_related('service')[:STATUS_ACTION_CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        try:
+            with transaction.atomic():
+                if status == 'confirmed':
+                    # Serialize with reserve_slot, which locks the stylist the same way.
+                    list(Staff.objects.select_for_update().filter(pk__in={booking.staff_id for booking in chunk}).values_list('pk'))
+                    clashing = confirm_clashes(chunk)
+                    clashes += sorted(clashing)
+                    chunk = [booking for booking in chunk if booking.pk not in clashing]
+                updated += Booking.objects.filter(pk__in=[booking.pk for booking in chunk]).update(status=status, hold_expires_at=None, updated_at=timezone.now())
+                old_statuses = [booking.status for booking in chunk]
+                for booking in chunk:
+                    booking.status = status
+                record_status_changes(zip(chunk, old_statuses))
+                sync_reminder_jobs(chunk)
+        except IntegrityError:
+            modeladmin.message_user(request, f"Another live booking already has one of these slots; stopped after {updated} booking(s).", messages.ERROR)
+            return
+        for booking in chunk:
+            bump_booking_days(booking.staff_id, booking.start_time, booking.end_time)
+    if clashes:
+        listed = ', '.join(f'#{pk}' for pk in clashes[:10]) + (' and more' if len(clashes) > 10 else '')
+        modeladmin.message_user(request, f"{len(clashes)} booking(s) overlap another live booking and were left as they are: {listed}.", messages.WARNING)
+    modeladmin.message_user(request, f"{updated} booking(s) marked as {status}.", messages.SUCCESS)
+
+
+@admin.action(description="Mark selected bookings as confirmed")
+def mark_confirmed(modeladmin, request, queryset):
+    set_booking_status(modeladmin, request, queryset, 'confirmed')
+
+
+@admin.action(description="Mark selected bookings as completed")
+def mark_completed(modeladmin, request, queryset):
+    set_booking_status(modeladmin, request, queryset, 'completed')
+
+
+@admin.action(description="Mark selected bookings as cancelled")
+def mark_cancelled(modeladmin, request, queryset):
+    set_booking_status(modeladmin, request, queryset, 'cancelled')
+
+
+@admin.register(Booking)
+class BookingAdmin(LargeTableAdmin):
+    list_display = ('id', 'start_time', 'service', 'staff', 'customer', 'status')
+    # Everything list_display (and Staff.__str__) needs, joined into the page query.
+    list_select_related = ('service', 'staff__user_profile__user', 'customer')
+    list_filter = ('status',)
+    date_hierarchy = 'start_time'
+    ordering = ('-start_time', '-id')
+    raw_id_fields = ('customer',)
+    autocomplete_fields = ('staff', 'service')
+    actions = (mark_confirmed, mark_completed, mark_cancelled)
+    readonly_fields = ('created_at', 'updated_at')
+
+    def save_model(self, request, obj, form, change):
+        # Keep the daily rollups in step with hand edits: take the booking out
+        # as it was and add it back as it is now, in case the day, stylist or
+        # service changed as well as the status.
+        with transaction.atomic():
+            old = Booking.objects.select_related('service').filter(pk=obj.pk).first() if change else None
+            super().save_model(request, obj, form, change)
+            changes = [(obj, None)]
+            if old is not None:
+                old_status, old.status = old.status, None
+                changes.append((old, old_status))
+            record_status_changes(changes)
+            sync_reminder_jobs([obj])
+
+
+@admin.register(BookingArchive)
+class BookingArchiveAdmin(LargeTableAdmin):
+    list_display = ('id', 'start_time', 'service', 'staff', 'customer', 'status')
+    list_select_related = ('service', 'staff__user_profile__user', 'customer')
+    list_filter = ('status',)
+    ordering = ('-id',)
+    raw_id_fields = ('customer', 'staff', 'service')
+
+
+@admin.register(Staff)
+class StaffAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'user_profile')
+    list_select_related = ('user_profile__user',)
+    search_fields = ('user_profile__user__username', 'user_profile__user__first_name', 'user_profile__user__last_name')
+    raw_id_fields = ('user_profile',)
+
+
+@admin.register(Service)
+class ServiceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'duration_minutes', 'price', 'is_active')
+    list_filter = ('is_active',)
+    search_fields = ('name',)
+    autocomplete_fields = ('staff_members',)
+
+
+@admin.register(UserProfile)
+class UserProfileAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'user_type')
+    list_select_related = ('user',)
+    list_filter = ('user_type',)
+    search_fields = ('user__username', 'user__email')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Availability)
+class AvailabilityAdmin(admin.ModelAdmin):
+    list_display = ('staff', 'day_of_week', 'start_time', 'end_time')
+    list_select_related = ('staff__user_profile__user',)
+    list_filter = ('day_of_week',)
+    autocomplete_fields = ('staff',)
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(LargeTableAdmin):
+    list_display = ('id', 'subject', 'to_email', 'status', 'attempts', 'next_attempt_at')
+    list_filter = ('status',)
+    ordering = ('-id',)
+    raw_id_fields = ('booking',)
+
+
+@admin.register(ReminderJob)
+class ReminderJobAdmin(LargeTableAdmin):
+    list_display = ('booking', 'due_at', 'sent_at')
+    list_select_related = ('booking__service', 'booking__staff__user_profile__user') # Used by the booking's name.
+    ordering = ('-due_at',)
+    raw_id_fields = ('booking',)
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(LargeTableAdmin):
+    list_display = ('event_id', 'event_type', 'received_at', 'processed_at', 'problem')
+    list_filter = (('problem', admin.EmptyFieldListFilter),) # "Not empty" lists the ones to follow up.
+    search_fields = ('=event_id',) # Exact match, so the unique index is used.
+    ordering = ('-id',)
+
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(LargeTableAdmin):
+    list_display = ('day', 'staff', 'service', 'bookings', 'booked_minutes', 'available_minutes', 'revenue')
+    list_select_related = ('staff__user_profile__user', 'service')
+    date_hierarchy = 'day'
+    ordering = ('-day', 'staff_id')
+    raw_id_fields = ('staff', 'service')
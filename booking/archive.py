@@ -0,0 +1,72 @@
+# booking/archive.py
+"""
+Moving old bookings out of the live Booking table.
+
+Every slot lookup, overlap check and dashboard query runs against Booking,
+so it should only hold recent and future appointments. archive_batch()
+copies bookings older than the retention window into BookingArchive and
+deletes them from Booking in the same transaction; customers still see
+them in their history (see past_bookings_page).
+"""
+from datetime import timedelta
+from heapq import merge
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .db import retry_on_lock
+from .models import Booking, BookingArchive
+
+# Bookings that ended this many days ago are moved to the archive.
+ARCHIVE_AFTER_DAYS = getattr(settings, 'BOOKING_ARCHIVE_AFTER_DAYS', 365)
+
+# Pending bookings are left to the reaper; everything else is history.
+ARCHIVED_STATUSES = ('confirmed', 'completed', 'cancelled')
+
+# The fields copied from a Booking onto its archive row.
+ARCHIVED_FIELDS = ('id', 'customer_id', 'staff_id', 'service_id', 'start_time', 'end_time', 'status', 'created_at', 'updated_at', 'stripe_session_id')
+
+
+def archive_cutoff(days=ARCHIVE_AFTER_DAYS, now=None):
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+@retry_on_lock
+def archive_batch(cutoff, batch_size=500):
+    """Moves one batch of bookings that ended before `cutoff`. Returns how many moved."""
+    with transaction.atomic():
+        # start_time comes first so the (status, start_time) index can find the rows.
+        bookings = list(
+            Booking.objects.filter(status__in=ARCHIVED_STATUSES, start_time__lt=cutoff, end_time__lt=cutoff)
+            .order_by('id')[:batch_size]
+        )
+        if not bookings:
+            return 0
+        # ignore_conflicts: a batch interrupted after the insert can safely run again.
+        BookingArchive.objects.bulk_create(
+            [BookingArchive(**{field: getattr(booking, field) for field in ARCHIVED_FIELDS}) for booking in bookings],
+            ignore_conflicts=True,
+        )
+        Booking.objects.filter(id__in=[booking.id for booking in bookings]).delete()
+    return len(bookings)
+
+
+def past_bookings_page(customer, now, cursor=None, page_size=20):
+    """Up to page_size + 1 of a customer's past bookings, newest first, from both tables.
+
+    Both tables are read with the same keyset cursor on (start_time, id) and
+    the two short lists are merged, so paging walks from live bookings into
+    the archive without the customer noticing. Archive rows keep their
+    original ids, so a cursor stays valid after its booking is archived.
+    """
+    related = ('service', 'staff__user_profile__user')
+    pages = []
+    for model in (Booking, BookingArchive):
+        rows = model.objects.filter(customer=customer, start_time__lt=now).select_related(*related).order_by('-start_time', '-id')
+        if cursor:
+            before_time, before_id = cursor
+            rows = rows.filter(Q(start_time__lt=before_time) | Q(start_time=before_time, id__lt=before_id))
+        pages.append(rows[:page_size + 1])
+    newest_first = merge(*pages, key=lambda booking: (booking.start_time, booking.id), reverse=True)
+    return list(islice(newest_first, page_size + 1))
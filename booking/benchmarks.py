@@ -0,0 +1,57 @@
+# booking/benchmarks.py
+"""
+Helpers for the bench_suite command: timing a scenario, summarising the
+samples and comparing a run against a saved baseline.
+"""
+import statistics
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def measure(action, repeat):
+    """Runs `action` `repeat` times; returns per-call milliseconds and query counts."""
+    action() # Warm-up: the first call pays for template loading and empty caches.
+    timings, queries = [], []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            action()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+    return timings, queries
+
+
+def summarize(timings, queries):
+    """p50/p95/p99 latency and query counts for one scenario, rounded for readable JSON."""
+    if len(timings) > 1:
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = timings[0]
+    return {
+        'requests': len(timings),
+        'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'queries_mean': round(statistics.mean(queries), 2), 'queries_max': max(queries),
+    }
+
+
+def find_regressions(results, baseline, tolerance=0.25, slack_ms=1.0):
+    """Human-readable reasons why `results` is worse than `baseline` (empty if it is not).
+
+    Latency regresses when p95 grows by more than `tolerance` (a fraction)
+    plus `slack_ms`, which keeps sub-millisecond noise from failing a run.
+    Query counts are deterministic, so any increase is a regression.
+    """
+    problems = []
+    for name, before in baseline.get('scenarios', {}).items():
+        after = results['scenarios'].get(name)
+        if after is None:
+            continue # Not run this time (e.g. filtered with --scenario).
+        limit = before['p95_ms'] * (1 + tolerance) + slack_ms
+        if after['p95_ms'] > limit:
+            problems.append(f"{name}: p95 {after['p95_ms']:.2f} ms > {limit:.2f} ms (baseline {before['p95_ms']:.2f} ms)")
+        if after['queries_max'] > before['queries_max']:
+            problems.append(f"{name}: {after['queries_max']} queries per request (baseline {before['queries_max']})")
+    return problems
@@ -1,44 +1,238 @@
 # booking/booking_logic.py
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.utils import timezone
-from .models import Availability, Booking
+from .db import retry_on_lock
+from .models import Availability, Booking, Staff
+from .reminders import sync_reminder_jobs
+from .rollups import record_status_changes
+from .slot_engine import free_start_times, free_start_times_for_range
 
-def get_available_slots(service, staff, booking_date):
-    """Calculates all available time slots for a staff member on a specific date."""
-    available_slots = []
-    service_duration = timedelta(minutes=service.duration_minutes)
-    weekday = booking_date.weekday()
+# How long a 'pending' booking keeps its slot while the customer pays. Stripe
+# only accepts checkout sessions that live at least 30 minutes, and the
+# session expires together with the hold.
+BOOKING_HOLD_MINUTES = getattr(settings, 'BOOKING_HOLD_MINUTES', 31)
+
+# Abandoned checkouts are deleted once their pending booking is this old. It
+# is well past the hold, so a late "payment completed" webhook still finds it.
+PENDING_BOOKING_TTL_MINUTES = getattr(settings, 'PENDING_BOOKING_TTL_MINUTES', 120)
+
+# The statuses a booking can be cancelled from.
+CANCELLABLE_STATUSES = ('pending', 'confirmed')
+
+# One open appointment time found by the "any stylist" search.
+OpenSlot = namedtuple('OpenSlot', ['start_time', 'staff'])
+
+# No appointment lasts this long, so it bounds how far back an overlap check looks.
+LONGEST_BOOKING = timedelta(days=1)
+
+class SlotUnavailable(Exception):
+    """Raised when a requested time cannot be booked: it has passed, falls outside
+    the stylist's working hours, or overlaps a confirmed booking or a live hold."""
+
+def day_range(first_day, last_day=None):
+    """The half-open [start, end) datetime range covering whole local days.
 
+    Filtering with start_time__gte/start_time__lt on these bounds lets the
+    database use an index on start_time, unlike start_time__date, which
+    wraps the column in a function.
+    """
+    last_day = last_day or first_day
+    return (
+        timezone.make_aware(datetime.combine(first_day, time.min)),
+        timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min)),
+    )
+
+def blocking_bookings(now=None):
+    """A filter for bookings that occupy their slot: confirmed ones and unexpired holds."""
+    now = now or timezone.now()
+    return Q(status='confirmed') | Q(status='pending', hold_expires_at__gt=now)
+
+def compute_day_slots(service, staff, booking_date):
+    """Free slots for one staff member and day, plus when that answer may change on its own.
+
+    The second value is the expiry time of the earliest hold on the day (or
+    None): once it passes, the slot it held opens up again.
+    """
     # 1. Get the staff's general working hours for that day of the week.
     try:
-        availability = Availability.objects.get(staff=staff, day_of_week=weekday)
+        availability = Availability.objects.get(staff=staff, day_of_week=booking_date.weekday())
     except Availability.DoesNotExist:
-        return [] # Staff does not work on this day.
+        return [], None # Staff does not work on this day.
 
-    # 2. Get all the confirmed appointments that are already booked for that day.
-    bookings_on_day = Booking.objects.filter(
+    # 2. Get all the appointments and live holds that already occupy that day.
+    # We only need the times, so skip building full model instances.
+    day_start, day_end = day_range(booking_date)
+    bookings_on_day = list(Booking.objects.filter(
+        blocking_bookings(),
         staff=staff,
-        start_time__date=booking_date,
-        status='confirmed'
-    ).order_by('start_time')
-
-    # 3. Iterate through the staff's workday, finding the gaps between existing bookings.
-    current_time_naive = datetime.combine(booking_date, availability.start_time)
-    current_time = timezone.make_aware(current_time_naive)
-    end_of_day_naive = datetime.combine(booking_date, availability.end_time)
-    end_of_day = timezone.make_aware(end_of_day_naive)
-
-    for booking in bookings_on_day:
-        # Check for slots before this booking starts.
-        while current_time + service_duration <= booking.start_time:
-            available_slots.append(current_time.time())
-            current_time += timedelta(minutes=15) # We check for start times every 15 mins.
-        # Jump our clock to the end of the current booking.
-        current_time = booking.end_time
-
-    # 4. After the last booking, check for remaining slots until the end of the day.
-    while current_time + service_duration <= end_of_day:
-        available_slots.append(current_time.time())
-        current_time += timedelta(minutes=15)
-        
-    return available_slots
\ No newline at end of file
+        start_time__gte=day_start,
+        start_time__lt=day_end,
+    ).values_list('start_time', 'end_time', 'hold_expires_at'))
+    hold_expiries = [hold_expires_at for _, _, hold_expires_at in bookings_on_day if hold_expires_at]
+
+    # 3. Let the slot engine intersect the working hours with the booked time
+    # and find every start time that leaves room for the whole service.
+    slots = free_start_times(
+        booking_date, availability.start_time, availability.end_time,
+        [(start, end) for start, end, _ in bookings_on_day], service.duration_minutes
+    )
+    return slots, min(hold_expiries, default=None)
+
+def compute_range_slots(service, staff_id, start_date, end_date):
+    """compute_day_slots for every day from start_date to end_date, in two queries.
+
+    Returns ({date: [time, ...]}, earliest hold expiry or None).
+    """
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    hours = {
+        day_of_week: (start, end)
+        for day_of_week, start, end in Availability.objects.filter(staff_id=staff_id).values_list('day_of_week', 'start_time', 'end_time')
+    }
+    if not hours:
+        return {day: [] for day in days}, None # Staff does not work at all.
+    range_start, range_end = day_range(start_date, end_date)
+    bookings = list(Booking.objects.filter(
+        blocking_bookings(), staff_id=staff_id,
+        start_time__gt=range_start - LONGEST_BOOKING, start_time__lt=range_end, end_time__gt=range_start,
+    ).values_list('start_time', 'end_time', 'hold_expires_at'))
+    hold_expiries = [hold_expires_at for _, _, hold_expires_at in bookings if hold_expires_at]
+    slots = free_start_times_for_range(days, hours, [(start, end) for start, end, _ in bookings], service.duration_minutes)
+    return slots, min(hold_expiries, default=None)
+
+def get_available_slots(service, staff, booking_date):
+    """Calculates all available time slots for a staff member on a specific date."""
+    return compute_day_slots(service, staff, booking_date)[0]
+
+def is_offered_start(staff, service, start_time):
+    """Whether start_time is one of the start times the booking form offers for the
+    stylist's working hours that day (ignoring other bookings). One query."""
+    local_start = timezone.localtime(start_time)
+    availability = Availability.objects.filter(staff=staff, day_of_week=local_start.weekday()).first()
+    if availability is None:
+        return False
+    starts = free_start_times(local_start.date(), availability.start_time, availability.end_time, [], service.duration_minutes)
+    return local_start.time() in starts
+
+@retry_on_lock
+def reserve_slot(customer, staff, service, start_time):
+    """Atomically places a short-lived 'pending' hold on a slot, or raises SlotUnavailable.
+
+    The start time comes straight from the customer's POST, so it is checked
+    here: it must be in the future, on the slot grid within the stylist's
+    working hours, and clear of other live bookings. The staff row is locked
+    for the length of the transaction, so two customers reserving the same
+    stylist are serialized and see each other's holds (SQLite serializes all
+    writers anyway). The partial unique constraint on Booking only covers an
+    identical (staff, start_time); overlapping bookings with different start
+    times are kept out by this check alone, not by the database.
+    """
+    end_time = start_time + timedelta(minutes=service.duration_minutes)
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            list(Staff.objects.select_for_update().filter(pk=staff.pk).values_list('pk'))
+            if start_time <= now or not is_offered_start(staff, service, start_time):
+                raise SlotUnavailable
+            overlapping = Booking.objects.filter(
+                staff=staff, start_time__gt=start_time - LONGEST_BOOKING, start_time__lt=end_time, end_time__gt=start_time
+            )
+            if overlapping.filter(blocking_bookings(now)).exists():
+                raise SlotUnavailable
+            # Expired holds no longer count, so clear them out of the way.
+            overlapping.filter(status='pending', hold_expires_at__lte=now).delete()
+            return Booking.objects.create(
+                customer=customer, staff=staff, service=service,
+                start_time=start_time, end_time=end_time, status='pending',
+                hold_expires_at=now + timedelta(minutes=BOOKING_HOLD_MINUTES),
+            )
+    except IntegrityError:
+        raise SlotUnavailable
+
+@retry_on_lock
+def cancel_booking(booking):
+    """Cancels a booking in its own write transaction, with its rollup totals and reminder.
+
+    Only pending and confirmed bookings can be cancelled; for anything else
+    it changes nothing and returns False.
+    """
+    with transaction.atomic():
+        # Re-read the status under a lock: cancelling a booking twice (or a
+        # completed one) would take it off the daily rollups a second time.
+        old_status = Booking.objects.select_for_update().filter(pk=booking.pk).values_list('status', flat=True).first()
+        if old_status not in CANCELLABLE_STATUSES:
+            return False
+        booking.status = 'cancelled'
+        booking.save()
+        record_status_changes([(booking, old_status)])
+        sync_reminder_jobs([booking])
+    return True
+
+def abandoned_bookings(ttl_minutes=PENDING_BOOKING_TTL_MINUTES, now=None):
+    """Pending bookings older than the TTL whose hold (if any) has run out."""
+    now = now or timezone.now()
+    return Booking.objects.filter(
+        Q(hold_expires_at__isnull=True) | Q(hold_expires_at__lte=now),
+        status='pending', created_at__lt=now - timedelta(minutes=ttl_minutes),
+    )
+
+@retry_on_lock
+def reap_abandoned_bookings(ttl_minutes=PENDING_BOOKING_TTL_MINUTES, chunk_size=500):
+    """Deletes one chunk of abandoned pending bookings. Returns how many were removed.
+
+    Each call is its own short write transaction, so callers loop until it
+    returns 0 instead of locking the table for one huge DELETE.
+    """
+    with transaction.atomic():
+        ids = list(abandoned_bookings(ttl_minutes).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return 0
+        # Re-check the status: a booking confirmed meanwhile must survive.
+        _, deleted = Booking.objects.filter(id__in=ids, status='pending').delete()
+    return deleted.get('booking.Booking', 0)
+
+def find_earliest_slots(service, start_date, end_date, limit=10):
+    """Finds the earliest open slots for a service across every staff member who offers it.
+
+    Always runs three queries (staff, working hours, bookings), however many
+    staff members or days the range [start_date, end_date] covers.
+    """
+    staff_members = list(service.staff_members.select_related('user_profile__user'))
+    if not staff_members:
+        return []
+    staff_by_id = {staff.id: staff for staff in staff_members}
+    range_start, range_end = day_range(start_date, end_date)
+
+    # Load every relevant schedule and booking for the whole range at once.
+    hours = {staff_id: {} for staff_id in staff_by_id}
+    for availability in Availability.objects.filter(staff_id__in=staff_by_id):
+        hours[availability.staff_id][availability.day_of_week] = (availability.start_time, availability.end_time)
+    busy = {staff_id: [] for staff_id in staff_by_id}
+    bookings = Booking.objects.filter(
+        blocking_bookings(), staff_id__in=staff_by_id,
+        start_time__gt=range_start - LONGEST_BOOKING, start_time__lt=range_end, end_time__gt=range_start,
+    ).values_list('staff_id', 'start_time', 'end_time')
+    for staff_id, start, end in bookings:
+        busy[staff_id].append((start, end))
+
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    now = timezone.localtime()
+    candidates = []
+    for staff_id in staff_by_id:
+        slots_by_day = free_start_times_for_range(days, hours[staff_id], busy[staff_id], service.duration_minutes)
+        for day, slots in slots_by_day.items():
+            for slot in slots:
+                if (day, slot) > (now.date(), now.time()): # Never offer a time that has already passed.
+                    candidates.append((day, slot, staff_id))
+
+    # Earliest first; ties are broken by staff id so results are stable. Only
+    # the few slots we return are turned into timezone-aware datetimes.
+    candidates.sort()
+    tz = timezone.get_current_timezone()
+    return [
+        OpenSlot(timezone.make_aware(datetime.combine(day, slot), tz), staff_by_id[staff_id])
+        for day, slot, staff_id in candidates[:limit]
+    ]
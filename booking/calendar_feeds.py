@@ -0,0 +1,117 @@
+# booking/calendar_feeds.py
+"""
+iCalendar (.ics) feeds that staff and customers subscribe to from their
+calendar apps.
+
+Calendar apps cannot log in, so each feed lives at a URL containing a
+signed token ("staff-<id>" or "customer-<id>"). The feed is generated as a
+stream, one VEVENT at a time, so even a long booking history never sits in
+memory as a whole. That holds under WSGI with ics_lines; ASGI servers get
+aics_lines instead, because Django reads a synchronous stream into memory
+before sending it over ASGI.
+
+Bookings moved to BookingArchive stay in the feed, as they stay in the
+customer's booking history.
+"""
+from datetime import timezone as dt_timezone
+from heapq import merge
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.urls import reverse
+from .models import Booking, BookingArchive
+
+FEED_SALT = 'booking.calendar-feed'
+FEED_KINDS = ('staff', 'customer')
+# Only these statuses appear in a feed; cancelled bookings drop out of it.
+FEED_STATUSES = ('confirmed', 'completed')
+
+
+def feed_token(kind, owner_id):
+    return signing.Signer(salt=FEED_SALT).sign(f'{kind}-{owner_id}')
+
+
+def read_feed_token(token):
+    """The (kind, owner id) a token was made for, or None if it was tampered with."""
+    try:
+        kind, owner_id = signing.Signer(salt=FEED_SALT).unsign(token).split('-')
+    except (signing.BadSignature, ValueError):
+        return None
+    if kind not in FEED_KINDS or not owner_id.isdigit():
+        return None
+    return kind, int(owner_id)
+
+
+def feed_url(request, kind, owner_id):
+    return request.build_absolute_uri(reverse('booking:calendar_feed', args=[feed_token(kind, owner_id)]))
+
+
+def feed_bookings(kind, owner_id):
+    """The bookings in one feed, as one queryset per table (live, then archived).
+
+    Staff see bookings of theirs; customers see their own.
+    """
+    owner = {'staff_id': owner_id} if kind == 'staff' else {'customer_id': owner_id}
+    return [model.objects.filter(status__in=FEED_STATUSES, **owner) for model in (Booking, BookingArchive)]
+
+
+def _escape(text):
+    return str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Splits a content line into the 75-octet pieces RFC 5545 asks for."""
+    data = line.encode()
+    if len(data) <= 75:
+        return line + '\r\n'
+    pieces, start = [], 0
+    while start < len(data):
+        end = min(start + (75 if not pieces else 74), len(data))
+        while end < len(data) and (data[end] & 0xC0) == 0x80: # Never split a UTF-8 character.
+            end -= 1
+        pieces.append(data[start:end].decode())
+        start = end
+    return '\r\n '.join(pieces) + '\r\n'
+
+
+def _stamp(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def ics_lines(kind, owner_id, host):
+    """Yields the feed one chunk (a VEVENT or the header/footer) at a time."""
+    yield ''.join(_fold(line) for line in (
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//StyleSync//Bookings//EN',
+        'CALSCALE:GREGORIAN', 'METHOD:PUBLISH', 'X-WR-CALNAME:StyleSync appointments',
+    ))
+    tables = [
+        bookings.select_related('service', 'customer', 'staff__user_profile__user').order_by('start_time', 'id').iterator(chunk_size=500)
+        for bookings in feed_bookings(kind, owner_id)
+    ]
+    # Archive rows keep their booking's id, so an event keeps its UID when it is archived.
+    for booking in merge(*tables, key=lambda booking: (booking.start_time, booking.id)):
+        if kind == 'staff':
+            summary = f"{booking.service.name} - {booking.customer.get_full_name() or booking.customer.username}"
+        else:
+            summary = f"{booking.service.name} with {booking.staff}"
+        yield ''.join(_fold(line) for line in (
+            'BEGIN:VEVENT',
+            f'UID:booking-{booking.id}@{host}',
+            f'DTSTAMP:{_stamp(booking.updated_at)}',
+            f'DTSTART:{_stamp(booking.start_time)}',
+            f'DTEND:{_stamp(booking.end_time)}',
+            f'SUMMARY:{_escape(summary)}',
+            'STATUS:CONFIRMED',
+            'END:VEVENT',
+        ))
+    yield 'END:VCALENDAR\r\n'
+
+
+async def aics_lines(kind, owner_id, host, batch_size=100):
+    """ics_lines as an async iterator, for ASGI servers. Each step reads up to batch_size chunks."""
+    lines = ics_lines(kind, owner_id, host)
+    # thread_sensitive (the default) keeps every step on the thread, and so the
+    # database connection, that opened the cursors.
+    next_batch = sync_to_async(lambda: ''.join(islice(lines, batch_size)))
+    while batch := await next_batch():
+        yield batch
@@ -0,0 +1,45 @@
+# booking/catalog.py
+"""
+The cached service catalog shown on the home page.
+
+The catalog changes rarely, so both the list of services and the rendered
+HTML fragment are cached under a version number. Saving or deleting a
+Service, or changing which staff offer it, bumps the version (see
+signals.py), which makes every cached copy obsolete at once.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import Service
+from .routers import primary_reads
+
+CATALOG_VERSION_KEY = 'catalog:version'
+# Versions make stale reads impossible, so this only bounds memory use.
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock, so an evicted counter never reuses an old number.
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
+
+
+def get_service_catalog(version=None):
+    """All active services, ordered by name, from the cache when possible."""
+    key = f'catalog:services:{version or get_catalog_version()}'
+    services = cache.get(key)
+    if services is None:
+        with primary_reads(): # Never cache a lagging replica's copy under a new version.
+            services = list(Service.objects.filter(is_active=True).order_by('name'))
+        cache.set(key, services, CATALOG_CACHE_TIMEOUT)
+    return services
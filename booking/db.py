@@ -0,0 +1,41 @@
+# booking/db.py
+"""
+Helpers for writing safely under concurrency.
+
+SQLite allows one writer at a time. With the concurrency mode in settings.py
+(WAL, a busy timeout and BEGIN IMMEDIATE transactions) writers queue up
+instead of failing, and retry_on_lock covers what is left: when a write
+transaction still hits "database is locked", it is retried a few times with
+a short, jittered backoff before the error is allowed through.
+"""
+import functools
+import random
+import time
+from django.conf import settings
+from django.db import OperationalError, connection
+
+WRITE_RETRY_ATTEMPTS = getattr(settings, 'WRITE_RETRY_ATTEMPTS', 8)
+WRITE_RETRY_BASE_SECONDS = 0.005
+
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_lock(func):
+    """Retries a function that runs its own transaction when the database reports a lock.
+
+    Only the outermost transaction can be retried, so inside an existing
+    atomic block the error is raised straight away.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(WRITE_RETRY_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if not is_lock_error(e) or connection.in_atomic_block or attempt == WRITE_RETRY_ATTEMPTS - 1:
+                    raise
+                time.sleep(random.uniform(0, WRITE_RETRY_BASE_SECONDS * 2 ** attempt))
+    return wrapper
@@ -1,11 +1,14 @@
 # booking/decorators.py
 from django.core.exceptions import PermissionDenied
+from .roles import get_checked_user_role
 
 def staff_required(function):
     """A decorator to ensure that only staff members can access a view."""
     def wrap(request, *args, **kwargs):
         # If user is logged in, has a profile, and is a staff member...
-        if request.user.is_authenticated and hasattr(request.user, 'userprofile') and request.user.userprofile.user_type == 'staff':
+        # (The role is checked in the database rather than trusted from the
+        # session, in the same query that loads the Staff row the page needs.)
+        if get_checked_user_role(request) == 'staff':
             # ...then allow them to proceed to the original view function.
             return function(request, *args, **kwargs)
         else:
@@ -1,18 +1,95 @@
 # booking/emails.py
-from django.core.mail import send_mail
+from datetime import timedelta
+from django.core.mail import EmailMessage, get_connection
 from django.template.loader import render_to_string # Allows building emails from templates
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboxMessage
 
-def send_booking_email(booking, template_prefix):
-    """A helper function to send booking confirmation emails."""
+# Retry schedule for the outbox: wait OUTBOX_RETRY_BASE_SECONDS, then twice
+# that, and so on (capped), giving up after OUTBOX_MAX_ATTEMPTS tries.
+OUTBOX_MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8)
+OUTBOX_RETRY_BASE_SECONDS = getattr(settings, 'OUTBOX_RETRY_BASE_SECONDS', 30)
+OUTBOX_RETRY_MAX_SECONDS = 60 * 60
+# How long a worker owns the messages it claimed before others may retry them.
+OUTBOX_CLAIM_SECONDS = 5 * 60
+
+def render_booking_email(booking, template_prefix):
+    """Renders the subject and body of a booking email from its templates."""
     context = {'booking': booking}
     subject = render_to_string(f'booking/email/{template_prefix}_subject.txt', context).strip()
     text_body = render_to_string(f'booking/email/{template_prefix}_body.txt', context)
-    
-    send_mail(
+    return OutboxMessage(
+        booking=booking,
         subject=subject,
-        message=text_body,
+        body=text_body,
         from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[booking.customer.email],
-        fail_silently=False # Raise an error if the email fails to send
-    )
\ No newline at end of file
+        to_email=booking.customer.email,
+    )
+
+def queue_booking_email(booking, template_prefix):
+    """Puts a booking email in the outbox. Call it inside the transaction that changes the booking."""
+    message = render_booking_email(booking, template_prefix)
+    message.save()
+    return message
+
+def claim_outbox_batch(batch_size):
+    """Claims up to `batch_size` due messages for this worker.
+
+    Claimed messages have next_attempt_at pushed into the future, so other
+    workers skip them; if this worker dies, they simply become due again.
+    """
+    now = timezone.now()
+    due = OutboxMessage.objects.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+    with transaction.atomic():
+        ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+        OutboxMessage.objects.filter(id__in=ids).update(next_attempt_at=now + timedelta(seconds=OUTBOX_CLAIM_SECONDS))
+    return list(OutboxMessage.objects.filter(id__in=ids).order_by('id'))
+
+def deliver_outbox_batch(messages, connection):
+    """Sends claimed messages over an open mail connection and records the outcome.
+
+    Returns a (sent, failed) tuple; failures are rescheduled with backoff.
+    If the mail server cannot be reached again after a failure, the batch
+    stops and the messages not yet tried are put back for a later run.
+    """
+    sent_ids = []
+    failed = 0
+    try:
+        for index, message in enumerate(messages):
+            email = EmailMessage(subject=message.subject, body=message.body, from_email=message.from_email, to=[message.to_email])
+            try:
+                connection.send_messages([email])
+            except Exception as e:
+                failed += 1
+                message.attempts += 1
+                message.last_error = str(e)
+                if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    message.status = 'failed'
+                else:
+                    delay = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (message.attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+                    message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+                message.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+                # The connection may be broken now; start a fresh one for the rest.
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception:
+                    # Still down: leave the untried messages (attempts unchanged) for a later run.
+                    untried = [other.id for other in messages[index + 1:]]
+                    OutboxMessage.objects.filter(id__in=untried).update(next_attempt_at=timezone.now() + timedelta(seconds=OUTBOX_RETRY_BASE_SECONDS))
+                    break
+            else:
+                sent_ids.append(message.id)
+    finally:
+        # Record what was delivered even if something above blew up, so it is never sent twice.
+        if sent_ids:
+            OutboxMessage.objects.filter(id__in=sent_ids).update(status='sent', sent_at=timezone.now())
+    return len(sent_ids), failed
+
+def open_mail_connection():
+    """A mail connection that stays open across batches (the backend reopens it if it drops)."""
+    connection = get_connection()
+    connection.open()
+    return connection
@@ -0,0 +1,27 @@
+# booking/management/commands/archive_bookings.py
+
+import time
+from django.core.management.base import BaseCommand
+from booking.archive import ARCHIVE_AFTER_DAYS, archive_batch, archive_cutoff
+
+# Moves old bookings into the archive table, one small transaction at a time.
+# Run it nightly from cron; it can be stopped and restarted at any point.
+class Command(BaseCommand):
+    help = 'Moves bookings older than the retention window into the booking archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help='Archive bookings that ended more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Bookings moved per transaction.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to wait between batches, so other writers get the lock.')
+
+    def handle(self, *args, **options):
+        # Fixed once, so rows that age past the window mid-run wait for the next run.
+        cutoff = archive_cutoff(options['days'])
+        total = 0
+        while True:
+            moved = archive_batch(cutoff, options['batch_size'])
+            total += moved
+            if moved < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} booking(s) older than {cutoff:%Y-%m-%d}.'))
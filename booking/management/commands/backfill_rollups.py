@@ -0,0 +1,58 @@
+# booking/management/commands/backfill_rollups.py
+
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from booking.models import Booking, BookingArchive
+from booking.rollups import local_day, rebuild_rollups, store_available_minutes
+
+# Rebuilds the daily utilization/revenue rollups from the bookings, a few
+# days per transaction. Run it once after deploying the rollups, and again
+# for any range that needs repairing (e.g. after bulk-loading bookings).
+# Also run it nightly from cron with --available-only, which stores today's
+# available minutes for every stylist, so each day keeps the working hours
+# that applied on it.
+class Command(BaseCommand):
+    help = 'Recomputes the daily rollups from live and archived bookings, in batches of days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (YYYY-MM-DD). Defaults to the oldest booking.')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day (YYYY-MM-DD). Defaults to the newest booking.')
+        parser.add_argument('--batch-days', type=int, default=31, help='Days rebuilt per transaction.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to wait between batches, so other writers get the lock.')
+        parser.add_argument('--available-only', action='store_true', help='Only store missing available minutes (the nightly run). Defaults to today.')
+        parser.add_argument('--reset-available', action='store_true', help='Also recompute stored available minutes from the current working hours.')
+
+    def handle(self, *args, **options):
+        first_day, last_day = options['start'], options['end']
+        if options['available_only']:
+            first_day = first_day or timezone.localdate()
+            last_day = last_day or first_day
+            if first_day > last_day:
+                raise CommandError('--start must not be after --end.')
+            rows = store_available_minutes(first_day, last_day)
+            self.stdout.write(self.style.SUCCESS(f'Stored {rows} available-minutes row(s) from {first_day} to {last_day}.'))
+            return
+        if first_day is None or last_day is None:
+            bounds = [model.objects.aggregate(first=Min('start_time'), last=Max('start_time')) for model in (Booking, BookingArchive)]
+            starts = [local_day(bound['first']) for bound in bounds if bound['first']]
+            ends = [local_day(bound['last']) for bound in bounds if bound['last']]
+            if not starts:
+                self.stdout.write('There are no bookings to roll up.')
+                return
+            first_day, last_day = first_day or min(starts), last_day or max(ends)
+        if first_day > last_day:
+            raise CommandError('--start must not be after --end.')
+        if options['batch_days'] < 1:
+            raise CommandError('--batch-days must be at least 1.')
+
+        rows, batch_start = 0, first_day
+        while batch_start <= last_day:
+            batch_end = min(batch_start + timedelta(days=options['batch_days'] - 1), last_day)
+            rows += rebuild_rollups(batch_start, batch_end, reset_available=options['reset_available'])
+            batch_start = batch_end + timedelta(days=1)
+            if batch_start <= last_day:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} rollup row(s) from {first_day} to {last_day}.'))
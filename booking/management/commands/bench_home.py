@@ -0,0 +1,43 @@
+# booking/management/commands/bench_home.py
+
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from django.urls import reverse
+from booking.catalog import bump_catalog_version
+
+# Benchmarks the anonymous home page with Django's test client, once with the
+# catalog cache invalidated before every request ("before") and once warm ("after").
+# It reads the configured database, so load some services first.
+class Command(BaseCommand):
+    help = 'Compares home page latency and query count with a cold and a warm catalog cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per run.')
+
+    def handle(self, *args, **options):
+        setup_test_environment() # Lets the test client use the 'testserver' host.
+        client = Client()
+        url = reverse('booking:home')
+        results = {}
+        for label, cold in (('cold cache', True), ('warm cache', False)):
+            client.get(url) # Warm up templates and (for the warm run) the cache.
+            timings, queries = [], 0
+            for _ in range(options['requests']):
+                if cold:
+                    bump_catalog_version()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries += len(captured)
+                assert response.status_code == 200
+            results[label] = statistics.mean(timings)
+            self.stdout.write(
+                f'{label}: mean {results[label]:.2f} ms, median {statistics.median(timings):.2f} ms, '
+                f'{queries / options["requests"]:.1f} queries per request'
+            )
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {results['cold cache'] / results['warm cache']:.1f}x"))
@@ -0,0 +1,65 @@
+# booking/management/commands/bench_slots.py
+
+import random
+import timeit
+from datetime import date, datetime, time, timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from booking.slot_engine import free_start_times, free_start_times_for_range, loop_free_start_times, SLOT_MINUTES
+
+# A microbenchmark comparing the bitmap slot engine with the original loop.
+# It runs entirely in memory, so it needs no database rows.
+class Command(BaseCommand):
+    help = 'Compares the bitmap slot engine against the original per-step slot loop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help='Calls per implementation.')
+        parser.add_argument('--bookings', type=int, default=12, help='Bookings placed on the sample day.')
+        parser.add_argument('--duration', type=int, default=45, help='Service length in minutes.')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        day = date(2030, 1, 7)
+        work_start, work_end = time(8, 0), time(20, 0)
+        busy = self.build_day(day, work_start, work_end, options['bookings'], options['seed'])
+        duration = options['duration']
+
+        # Both implementations should agree on a 15-minute aligned day.
+        engine_slots = free_start_times(day, work_start, work_end, busy, duration)
+        loop_slots = loop_free_start_times(day, work_start, work_end, busy, duration)
+        if engine_slots != loop_slots:
+            self.stdout.write(self.style.WARNING('Engine and loop disagree on the sample day.'))
+
+        results = {}
+        for name, func in (('loop', loop_free_start_times), ('bitmap', free_start_times)):
+            seconds = timeit.timeit(lambda: func(day, work_start, work_end, busy, duration), number=options['iterations'])
+            results[name] = seconds / options['iterations'] * 1_000_000
+            self.stdout.write(f'{name:>6}: {results[name]:.1f} us per call')
+
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {results['loop'] / results['bitmap']:.1f}x"))
+
+        # The engine can also batch a whole week in one call, which the loop cannot.
+        days = [day + timedelta(days=offset) for offset in range(7)]
+        week_busy = [interval for offset in range(7) for interval in self.build_day(days[offset], work_start, work_end, options['bookings'], options['seed'] + offset)]
+        hours = {weekday: (work_start, work_end) for weekday in range(7)}
+
+        def loop_week():
+            for current in days:
+                loop_free_start_times(current, work_start, work_end, [b for b in week_busy if b[0].date() == current], duration)
+
+        for name, func in (('loop x7', loop_week), ('bitmap week', lambda: free_start_times_for_range(days, hours, week_busy, duration))):
+            seconds = timeit.timeit(func, number=max(1, options['iterations'] // 7))
+            results[name] = seconds / max(1, options['iterations'] // 7) * 1_000_000
+            self.stdout.write(f'{name:>11}: {results[name]:.1f} us per week')
+        self.stdout.write(self.style.SUCCESS(f"Week speed-up: {results['loop x7'] / results['bitmap week']:.1f}x"))
+
+    def build_day(self, day, work_start, work_end, count, seed):
+        """Places `count` non-overlapping, 15-minute aligned bookings on the day."""
+        rng = random.Random(seed)
+        start = timezone.make_aware(datetime.combine(day, work_start))
+        cells = int((datetime.combine(day, work_end) - datetime.combine(day, work_start)).total_seconds() // 60 // SLOT_MINUTES)
+        taken = sorted(rng.sample(range(0, cells, 4), min(count, cells // 4)))
+        return [
+            (start + timedelta(minutes=cell * SLOT_MINUTES), start + timedelta(minutes=(cell + rng.choice((2, 3, 4))) * SLOT_MINUTES))
+            for cell in taken
+        ]
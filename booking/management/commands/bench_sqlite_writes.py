@@ -0,0 +1,100 @@
+# booking/management/commands/bench_sqlite_writes.py
+
+import multiprocessing
+import tempfile
+import time
+from datetime import datetime, time as clock_time, timedelta
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.utils import timezone
+from booking.booking_logic import reserve_slot, SlotUnavailable
+from booking.models import Availability, Service, Staff, UserProfile
+
+# The stylist works 09:00-17:00 every day, so reserve_slot accepts the
+# benchmark's 15-minute slots; each day holds SLOTS_PER_DAY of them.
+WORK_START, WORK_END = clock_time(9), clock_time(17)
+SLOTS_PER_DAY = (WORK_END.hour - WORK_START.hour) * 4
+FIRST_DAY = datetime(2030, 1, 7)
+
+def slot_start(number):
+    """The start of the benchmark's nth 15-minute slot, filling each working day in turn."""
+    day, slot = divmod(number, SLOTS_PER_DAY)
+    return timezone.make_aware(datetime.combine(FIRST_DAY + timedelta(days=day), WORK_START) + timedelta(minutes=15 * slot))
+
+def use_database(path, options):
+    """Points the default connection at a benchmark database file."""
+    connections.close_all()
+    connection = connections['default']
+    connection.settings_dict['NAME'] = str(path)
+    connection.settings_dict['OPTIONS'] = dict(options)
+
+def write_worker(path, options, worker, writes, retry):
+    """One process: books `writes` different slots for the same stylist, as fast as it can."""
+    use_database(path, options)
+    staff, service, customer = Staff.objects.get(), Service.objects.get(), User.objects.get(username='customer')
+    reserve = reserve_slot if retry else reserve_slot.__wrapped__ # __wrapped__ skips the retries.
+    written = lock_errors = 0
+    for i in range(writes):
+        start = slot_start(worker * writes + i)
+        try:
+            reserve(customer, staff, service, start)
+            written += 1
+        except OperationalError:
+            lock_errors += 1
+        except SlotUnavailable:
+            pass
+    connections.close_all()
+    return written, lock_errors
+
+# A multi-process write benchmark: several processes hammer one SQLite file
+# with booking reservations, once with default settings and once with the
+# concurrency mode from settings.py (WAL, busy timeout, BEGIN IMMEDIATE).
+class Command(BaseCommand):
+    help = 'Measures multi-process booking write throughput and lock errors on SQLite.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--writes', type=int, default=100, help='Reservations per process.')
+        parser.add_argument('--retry', action='store_true', help='Use the bounded lock retries as well.')
+
+    def handle(self, *args, **options):
+        original = dict(connections['default'].settings_dict)
+        modes = (('default', {}), ('concurrency mode', settings.SQLITE_CONCURRENCY_OPTIONS))
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for label, db_options in modes:
+                    path = Path(directory) / f"{label.replace(' ', '_')}.sqlite3"
+                    self.prepare(path, db_options)
+                    self.run_mode(label, path, db_options, options)
+        finally:
+            connections.close_all()
+            connections['default'].settings_dict.update(original)
+
+    def prepare(self, path, db_options):
+        use_database(path, db_options)
+        call_command('migrate', verbosity=0)
+        user = User.objects.create_user(username='stylist')
+        staff = Staff.objects.create(user_profile=UserProfile.objects.create(user=user, user_type='staff'))
+        Service.objects.create(name='Cut', description='', duration_minutes=15, price='30.00').staff_members.add(staff)
+        Availability.objects.bulk_create([
+            Availability(staff=staff, day_of_week=day_of_week, start_time=WORK_START, end_time=WORK_END) for day_of_week in range(7)
+        ])
+        User.objects.create_user(username='customer', email='customer@example.com')
+        connections.close_all() # Never share a connection with the forked workers.
+
+    def run_mode(self, label, path, db_options, options):
+        jobs = [(path, db_options, worker, options['writes'], options['retry']) for worker in range(options['processes'])]
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(options['processes']) as pool:
+            results = pool.starmap(write_worker, jobs)
+        elapsed = time.perf_counter() - started
+        written = sum(result[0] for result in results)
+        lock_errors = sum(result[1] for result in results)
+        style = self.style.SUCCESS if not lock_errors else self.style.WARNING
+        self.stdout.write(style(
+            f'{label}: {written} writes in {elapsed:.2f}s ({written / elapsed:.0f} writes/s), {lock_errors} lock errors'
+        ))
@@ -0,0 +1,146 @@
+# booking/management/commands/bench_suite.py
+
+import hashlib
+import hmac
+import io
+import json
+import random
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from booking.benchmarks import find_regressions, measure, summarize
+from booking.models import Booking, OutboxMessage, ReminderJob, Service, Staff, StripeEvent
+
+SCENARIOS = ('home', 'booking_slots', 'slot_window', 'my_bookings', 'staff_dashboard', 'stripe_webhook', 'send_reminders')
+
+# Drives the main pages, the Stripe webhook and the reminder job against the
+# configured database (fill it with generate_salon_data first) and prints
+# p50/p95/p99 latency and queries per request as JSON. With --baseline it
+# fails when a scenario got slower or runs more queries than the saved run:
+#
+#   python manage.py bench_suite --output baseline.json
+#   python manage.py bench_suite --baseline baseline.json
+class Command(BaseCommand):
+    help = 'Benchmarks the hot pages and jobs and compares the results with a baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per scenario.')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Run only this scenario (repeatable).')
+        parser.add_argument('--output', help='Also write the JSON results to this file.')
+        parser.add_argument('--baseline', help='A previous --output file to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 growth over the baseline, as a fraction.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            setup_test_environment() # Lets the test client use the 'testserver' host.
+        except RuntimeError:
+            pass # Already set up, e.g. when run from the test suite.
+        self.rng = random.Random(options['seed'])
+        self.load_fixtures()
+
+        outbox_before = OutboxMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        started = timezone.now()
+        results = {'dataset': {'bookings': Booking.objects.count(), 'staff': Staff.objects.count(), 'services': Service.objects.count()}, 'scenarios': {}}
+        try:
+            for name in options['scenario'] or SCENARIOS:
+                action = getattr(self, f'make_{name}')()
+                results['scenarios'][name] = summarize(*measure(action, options['requests']))
+        finally:
+            # Leave the database as we found it.
+            StripeEvent.objects.filter(event_id__startswith='evt_bench_').delete()
+            OutboxMessage.objects.filter(id__gt=outbox_before).delete()
+            ReminderJob.objects.filter(sent_at__gte=started).update(sent_at=None)
+
+        report = json.dumps(results, indent=2)
+        self.stdout.write(report)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                problems = find_regressions(results, json.load(baseline), options['tolerance'])
+            if problems:
+                raise CommandError('Performance regressed:\n' + '\n'.join(problems))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def load_fixtures(self):
+        """Picks the services, staff and the busiest customer the scenarios use."""
+        self.services = list(Service.objects.filter(is_active=True).prefetch_related('staff_members'))
+        self.services = [service for service in self.services if service.staff_members.all()]
+        busiest = Booking.objects.values('customer').annotate(total=Count('id')).order_by('-total').first()
+        self.staff_member = Staff.objects.select_related('user_profile__user').annotate(total=Count('bookings')).order_by('-total').first()
+        if not self.services or not busiest or not self.staff_member:
+            raise CommandError('Not enough data to benchmark. Run generate_salon_data first.')
+        self.customer_id = busiest['customer']
+
+    def logged_in_client(self, user_id):
+        client = Client()
+        client.force_login(User.objects.get(pk=user_id))
+        return client
+
+    def make_home(self):
+        client, url = Client(), reverse('booking:home')
+        return lambda: self.expect_ok(client.get(url))
+
+    def make_booking_slots(self):
+        client = self.logged_in_client(self.customer_id)
+        today = timezone.localdate()
+
+        def action():
+            # A different service, stylist and day each time, like real traffic.
+            service = self.rng.choice(self.services)
+            staff = self.rng.choice(list(service.staff_members.all()))
+            day = today + timedelta(days=self.rng.randint(1, 14))
+            self.expect_ok(client.get(reverse('booking:book_service', args=[service.id]), {'staff': staff.id, 'date': day.isoformat()}))
+        return action
+
+    def make_slot_window(self):
+        client = self.logged_in_client(self.customer_id)
+        today = timezone.localdate()
+
+        def action():
+            # The JSON the booking form fetches when the stylist or date changes.
+            service = self.rng.choice(self.services)
+            staff = self.rng.choice(list(service.staff_members.all()))
+            day = today + timedelta(days=self.rng.randint(1, 14))
+            self.expect_ok(client.get(reverse('booking:slot_window', args=[service.id]), {'staff': staff.id, 'start': day.isoformat()}))
+        return action
+
+    def make_my_bookings(self):
+        client, url = self.logged_in_client(self.customer_id), reverse('booking:my_bookings')
+        return lambda: self.expect_ok(client.get(url))
+
+    def make_staff_dashboard(self):
+        client, url = self.logged_in_client(self.staff_member.user_profile.user_id), reverse('booking:staff_dashboard')
+        return lambda: self.expect_ok(client.get(url))
+
+    def make_stripe_webhook(self):
+        client, url = Client(), reverse('booking:stripe_webhook')
+
+        def action():
+            payload = json.dumps({'id': f'evt_bench_{uuid.uuid4().hex}', 'object': 'event', 'type': 'checkout.session.completed', 'data': {'object': {'metadata': {}}}})
+            self.expect_ok(client.post(url, data=payload, content_type='application/json', HTTP_STRIPE_SIGNATURE=self.sign(payload)))
+        return action
+
+    def make_send_reminders(self):
+        return lambda: call_command('send_reminders', stdout=io.StringIO())
+
+    def sign(self, payload):
+        """A valid Stripe-Signature header, so the webhook runs its real verification."""
+        timestamp = int(time.time())
+        signature = hmac.new(settings.STRIPE_WEBHOOK_SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return f't={timestamp},v1={signature}'
+
+    def expect_ok(self, response):
+        if response.status_code != 200:
+            raise CommandError(f'{response.request["PATH_INFO"]} answered {response.status_code}.')
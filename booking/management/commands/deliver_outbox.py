@@ -0,0 +1,33 @@
+# booking/management/commands/deliver_outbox.py
+
+import time
+from django.core.management.base import BaseCommand
+from booking.emails import claim_outbox_batch, deliver_outbox_batch, open_mail_connection
+
+# A long-running worker that sends the emails queued in the outbox.
+# Run one or more of these next to the web server; use --once from cron or tests.
+class Command(BaseCommand):
+    help = 'Delivers queued outbox emails in batches, retrying failures with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages claimed per batch.')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Deliver everything that is due, then exit.')
+
+    def handle(self, *args, **options):
+        connection = open_mail_connection() # One connection, reused for every batch.
+        try:
+            while True:
+                messages = claim_outbox_batch(options['batch_size'])
+                if messages:
+                    sent, failed = deliver_outbox_batch(messages, connection)
+                    style = self.style.SUCCESS if not failed else self.style.WARNING
+                    self.stdout.write(style(f'Delivered {sent}, failed {failed}.'))
+                    continue # There may be more waiting; don't sleep yet.
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
@@ -0,0 +1,30 @@
+# booking/management/commands/export_availability.py
+
+import csv
+import json
+from django.core.management.base import BaseCommand
+from booking.schedules import EXPORT_FIELDS, export_rows
+
+# Writes every staff member's weekly hours as CSV or JSON Lines, row by row,
+# in the format import_availability reads back.
+class Command(BaseCommand):
+    help = 'Exports staff working hours (Availability) as CSV or JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+        parser.add_argument('--output', help='File to write; defaults to standard output.')
+
+    def handle(self, *args, **options):
+        output = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        try:
+            if options['format'] == 'csv':
+                writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS, lineterminator='\n')
+                writer.writeheader()
+                for row in export_rows():
+                    writer.writerow(row)
+            else:
+                for row in export_rows():
+                    output.write(json.dumps(row) + '\n')
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,161 @@
+# booking/management/commands/generate_salon_data.py
+
+import random
+from itertools import accumulate
+from datetime import datetime, time, timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from booking.booking_logic import BOOKING_HOLD_MINUTES
+from booking.catalog import bump_catalog_version
+from booking.models import Availability, Booking, ReminderJob, Service, Staff, UserProfile
+from booking.reminders import reminder_jobs_for
+
+# Every generated user's username starts with this, so --clear can find them.
+PREFIX = 'salon_'
+SERVICE_NAMES = ['Cut', 'Cut & Blow-dry', 'Colour', 'Highlights', 'Balayage', 'Beard Trim', 'Perm', 'Keratin', 'Kids Cut', 'Updo', 'Toner', 'Fringe Trim']
+DURATIONS = [30, 45, 60, 60, 90, 120]
+
+# Fills the database with a realistic salon: staff with weekly hours, a menu
+# of services and a long booking history (plus the coming weeks), for the
+# bench_suite command and for trying out changes against a big dataset.
+class Command(BaseCommand):
+    help = 'Generates synthetic staff, services, customers and bookings for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--staff', type=int, default=20)
+        parser.add_argument('--services', type=int, default=12)
+        parser.add_argument('--customers', type=int, default=5000)
+        parser.add_argument('--bookings', type=int, default=200000, help='Bookings to create; history goes back as far as needed.')
+        parser.add_argument('--future-days', type=int, default=30, help='Days ahead that already have bookings.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk INSERT.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated data first.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['clear']:
+            self.clear()
+        with transaction.atomic():
+            staff = self.create_staff(options['staff'], rng)
+            services = self.create_services(options['services'], staff, rng)
+            customers = self.create_customers(options['customers'], options['batch_size'])
+        created = self.create_bookings(staff, services, customers, options, rng)
+
+        # bulk_create skips the signals that keep the caches fresh.
+        bump_catalog_version()
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(staff)} staff, {len(services)} services, {len(customers)} customers and {created} bookings.'
+        ))
+
+    def clear(self):
+        # Deleting the users cascades to their profiles, staff rows and bookings.
+        User.objects.filter(username__startswith=PREFIX).delete()
+        Service.objects.filter(description__startswith=PREFIX).delete()
+
+    def create_staff(self, count, rng):
+        password = make_password(None) # Generated accounts cannot log in.
+        users = User.objects.bulk_create([
+            User(username=f'{PREFIX}staff_{i}', first_name=f'Stylist {i}', password=password) for i in range(count)
+        ])
+        profiles = UserProfile.objects.bulk_create([UserProfile(user=user, user_type='staff') for user in users])
+        staff = Staff.objects.bulk_create([Staff(user_profile=profile) for profile in profiles])
+        hours = []
+        for member in staff:
+            start = rng.choice((8, 9, 10))
+            # Everyone works six days a week, with a different day off.
+            day_off = rng.randrange(7)
+            hours += [
+                Availability(staff=member, day_of_week=day, start_time=time(start), end_time=time(start + 9))
+                for day in range(7) if day != day_off
+            ]
+        Availability.objects.bulk_create(hours)
+        return staff
+
+    def create_services(self, count, staff, rng):
+        services = Service.objects.bulk_create([
+            Service(
+                name=SERVICE_NAMES[i % len(SERVICE_NAMES)] + (f' {i // len(SERVICE_NAMES) + 1}' if i >= len(SERVICE_NAMES) else ''),
+                description=f'{PREFIX}generated', duration_minutes=rng.choice(DURATIONS), price=rng.choice((25, 40, 60, 85, 120)),
+            )
+            for i in range(count)
+        ])
+        for service in services:
+            service.staff_members.add(*rng.sample(staff, max(1, len(staff) // 2)))
+        return services
+
+    def create_customers(self, count, batch_size):
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(username=f'{PREFIX}customer_{i}', email=f'{PREFIX}customer_{i}@example.com', first_name=f'Customer {i}', password=password)
+            for i in range(count)
+        ], batch_size=batch_size)
+        UserProfile.objects.bulk_create([UserProfile(user=user, user_type='customer') for user in users], batch_size=batch_size)
+        return users
+
+    def create_bookings(self, staff, services, customers, options, rng):
+        """Walks back day by day from the end of the future window, filling each working day."""
+        tz = timezone.get_current_timezone()
+        now = timezone.now()
+        today = timezone.localdate()
+        hours = {(a.staff_id, a.day_of_week): (a.start_time, a.end_time) for a in Availability.objects.filter(staff__in=staff)}
+        services_by_id = {service.id: service for service in services}
+        offered = {member.id: [] for member in staff}
+        for staff_id, service_id in Service.staff_members.through.objects.filter(service__in=services).values_list('staff_id', 'service_id'):
+            offered[staff_id].append(services_by_id[service_id])
+        # Customers are not equally loyal: a few regulars make most bookings.
+        # Cumulative weights make each pick a binary search instead of a full sum.
+        cum_weights = list(accumulate((rank + 1) ** -0.5 for rank in range(len(customers))))
+
+        batch, created = [], 0
+        day = today + timedelta(days=options['future_days'] - 1)
+        while created + len(batch) < options['bookings']:
+            for member in staff:
+                working = hours.get((member.id, day.weekday()))
+                if not working or not offered[member.id]:
+                    continue
+                current = datetime.combine(day, working[0], tzinfo=tz)
+                closing = datetime.combine(day, working[1], tzinfo=tz)
+                while created + len(batch) < options['bookings']:
+                    service = rng.choice(offered[member.id])
+                    end = current + timedelta(minutes=service.duration_minutes)
+                    if end > closing:
+                        break
+                    if rng.random() < 0.2: # A gap in the diary.
+                        current += timedelta(minutes=15)
+                        continue
+                    status, hold = self.pick_status(current, now, rng)
+                    batch.append(Booking(
+                        customer=rng.choices(customers, cum_weights=cum_weights)[0], staff=member, service=service,
+                        start_time=current, end_time=end, status=status, hold_expires_at=hold,
+                    ))
+                    current = end
+            if len(batch) >= options['batch_size']:
+                self.save_bookings(batch, now)
+                created += len(batch)
+                batch = []
+            day -= timedelta(days=1)
+        self.save_bookings(batch, now)
+        return created + len(batch)
+
+    def save_bookings(self, batch, now):
+        Booking.objects.bulk_create(batch)
+        # Upcoming confirmed bookings get their reminder job, as they would when confirmed.
+        ReminderJob.objects.bulk_create(reminder_jobs_for(batch, now))
+
+    def pick_status(self, start, now, rng):
+        """A status (and hold expiry for pending bookings) that is plausible for the time."""
+        roll = rng.random()
+        if start >= now:
+            if roll < 0.04:
+                return 'pending', now + timedelta(minutes=rng.randrange(1, BOOKING_HOLD_MINUTES))
+            return ('cancelled', None) if roll < 0.1 else ('confirmed', None)
+        if roll < 0.02:
+            return 'pending', start - timedelta(days=1) # An abandoned checkout.
+        if roll < 0.15:
+            return 'cancelled', None
+        return ('confirmed', None) if roll < 0.2 else ('completed', None)
@@ -0,0 +1,45 @@
+# booking/management/commands/import_availability.py
+
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from booking.schedules import plan_import, save_availability
+
+# Loads a season's working hours for many staff at once. The whole file is
+# checked before anything is written, and then applied in one transaction.
+#
+#   staff,day_of_week,start_time,end_time
+#   anna,Monday,09:00,17:00
+class Command(BaseCommand):
+    help = 'Imports staff working hours from CSV or JSON Lines (see export_availability).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The file to import.')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Defaults to the file extension.')
+        parser.add_argument('--replace', action='store_true', help='Delete days that are not in the file, for the staff it lists.')
+        parser.add_argument('--dry-run', action='store_true', help='Check the file and report the changes without saving them.')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.json')) else 'csv')
+        with open(options['path'], newline='') as source:
+            if file_format == 'csv':
+                rows = csv.DictReader(source)
+            else:
+                rows = (self.parse_json_line(line) for line in source if line.strip())
+            to_save, to_delete, errors = plan_import(rows, replace=options['replace'])
+
+        if errors:
+            raise CommandError('Nothing was imported:\n' + '\n'.join(errors))
+        created = sum(1 for availability in to_save if availability.pk is None)
+        summary = f'{created} created, {len(to_save) - created} updated, {len(to_delete)} deleted'
+        if options['dry_run']:
+            self.stdout.write(f'Dry run: {summary}.')
+            return
+        save_availability(to_save, to_delete)
+        self.stdout.write(self.style.SUCCESS(f'Imported availability: {summary}.'))
+
+    def parse_json_line(self, line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return {} # Reported as a row with missing fields.
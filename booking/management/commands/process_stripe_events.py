@@ -0,0 +1,28 @@
+# booking/management/commands/process_stripe_events.py
+
+import time
+from django.core.management.base import BaseCommand
+from booking.stripe_events import process_stripe_events
+
+# A long-running worker that applies the Stripe events the webhook stored.
+# Use --once to work through a backlog (e.g. after a replay) and exit.
+class Command(BaseCommand):
+    help = 'Processes stored Stripe webhook events in the order they arrived.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Events applied per transaction.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when there is nothing to do.')
+        parser.add_argument('--once', action='store_true', help='Process everything stored so far, then exit.')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                processed = process_stripe_events(options['batch_size'])
+                if processed:
+                    self.stdout.write(self.style.SUCCESS(f'Processed {processed} events.'))
+                    continue # There may be more waiting; don't sleep yet.
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,38 @@
+# booking/management/commands/reap_pending_bookings.py
+
+import time
+from django.core.management.base import BaseCommand
+from booking.booking_logic import PENDING_BOOKING_TTL_MINUTES, reap_abandoned_bookings
+
+# Deletes the 'pending' bookings left behind by abandoned Stripe checkouts.
+# Run it from cron, or with --loop as a long-running worker.
+class Command(BaseCommand):
+    help = 'Deletes abandoned pending bookings in small chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-minutes', type=int, default=PENDING_BOOKING_TTL_MINUTES, help='Age after which a pending booking is abandoned.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to wait between chunks, so other writers get the lock.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, reaping every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=300.0, help='Seconds between runs in --loop mode.')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                removed = self.reap(options)
+                self.stdout.write(self.style.SUCCESS(f'Removed {removed} abandoned pending booking(s).'))
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def reap(self, options):
+        """One run: delete chunk after chunk until nothing is left."""
+        total = 0
+        while True:
+            removed = reap_abandoned_bookings(options['ttl_minutes'], options['chunk_size'])
+            total += removed
+            if removed < options['chunk_size']:
+                return total
+            time.sleep(options['pause'])
@@ -1,45 +1,66 @@
 # booking/management/commands/send_reminders.py
 
+import time
+from concurrent.futures import ThreadPoolExecutor
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from datetime import timedelta
-from booking.models import Booking
-from booking.emails import send_booking_email
+from booking.reminders import next_reminder_due, send_due_reminders
 
 # By creating a file in this specific folder and naming the class "Command",
 # Django automatically makes it runnable from the command line.
+# Reminders are written to the email outbox; the deliver_outbox worker sends them.
+#
+# Each confirmed booking has a ReminderJob row that says when its reminder is
+# due (see booking/reminders.py). This command only looks at the jobs that are
+# due and marks them sent as it queues them, so running it from cron every few
+# minutes (or several copies at once) never sends a reminder twice. With
+# --daemon it keeps running and sleeps until the next reminder is due.
+#
+# Old cron lines written for the earlier bulk mode still work: --chunk-size
+# is another name for --batch-size, and --bulk is accepted but changes
+# nothing, because every run now claims and queues its jobs in batches.
 class Command(BaseCommand):
     # This is a helpful description of what the command does.
-    help = 'Sends email reminders for bookings that are 24-48 hours away.'
+    help = 'Queues the email reminders that are due.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', '--chunk-size', type=int, default=200, help='Jobs claimed (and emails queued) per transaction.')
+        parser.add_argument('--bulk', action='store_true', help='No longer needed (every run works in batches); kept so old cron lines still run.')
+        parser.add_argument('--workers', type=int, default=1, help='Threads used to render emails.')
+        parser.add_argument('--daemon', action='store_true', help='Keep running, waking up when the next reminder is due.')
+        parser.add_argument('--max-sleep', type=float, default=60.0, help='Longest nap in --daemon mode, so newly booked reminders are noticed.')
 
     def handle(self, *args, **options):
         """The main logic of the script goes in this 'handle' method."""
-        
-        now = timezone.now()
-        # We define a time window: we're looking for appointments that are
-        # more than 24 hours away but less than 48 hours away.
-        reminder_start_time = now + timedelta(hours=24)
-        reminder_end_time = now + timedelta(hours=48)
-
-        # This is a database query. It asks the Booking model to find all confirmed
-        # bookings that fall within our specific time window.
-        bookings_to_remind = Booking.objects.filter(
-            start_time__gte=reminder_start_time,
-            start_time__lt=reminder_end_time,
-            status='confirmed'
-        )
-
-        # This will print a status message to the console when the script runs.
-        self.stdout.write(f'Found {bookings_to_remind.count()} bookings to remind...')
-
-        # We loop through each booking that the database found.
-        for booking in bookings_to_remind:
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            # Rendering only uses data that is already loaded, so threads are safe here.
+            render = pool.map if options['workers'] > 1 else map
             try:
-                # We reuse the same email function from before, but this time
-                # we tell it to use the 'reminder' templates.
-                send_booking_email(booking, 'reminder')
-                self.stdout.write(self.style.SUCCESS(f'Successfully sent reminder for booking #{booking.id}'))
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Failed to send reminder for booking #{booking.id}: {e}'))
+                while True:
+                    queued, skipped = self.send_due(options['batch_size'], render)
+                    if not options['daemon']:
+                        self.stdout.write(self.style.SUCCESS(f'Reminder process complete: {queued} queued, {skipped} skipped.'))
+                        break
+                    time.sleep(self.seconds_until_next(options['max_sleep']))
+            except KeyboardInterrupt:
+                pass
+
+    def send_due(self, batch_size, render):
+        """Queues every due reminder, one batch per transaction. Returns (queued, skipped)."""
+        total_queued = total_skipped = 0
+        while True:
+            started = time.perf_counter()
+            queued, skipped = send_due_reminders(batch_size, render)
+            if queued or skipped:
+                self.stdout.write(f'Queued {queued} reminder(s), skipped {skipped} in {time.perf_counter() - started:.2f}s')
+            total_queued += queued
+            total_skipped += skipped
+            if queued + skipped < batch_size:
+                return total_queued, total_skipped
 
-        self.stdout.write(self.style.SUCCESS('Reminder process complete.'))
+    def seconds_until_next(self, max_sleep):
+        due_at = next_reminder_due()
+        if due_at is None:
+            return max_sleep
+        # Never less than a moment: a due job another worker holds must not make us spin.
+        return min(max_sleep, max(0.5, (due_at - timezone.now()).total_seconds()))
@@ -0,0 +1,78 @@
+# booking/middleware.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from .roles import get_staff_member, get_user_role
+from .routers import _pinned, _wrote
+
+# The cookie that keeps a browser on the primary database right after it wrote.
+PIN_COOKIE = 'db_pin'
+REPLICA_PIN_SECONDS = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+class ReplicaPinningMiddleware:
+    """Gives each request a clean routing state and makes recent writers read the primary.
+
+    A request that writes gets a short-lived cookie; while it is present,
+    the browser's requests skip the replica, so the page after a booking or
+    cancellation never shows data from before it (replication lag).
+    """
+
+    sync_capable = True
+    async_capable = True # So async views under ASGI never get pushed onto a worker thread.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pinned_token = _pinned.set(request.COOKIES.get(PIN_COOKIE) == '1')
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            self.pin_if_written(response)
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+        return response
+
+    async def __acall__(self, request):
+        pinned_token = _pinned.set(request.COOKIES.get(PIN_COOKIE) == '1')
+        wrote_token = _wrote.set(False)
+        try:
+            response = await self.get_response(request)
+            self.pin_if_written(response)
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+        return response
+
+    def pin_if_written(self, response):
+        if _wrote.get():
+            response.set_cookie(PIN_COOKIE, '1', max_age=REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+
+
+class StaffMemberMiddleware:
+    """Adds request.user_role and request.staff_member, both resolved lazily.
+
+    request.user_role is 'staff', 'customer' or None, and comes from the
+    session after the first request. request.staff_member is the Staff row
+    (or None), loaded with its profile in one query and only when used.
+    Put it after AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Only the attributes are set here; nothing touches the database until they are used.
+        request.user_role = SimpleLazyObject(lambda: get_user_role(request))
+        request.staff_member = SimpleLazyObject(lambda: get_staff_member(request))
+        return self.get_response(request) # A coroutine when the chain is async; the caller awaits it.
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:12
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def hold_existing_pending_bookings(apps, schema_editor):
+    # Pending bookings made before holds existed get the default hold window,
+    # counted from when they were created.
+    Booking = apps.get_model('booking', 'Booking')
+    # using(): run against the database being migrated, not wherever the router points.
+    Booking.objects.using(schema_editor.connection.alias).filter(status='pending', hold_expires_at__isnull=True).update(
+        hold_expires_at=models.F('created_at') + timedelta(minutes=31)
+    )
+
+
+def resolve_duplicate_active_bookings(apps, schema_editor):
+    # Bookings made before the constraint may share a live (staff, start_time).
+    # Keep one row per slot: the confirmed one, or else the oldest pending
+    # one; the other pending rows are cancelled (nobody paid for them). Two
+    # confirmed rows on one slot are two paying customers, which needs a
+    # person, so the migration stops and lists them instead.
+    Booking = apps.get_model('booking', 'Booking')
+    active = Booking.objects.using(schema_editor.connection.alias).filter(status__in=['pending', 'confirmed'])
+    duplicated = (
+        active.values('staff_id', 'start_time').annotate(rows=models.Count('id')).filter(rows__gt=1).values_list('staff_id', 'start_time')
+    )
+    slots = defaultdict(list)
+    for slot in duplicated:
+        for booking_id, status in active.filter(staff_id=slot[0], start_time=slot[1]).order_by('created_at', 'id').values_list('id', 'status'):
+            slots[slot].append((booking_id, status))
+    clashes = [
+        f"staff {staff_id} at {start_time:%Y-%m-%d %H:%M}: bookings {', '.join(str(booking_id) for booking_id, _ in rows)}"
+        for (staff_id, start_time), rows in slots.items() if sum(status == 'confirmed' for _, status in rows) > 1
+    ]
+    if clashes:
+        raise RuntimeError(
+            'Several confirmed bookings share a slot; cancel or move all but one of each, then migrate again:\n  ' + '\n  '.join(clashes)
+        )
+    extra = []
+    for rows in slots.values():
+        keep = next((booking_id for booking_id, status in rows if status == 'confirmed'), rows[0][0])
+        extra += [booking_id for booking_id, _ in rows if booking_id != keep]
+    active.filter(id__in=extra, status='pending').update(status='cancelled', hold_expires_at=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(hold_existing_pending_bookings, migrations.RunPython.noop),
+        migrations.RunPython(resolve_duplicate_active_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'confirmed'])), fields=('staff', 'start_time'), name='unique_active_booking_slot'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def start_from_created_at(apps, schema_editor):
+    # Existing bookings count as last changed when they were created.
+    Booking = apps.get_model('booking', 'Booking')
+    Booking.objects.using(schema_editor.connection.alias).update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0005_stripeevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(start_from_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['staff', 'updated_at'], name='booking_staff_updated'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0008_booking_start_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('bookings', models.IntegerField(default=0)),
+                ('booked_minutes', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('available_minutes', models.IntegerField(default=0)),
+                ('service', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='booking.service')),
+                ('staff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='booking.staff')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='rollup_day')],
+                'constraints': [models.UniqueConstraint(fields=('staff', 'service', 'day'), name='unique_rollup_service_day'), models.UniqueConstraint(condition=models.Q(('service__isnull', True)), fields=('staff', 'day'), name='unique_rollup_available_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:42
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def schedule_upcoming_reminders(apps, schema_editor):
+    # Confirmed bookings whose reminder is still ahead get a job, so nobody
+    # loses their reminder when send_reminders switches to the job queue.
+    Booking = apps.get_model('booking', 'Booking')
+    ReminderJob = apps.get_model('booking', 'ReminderJob')
+    alias = schema_editor.connection.alias
+    lead = timedelta(hours=getattr(settings, 'REMINDER_HOURS_BEFORE', 24))
+    bookings = Booking.objects.using(alias).filter(status='confirmed', start_time__gt=timezone.now() + lead).values_list('id', 'start_time')
+    ReminderJob.objects.using(alias).bulk_create(
+        [ReminderJob(booking_id=booking_id, due_at=start_time - lead) for booking_id, start_time in bookings.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0009_dailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_at', models.DateTimeField()),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('booking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_job', to='booking.booking')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['due_at'], name='reminder_due')],
+            },
+        ),
+        migrations.RunPython(schedule_upcoming_reminders, migrations.RunPython.noop),
+    ]
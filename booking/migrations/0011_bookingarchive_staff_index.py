@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0010_reminderjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookingarchive',
+            index=models.Index(fields=['staff', 'start_time', 'id'], name='booking_archive_staff_start'),
+        ),
+    ]
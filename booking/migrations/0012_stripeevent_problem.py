@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0011_bookingarchive_staff_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeevent',
+            name='problem',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -1,6 +1,8 @@
 # booking/models.py
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User # Django's built-in user system
+from django.utils import timezone
 from datetime import timedelta
 
 # We extend Django's User to add a 'role' to each person.
@@ -50,10 +52,150 @@ class Booking(models.Model):
     end_time = models.DateTimeField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Changes on every save(). queryset.update() skips auto_now, so bulk
+    # updates must set it themselves (schedule sync relies on it).
+    updated_at = models.DateTimeField(auto_now=True)
     stripe_session_id = models.CharField(max_length=255, blank=True, null=True)
-    
+    # A 'pending' booking holds its slot until this time, giving the customer a
+    # short window to pay. Expired holds no longer block the slot.
+    hold_expires_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Slot lookups, overlap checks and the staff dashboard.
+            models.Index(fields=['staff', 'status', 'start_time'], name='booking_staff_status_start'),
+            # A customer's upcoming and past bookings.
+            models.Index(fields=['customer', 'start_time'], name='booking_customer_start'),
+            # The reminder window, which looks at every customer at once.
+            models.Index(fields=['status', 'start_time'], name='booking_status_start'),
+            # Incremental schedule sync ("what changed since ...?").
+            models.Index(fields=['staff', 'updated_at'], name='booking_staff_updated'),
+            # The admin's newest-first list and its date hierarchy.
+            models.Index(fields=['start_time'], name='booking_start'),
+        ]
+        constraints = [
+            # The database itself refuses two live bookings for the same staff member and start time.
+            # Overlaps with different start times are only kept out by reserve_slot's check.
+            models.UniqueConstraint(fields=['staff', 'start_time'], condition=Q(status__in=['pending', 'confirmed']), name='unique_active_booking_slot'),
+        ]
+
     # We override the save method to automatically calculate the end time.
     def save(self, *args, **kwargs):
         if not self.end_time: self.end_time = self.start_time + timedelta(minutes=self.service.duration_minutes)
         super().save(*args, **kwargs)
-    def __str__(self): return f"Booking for {self.service.name} with {self.staff} on {self.start_time.strftime('%Y-%m-%d %H:%M')}"
\ No newline at end of file
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Where the booking was when loaded, so moving it also invalidates the
+        # slots of the day it left (see signals.invalidate_booking_days).
+        loaded = instance.__dict__
+        instance._loaded_slot = (loaded.get('staff_id'), loaded.get('start_time'), loaded.get('end_time'))
+        return instance
+
+    def __str__(self): return f"Booking for {self.service.name} with {self.staff} on {self.start_time.strftime('%Y-%m-%d %H:%M')}"
+
+# An email waiting to be delivered. Emails are written here in the same
+# transaction as the change that causes them, and the deliver_outbox command
+# sends them in the background, so no web request ever waits on the mail server.
+class OutboxMessage(models.Model):
+    STATUS_CHOICES = [('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')]
+    booking = models.ForeignKey(Booking, on_delete=models.SET_NULL, blank=True, null=True, related_name='outbox_messages')
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to_email = models.CharField(max_length=254)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # When a worker may next try this message; pushed forward when it is
+    # claimed and after every failure (backoff).
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='outbox_due')]
+    def __str__(self): return f"{self.subject} to {self.to_email} ({self.status})"
+
+
+# The reminder email a confirmed booking is owed, and when it is due.
+# Jobs are made when a booking is confirmed and removed if it is cancelled
+# (see reminders.py); send_reminders claims the due ones, queues their
+# emails and stamps sent_at, so no reminder is ever sent twice.
+class ReminderJob(models.Model):
+    booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name='reminder_job')
+    due_at = models.DateTimeField()
+    sent_at = models.DateTimeField(blank=True, null=True)
+    class Meta:
+        # Only unsent jobs are ever looked up by due time, so only they are indexed.
+        indexes = [models.Index(fields=['due_at'], condition=Q(sent_at__isnull=True), name='reminder_due')]
+    def __str__(self): return f"Reminder for booking #{self.booking_id} due {self.due_at}"
+
+
+# Every Stripe webhook event we have accepted, keyed by Stripe's event id.
+# The webhook only records the event (a duplicate delivery fails the unique
+# insert) and the process_stripe_events worker applies them in order.
+class StripeEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    # Why the event could not be applied (e.g. the booking was gone), for follow-up.
+    problem = models.CharField(max_length=255, blank=True)
+    class Meta:
+        indexes = [
+            # Keeps "what is left to process?" cheap however long the log grows.
+            models.Index(fields=['id'], condition=Q(processed_at__isnull=True), name='stripe_event_unprocessed'),
+        ]
+    def __str__(self): return f"{self.event_type} ({self.event_id})"
+
+
+# Old bookings, moved out of the Booking table by the archive_bookings
+# command so the live table (and its indexes) only holds recent and future
+# appointments. Rows keep their original Booking id.
+class BookingArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_bookings')
+    staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='archived_bookings')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='archived_bookings')
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Booking.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    stripe_session_id = models.CharField(max_length=255, blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [
+            # A customer's booking history, newest first. The id is part of the
+            # key because here it is not SQLite's rowid, and pages sort on it.
+            models.Index(fields=['customer', 'start_time', 'id'], name='booking_archive_customer_start'),
+            # A staff member's calendar feed, which includes archived bookings.
+            models.Index(fields=['staff', 'start_time', 'id'], name='booking_archive_staff_start'),
+        ]
+    def __str__(self): return f"Archived booking for {self.service.name} with {self.staff} on {self.start_time.strftime('%Y-%m-%d %H:%M')}"
+
+
+# Per-day totals for reports, so they never aggregate the raw Booking table.
+# One row per staff member, service and day holds the bookings that count
+# (confirmed or completed), their minutes and their revenue; the row with no
+# service holds the staff member's available (working) minutes that day.
+# Status changes update the rows as they happen (see rollups.py) and the
+# backfill_rollups command recomputes them from the bookings.
+class DailyRollup(models.Model):
+    staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='daily_rollups')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, blank=True, null=True, related_name='daily_rollups')
+    day = models.DateField()
+    bookings = models.IntegerField(default=0)
+    booked_minutes = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    available_minutes = models.IntegerField(default=0)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['staff', 'service', 'day'], name='unique_rollup_service_day'),
+            # NULLs never clash in a unique constraint, so the available-time rows need their own.
+            models.UniqueConstraint(fields=['staff', 'day'], condition=Q(service__isnull=True), name='unique_rollup_available_day'),
+        ]
+        indexes = [models.Index(fields=['day'], name='rollup_day')]
+    def __str__(self): return f"{self.staff} / {self.service or 'available'} on {self.day}"
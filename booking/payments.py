@@ -0,0 +1,102 @@
+# booking/payments.py
+"""
+Calls to Stripe from async views.
+
+Creating a checkout session is a network round trip to Stripe. The async
+booking view awaits it instead of blocking a worker, so under ASGI a slow
+payment provider only leaves requests waiting, not workers stuck.
+
+Each process has one StripeClient on top of a pooled httpx client (so
+connections to Stripe are reused across requests) and a semaphore that caps
+how many Stripe calls are in flight. When the cap is reached, new calls
+wait up to STRIPE_QUEUE_TIMEOUT_SECONDS and then fail with
+PaymentProviderBusy instead of piling up.
+
+httpx connections and asyncio semaphores belong to a single event loop,
+while under WSGI every async view runs in a short-lived loop of its own.
+So the client and the semaphore live on one long-lived loop in a
+background thread, and callers (from whatever loop they are in) hand their
+Stripe calls to it. close_stripe_client() shuts it down at process exit.
+"""
+import asyncio
+import atexit
+import threading
+import stripe
+from django.conf import settings
+from .profiling import outbound_call
+
+# Seconds a single Stripe request may take before it is abandoned.
+STRIPE_TIMEOUT_SECONDS = getattr(settings, 'STRIPE_TIMEOUT_SECONDS', 10)
+# Most Stripe requests in flight at once (per process).
+STRIPE_MAX_CONCURRENT_REQUESTS = getattr(settings, 'STRIPE_MAX_CONCURRENT_REQUESTS', 50)
+# How long a request waits for a free slot before giving up.
+STRIPE_QUEUE_TIMEOUT_SECONDS = getattr(settings, 'STRIPE_QUEUE_TIMEOUT_SECONDS', 5)
+# Where the Stripe API lives; tests point this at a local stub server.
+STRIPE_API_BASE = getattr(settings, 'STRIPE_API_BASE', None)
+
+# (loop, http_client, StripeClient, Semaphore) once the first call starts them.
+_stripe = None
+_stripe_lock = threading.Lock()
+
+
+class PaymentProviderBusy(Exception):
+    """Raised when too many Stripe requests are already in flight."""
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+    loop.close()
+
+
+def _get_stripe():
+    global _stripe
+    with _stripe_lock:
+        if _stripe is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=_run_loop, args=(loop,), name='stripe-client', daemon=True).start()
+            http_client = stripe.HTTPXClient(timeout=STRIPE_TIMEOUT_SECONDS)
+            client = stripe.StripeClient(
+                settings.STRIPE_SECRET_KEY,
+                http_client=http_client,
+                base_addresses={'api': STRIPE_API_BASE} if STRIPE_API_BASE else None,
+            )
+            _stripe = (loop, http_client, client, asyncio.Semaphore(STRIPE_MAX_CONCURRENT_REQUESTS))
+        return _stripe
+
+
+def close_stripe_client():
+    """Closes the pooled Stripe connections and stops their loop. The next call starts afresh."""
+    global _stripe
+    with _stripe_lock:
+        started, _stripe = _stripe, None
+    if started is None:
+        return
+    loop, http_client = started[:2]
+    try:
+        asyncio.run_coroutine_threadsafe(http_client.close_async(), loop).result(STRIPE_TIMEOUT_SECONDS)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(close_stripe_client)
+
+
+async def _create_checkout_session(client, limit, params):
+    # Runs on the Stripe loop, so the semaphore counts every caller in the process.
+    try:
+        await asyncio.wait_for(limit.acquire(), STRIPE_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise PaymentProviderBusy
+    try:
+        return await client.v1.checkout.sessions.create_async(params)
+    finally:
+        limit.release()
+
+
+async def create_checkout_session(params):
+    """Creates a Stripe Checkout Session without blocking the event loop."""
+    loop, _, client, limit = _get_stripe()
+    future = asyncio.run_coroutine_threadsafe(_create_checkout_session(client, limit, params), loop)
+    with outbound_call('stripe'): # Shows up as 'ext' time in the request profile.
+        return await asyncio.wrap_future(future)
@@ -0,0 +1,198 @@
+# booking/profiling.py
+"""
+Lightweight per-request profiling.
+
+ProfilingMiddleware measures a sample of requests: database queries (count
+and time), template rendering and outbound calls such as Stripe. Sampled
+responses get a Server-Timing header, which browsers show in the network
+tab. Requests slower than PROFILING_SLOW_REQUEST_MS, and sampled requests
+that repeat the same query (the N+1 signature), are logged as one JSON
+line on the 'booking.profiling' logger.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+# The share of requests that are profiled (0 turns it off, 1 profiles everything).
+PROFILING_SAMPLE_RATE = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.1)
+# Requests slower than this are always logged, sampled or not.
+PROFILING_SLOW_REQUEST_MS = getattr(settings, 'PROFILING_SLOW_REQUEST_MS', 500)
+# The same SQL this many times in one request is reported as a likely N+1.
+PROFILING_DUPLICATE_QUERIES = getattr(settings, 'PROFILING_DUPLICATE_QUERIES', 3)
+
+# The profile of the request being handled, or None when it was not sampled.
+_current = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """What one request spent its time on, in milliseconds."""
+
+    def __init__(self, measures_db=True):
+        # False when queries run out of the middleware's reach (async views);
+        # the report then leaves database figures out instead of showing zeros.
+        self.measures_db = measures_db
+        self.wrapped_connections = [] # Connections record_query was added to by process_view.
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.outbound_ms = 0.0
+        self.outbound_calls = Counter() # Service name -> calls made.
+        self.queries = Counter() # SQL text (with placeholders) -> times run.
+
+    def record_query(self, execute, sql, params, many, context):
+        """A database execute_wrapper: times every query run on the connection."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+            self.queries[sql] += 1
+
+    def duplicate_queries(self):
+        return [{'sql': sql, 'count': count} for sql, count in self.queries.most_common() if count >= PROFILING_DUPLICATE_QUERIES]
+
+    def server_timing(self, total_ms):
+        query_count = sum(self.queries.values())
+        return ', '.join([
+            *([f'db;dur={self.db_ms:.1f};desc="{query_count} queries"'] if self.measures_db else []),
+            f'tpl;dur={self.template_ms:.1f};desc="Templates"',
+            f'ext;dur={self.outbound_ms:.1f};desc="{sum(self.outbound_calls.values())} outbound calls"',
+            f'total;dur={total_ms:.1f}',
+        ])
+
+
+@contextmanager
+def outbound_call(name):
+    """Wrap calls to other services (e.g. Stripe) so their time shows up in the profile."""
+    profile = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.outbound_ms += (time.perf_counter() - started) * 1000
+            profile.outbound_calls[name] += 1
+
+
+class _TimedTemplate:
+    """Wraps a template so render() time is added to the current profile."""
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return self._template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self._template.render(context, request)
+        finally:
+            profile.template_ms += (time.perf_counter() - started) * 1000
+
+
+class ProfilingDjangoTemplates(DjangoTemplates):
+    """The normal Django template engine, with rendering time recorded for profiling.
+
+    Only the top-level template is wrapped; templates it extends or includes
+    are rendered inside it, so they are counted once.
+    """
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+class ProfilingMiddleware:
+    """Profiles a sample of requests and logs slow ones. Put it first in MIDDLEWARE.
+
+    Under ASGI it stays async too. Database connections belong to a thread,
+    so for sync views process_view (which Django runs in the view's thread)
+    hooks the profile into that thread's connections. Async views make their
+    queries on other worker threads, out of its reach, so they report
+    template and outbound time but leave database figures out. Queries run while a
+    StreamingHttpResponse is being sent (the calendar feeds) happen after
+    the middleware has returned, so they are not counted on either path.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        if random.random() >= PROFILING_SAMPLE_RATE:
+            return self.finish(request, self.get_response(request), started, None)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, started, profile)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        if random.random() >= PROFILING_SAMPLE_RATE:
+            return self.finish(request, await self.get_response(request), started, None)
+
+        profile = RequestProfile(measures_db=False)
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+            for connection in profile.wrapped_connections:
+                connection.execute_wrappers.remove(profile.record_query)
+        return self.finish(request, response, started, profile)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Only needed on the async path: __call__ already wraps the connections.
+        profile = _current.get()
+        if profile is None or profile.measures_db or iscoroutinefunction(view_func):
+            return None
+        # Runs in the thread the sync view will run in, so these are its connections.
+        for connection in connections.all():
+            connection.execute_wrappers.append(profile.record_query)
+            profile.wrapped_connections.append(connection)
+        profile.measures_db = True
+        return None
+
+    def finish(self, request, response, started, profile):
+        total_ms = (time.perf_counter() - started) * 1000
+        if profile is not None:
+            response['Server-Timing'] = profile.server_timing(total_ms)
+        if total_ms > PROFILING_SLOW_REQUEST_MS or (profile is not None and profile.duplicate_queries()):
+            self.log(request, response, total_ms, profile)
+        return response
+
+    def log(self, request, response, total_ms, profile):
+        entry = {'method': request.method, 'path': request.path, 'status': response.status_code, 'total_ms': round(total_ms, 1), 'sampled': profile is not None}
+        if profile is not None:
+            entry.update(template_ms=round(profile.template_ms, 1), outbound_ms=round(profile.outbound_ms, 1), outbound_calls=dict(profile.outbound_calls))
+            if profile.measures_db:
+                entry.update(queries=sum(profile.queries.values()), db_ms=round(profile.db_ms, 1), duplicate_queries=profile.duplicate_queries())
+        logger.warning(json.dumps(entry))
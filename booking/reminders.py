@@ -0,0 +1,80 @@
+# booking/reminders.py
+"""
+The reminder email queue (ReminderJob).
+
+A confirmed booking gets one job, due REMINDER_HOURS_BEFORE hours before
+the appointment; cancelling the booking removes it. Every place that
+changes a booking's status calls sync_reminder_jobs() in the same
+transaction. send_due_reminders() then claims a batch of due jobs, writes
+their emails to the outbox and stamps them sent, all in one transaction,
+so each reminder is queued exactly once however often it runs, and each
+run only touches the jobs that are actually due.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .db import retry_on_lock
+from .emails import render_booking_email
+from .models import OutboxMessage, ReminderJob
+
+# How long before the appointment the reminder goes out.
+REMINDER_HOURS_BEFORE = getattr(settings, 'REMINDER_HOURS_BEFORE', 24)
+
+
+def reminder_jobs_for(bookings, now=None):
+    """Unsaved jobs for the bookings that are confirmed and whose reminder is still ahead."""
+    now = now or timezone.now()
+    lead = timedelta(hours=REMINDER_HOURS_BEFORE)
+    return [
+        ReminderJob(booking_id=booking.id, due_at=booking.start_time - lead)
+        for booking in bookings if booking.status == 'confirmed' and booking.start_time - lead > now
+    ]
+
+
+def sync_reminder_jobs(bookings, now=None):
+    """Makes the bookings' reminder jobs match their current status and start time.
+
+    Confirmed bookings get a job (or have its due time moved); the unsent
+    jobs of every other booking are deleted. Bookings booked too close to
+    their appointment for a reminder get none. At most two queries.
+    """
+    bookings = list(bookings)
+    jobs = reminder_jobs_for(bookings, now)
+    scheduled = {job.booking_id for job in jobs}
+    unscheduled = [booking.id for booking in bookings if booking.id not in scheduled]
+    if unscheduled:
+        ReminderJob.objects.filter(booking_id__in=unscheduled, sent_at__isnull=True).delete()
+    if jobs:
+        ReminderJob.objects.bulk_create(jobs, update_conflicts=True, unique_fields=['booking'], update_fields=['due_at'])
+
+
+@retry_on_lock
+def send_due_reminders(batch_size=200, render=map, now=None):
+    """Claims up to batch_size due jobs, queues their emails and marks them sent.
+
+    Rows locked by another worker are skipped (SKIP LOCKED on PostgreSQL;
+    SQLite has a single writer anyway). `render` maps the email renderer
+    over the bookings; pass a thread pool's map to render in parallel.
+    Returns (queued, skipped): jobs whose booking was no longer confirmed or
+    has already started are marked sent without an email.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            ReminderJob.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(sent_at__isnull=True, due_at__lte=now)
+            .select_related('booking__customer', 'booking__service', 'booking__staff__user_profile__user')
+            .order_by('due_at', 'id')[:batch_size]
+        )
+        if not jobs:
+            return 0, 0
+        live = [job.booking for job in jobs if job.booking.status == 'confirmed' and job.booking.start_time > now]
+        OutboxMessage.objects.bulk_create(list(render(lambda booking: render_booking_email(booking, 'reminder'), live)))
+        ReminderJob.objects.filter(id__in=[job.id for job in jobs]).update(sent_at=now)
+    return len(live), len(jobs) - len(live)
+
+
+def next_reminder_due():
+    """When the next unsent reminder is due, or None if there is none."""
+    return ReminderJob.objects.filter(sent_at__isnull=True).order_by('due_at').values_list('due_at', flat=True).first()
@@ -0,0 +1,101 @@
+# booking/roles.py
+"""
+Who is making the request: a customer, a staff member, or neither.
+
+The role (and the Staff id, for staff) is worked out once with a single
+joined query and then kept in the session, so later requests know it
+without touching the database. Each user has a role version in the cache;
+saving or deleting their UserProfile or Staff row bumps it (see
+signals.py), which makes the copy in every one of their sessions stale.
+
+That only reaches every worker when the cache is shared (Redis, Memcached);
+with the per-process LocMemCache another worker can go on trusting an old
+role. So the session copy is only used for reads of ordinary pages: POSTs
+and other writes, and every page behind staff_required, check the role in
+the database. Staff pages load the Staff row anyway, so that check comes
+with the same query.
+"""
+import time
+from django.core.cache import cache
+from .models import Staff, UserProfile
+
+ROLE_SESSION_KEY = '_booking_role'
+# Requests that may use the role kept in the session; all others re-check it.
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _version_key(user_id):
+    return f'role:version:{user_id}'
+
+
+def get_role_version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # Start from the clock, so an evicted counter never reuses an old number.
+        cache.add(_version_key(user_id), time.time_ns(), None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def bump_role_version(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def _resolve(request, check_database=False):
+    """The {'role', 'staff_id'} dict for request.user, worked out once per request.
+
+    check_database skips the session copy, even if it was already used earlier in the request.
+    """
+    if hasattr(request, '_booking_role') and (request._role_checked or not check_database):
+        return request._booking_role
+    user = request.user
+    role = {'role': None, 'staff_id': None}
+    checked = True
+    if user.is_authenticated:
+        version = get_role_version(user.pk)
+        saved = request.session.get(ROLE_SESSION_KEY)
+        if not check_database and request.method in READ_METHODS and saved and saved['user'] == user.pk and saved['version'] == version:
+            role = {'role': saved['role'], 'staff_id': saved['staff_id']}
+            checked = False
+        else:
+            request.__dict__.pop('_staff_member', None) # May have come from the session copy.
+            # Profile and Staff row in one query; keep the Staff row for get_staff_member().
+            profile = UserProfile.objects.select_related('staff').filter(user=user).first()
+            if profile is not None:
+                staff = getattr(profile, 'staff', None)
+                role = {'role': profile.user_type, 'staff_id': staff.pk if staff else None}
+                if staff is not None:
+                    profile.user = user
+                    request._staff_member = staff
+            fresh = dict(role, user=user.pk, version=version)
+            if saved != fresh: # Don't rewrite the session when a write only confirmed it.
+                request.session[ROLE_SESSION_KEY] = fresh
+    request._booking_role = role
+    request._role_checked = checked
+    return role
+
+
+def get_user_role(request):
+    """'staff', 'customer', or None for anonymous users and users without a profile."""
+    return _resolve(request)['role']
+
+
+def get_checked_user_role(request):
+    """Like get_user_role, but always read from the database (once per request)."""
+    return _resolve(request, check_database=True)['role']
+
+
+def get_staff_member(request):
+    """The Staff row of a staff user (with its profile and user attached), or None."""
+    role = _resolve(request) # On a session miss this already loads the Staff row.
+    if not hasattr(request, '_staff_member'):
+        staff = None
+        if role['role'] == 'staff' and role['staff_id'] is not None:
+            staff = Staff.objects.select_related('user_profile').filter(pk=role['staff_id']).first()
+            if staff is not None:
+                staff.user_profile.user = request.user # Already loaded; saves another query.
+        request._staff_member = staff
+    return request._staff_member
@@ -0,0 +1,216 @@
+# booking/rollups.py
+"""
+Daily utilization and revenue totals (DailyRollup).
+
+Reports read these rows instead of aggregating the Booking table, which
+grows without bound. The rows are kept up to date as bookings change
+status: every place that confirms, completes or cancels a booking hands
+the change to record_status_changes(), which adds or subtracts it from the
+matching row in the same transaction. rebuild_rollups() recomputes a date
+range from the bookings themselves (live and archived), for the first fill
+and for repairs.
+
+A staff member's available minutes for a day come from their weekly
+working hours and are stored on the rollup row without a service. They are
+stored by the nightly `backfill_rollups --available-only` run (and when a
+booking on that day first counts) and then kept, so past days remember the
+hours that applied back then. Reports never write: for days not stored yet
+they use the current working hours.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .db import retry_on_lock
+from .models import Availability, Booking, BookingArchive, DailyRollup, Staff
+
+# Bookings in these statuses count as booked time and revenue.
+COUNTED_STATUSES = ('confirmed', 'completed')
+
+
+def local_day(value):
+    return timezone.localtime(value).date()
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _days(first_day, last_day):
+    return [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+
+
+def _minutes(start, end):
+    return int((end - start).total_seconds() // 60)
+
+
+def _working_minutes(staff_ids):
+    """{(staff_id, day_of_week): minutes} from the weekly working hours."""
+    minutes = {}
+    for staff_id, day_of_week, start, end in Availability.objects.filter(staff_id__in=staff_ids).values_list('staff_id', 'day_of_week', 'start_time', 'end_time'):
+        minutes[staff_id, day_of_week] = (end.hour * 60 + end.minute) - (start.hour * 60 + start.minute)
+    return minutes
+
+
+def ensure_available_rows(staff_days):
+    """Creates the available-minutes row for each (staff_id, day) that lacks one. Returns how many it made."""
+    staff_days = set(staff_days)
+    if not staff_days:
+        return 0
+    staff_ids = {staff_id for staff_id, _ in staff_days}
+    days = [day for _, day in staff_days]
+    existing = set(
+        DailyRollup.objects.filter(service__isnull=True, staff_id__in=staff_ids, day__gte=min(days), day__lte=max(days))
+        .values_list('staff_id', 'day')
+    )
+    missing = staff_days - existing
+    if not missing:
+        return 0
+    working = _working_minutes(staff_ids)
+    DailyRollup.objects.bulk_create(
+        [DailyRollup(staff_id=staff_id, day=day, available_minutes=working.get((staff_id, day.weekday()), 0)) for staff_id, day in missing],
+        ignore_conflicts=True, # Another request may have just made the same row.
+    )
+    return len(missing)
+
+
+def store_available_minutes(first_day, last_day):
+    """Stores every staff member's available minutes for the days that lack them. Returns how many rows it made."""
+    staff_ids = list(Staff.objects.values_list('id', flat=True))
+    return ensure_available_rows((staff_id, day) for staff_id in staff_ids for day in _days(first_day, last_day))
+
+
+def forget_available_minutes(staff_ids, from_day=None):
+    """Drops stored available minutes from `from_day` (today) on, after working hours change.
+
+    Past days keep the hours that applied then; the dropped rows are made
+    again from the new hours the next time they are needed.
+    """
+    DailyRollup.objects.filter(service__isnull=True, staff_id__in=staff_ids, day__gte=from_day or timezone.localdate()).delete()
+
+
+def record_status_changes(changes):
+    """Applies status changes to the rollups. `changes` holds (booking, old_status) pairs.
+
+    Each booking must already carry its new status and have its service
+    loaded (for the price). Only changes into or out of COUNTED_STATUSES
+    touch the totals. Call it inside the transaction that changes the
+    bookings, so the totals and the bookings never disagree.
+    """
+    deltas = defaultdict(lambda: [0, 0, Decimal('0')])
+    for booking, old_status in changes:
+        sign = (booking.status in COUNTED_STATUSES) - (old_status in COUNTED_STATUSES)
+        if not sign:
+            continue
+        delta = deltas[booking.staff_id, booking.service_id, local_day(booking.start_time)]
+        delta[0] += sign
+        delta[1] += sign * _minutes(booking.start_time, booking.end_time)
+        delta[2] += sign * booking.service.price
+    if not deltas:
+        return
+    with transaction.atomic():
+        # Make sure every row exists, then adjust each one in the database
+        # with F(), so concurrent changes to the same row add up correctly.
+        DailyRollup.objects.bulk_create(
+            [DailyRollup(staff_id=staff_id, service_id=service_id, day=day) for staff_id, service_id, day in deltas],
+            ignore_conflicts=True,
+        )
+        for (staff_id, service_id, day), (bookings, minutes, revenue) in deltas.items():
+            DailyRollup.objects.filter(staff_id=staff_id, service_id=service_id, day=day).update(
+                bookings=F('bookings') + bookings, booked_minutes=F('booked_minutes') + minutes, revenue=F('revenue') + revenue,
+            )
+        ensure_available_rows((staff_id, day) for staff_id, _, day in deltas)
+
+
+def _booking_totals(model, first_day, last_day):
+    """{(staff_id, service_id, day): [bookings, minutes, revenue]} for one table."""
+    # A plain range on start_time, so the database can use its index.
+    rows = (
+        model.objects.filter(status__in=COUNTED_STATUSES, start_time__gte=_day_start(first_day), start_time__lt=_day_start(last_day + timedelta(days=1)))
+        .annotate(day=TruncDate('start_time', tzinfo=timezone.get_current_timezone()))
+        .values('staff_id', 'service_id', 'day')
+        .annotate(
+            bookings=Count('id'),
+            duration=Sum(ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField())),
+            revenue=Sum('service__price'),
+        )
+        .order_by()
+    )
+    return {
+        (row['staff_id'], row['service_id'], row['day']): [row['bookings'], int(row['duration'].total_seconds() // 60), row['revenue']]
+        for row in rows
+    }
+
+
+@retry_on_lock
+def rebuild_rollups(first_day, last_day, reset_available=False):
+    """Recomputes the booking totals from first_day to last_day (inclusive) in one transaction.
+
+    Reads bookings from both the live table and the archive. Stored
+    available minutes are kept, since past days keep the hours that applied
+    then; missing ones are filled in. With reset_available they are
+    recomputed from the current working hours as well. Returns the number
+    of rows written.
+    """
+    with transaction.atomic():
+        # Delete before reading the bookings: a status change that is busy
+        # updating one of these rows makes the delete wait for it (on
+        # PostgreSQL), and the totals read afterwards then include it.
+        in_range = DailyRollup.objects.filter(day__gte=first_day, day__lte=last_day)
+        (in_range if reset_available else in_range.filter(service__isnull=False)).delete()
+        totals = _booking_totals(Booking, first_day, last_day)
+        for key, (bookings, minutes, revenue) in _booking_totals(BookingArchive, first_day, last_day).items():
+            total = totals.setdefault(key, [0, 0, Decimal('0')])
+            total[0] += bookings
+            total[1] += minutes
+            total[2] += revenue
+        rows = [
+            DailyRollup(staff_id=staff_id, service_id=service_id, day=day, bookings=bookings, booked_minutes=minutes, revenue=revenue)
+            for (staff_id, service_id, day), (bookings, minutes, revenue) in totals.items()
+        ]
+        DailyRollup.objects.bulk_create(rows, batch_size=500)
+        return len(rows) + store_available_minutes(first_day, last_day)
+
+
+def staff_utilization(first_day, last_day):
+    """Per staff member: booked and available minutes, bookings and revenue, from the rollups."""
+    staff_members = list(Staff.objects.select_related('user_profile__user').order_by('user_profile__user__first_name', 'id'))
+    rows = (
+        DailyRollup.objects.filter(day__gte=first_day, day__lte=last_day)
+        .values('staff_id')
+        .annotate(
+            bookings=Sum('bookings'), booked_minutes=Sum('booked_minutes'),
+            available_minutes=Sum('available_minutes'), revenue=Sum('revenue'),
+        )
+        .order_by()
+    )
+    totals = {row['staff_id']: row for row in rows}
+    # Days without a stored available row (the nightly run has not reached
+    # them) count the current working hours. Nothing is written here.
+    stored = set(DailyRollup.objects.filter(service__isnull=True, day__gte=first_day, day__lte=last_day).values_list('staff_id', 'day'))
+    working = _working_minutes([staff.id for staff in staff_members])
+    days = _days(first_day, last_day)
+    report = []
+    for staff in staff_members:
+        row = totals.get(staff.id, {})
+        unstored = sum(working.get((staff.id, day.weekday()), 0) for day in days if (staff.id, day) not in stored)
+        booked, available = row.get('booked_minutes') or 0, (row.get('available_minutes') or 0) + unstored
+        report.append({
+            'staff': staff, 'bookings': row.get('bookings') or 0, 'revenue': row.get('revenue') or Decimal('0'),
+            'booked_minutes': booked, 'available_minutes': available,
+            'utilization': round(100 * booked / available, 1) if available else None,
+        })
+    return report
+
+
+def revenue_by_service(first_day, last_day):
+    """Bookings, minutes and revenue per service, highest revenue first, from the rollups."""
+    return list(
+        DailyRollup.objects.filter(day__gte=first_day, day__lte=last_day, service__isnull=False)
+        .values('service_id', 'service__name')
+        .annotate(bookings=Sum('bookings'), booked_minutes=Sum('booked_minutes'), revenue=Sum('revenue'))
+        .order_by('-revenue', 'service__name')
+    )
@@ -0,0 +1,90 @@
+# booking/routers.py
+"""
+Read/write splitting between the primary database and a read replica.
+
+Writes always go to the primary ('default'). Reads go to the replica only
+inside read_from_replica views (or a replica_reads() block), and only until
+something is written: from then on the rest of the request reads the
+primary, so it sees its own writes. ReplicaPinningMiddleware extends that to
+the next few seconds of the same browser, covering the redirect that
+usually follows a write.
+
+Without a 'replica' entry in DATABASES everything stays on the primary.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = 'replica'
+
+# Where reads should go right now, whether they must use the primary anyway,
+# and whether this request has written anything.
+_read_alias = ContextVar('read_alias', default=DEFAULT_DB_ALIAS)
+_pinned = ContextVar('pinned_to_primary', default=False)
+_wrote = ContextVar('wrote_to_primary', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in connections.settings
+
+
+def pin_to_primary():
+    """Sends every further read in this request (or task) to the primary."""
+    _pinned.set(True)
+
+
+def has_written():
+    return _wrote.get()
+
+
+@contextmanager
+def replica_reads():
+    """Reads inside the block may be served by the replica (if one is configured)."""
+    token = _read_alias.set(REPLICA_ALIAS if replica_configured() else DEFAULT_DB_ALIAS)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Reads inside the block always use the primary, e.g. to fill a cache with fresh data."""
+    token = _read_alias.set(DEFAULT_DB_ALIAS)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def read_from_replica(view):
+    """A view decorator: GET and HEAD requests read from the replica."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """Routes reads to the replica when allowed, and everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or _wrote.get():
+            return DEFAULT_DB_ALIAS
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Read-your-writes: after the first write, this request reads the primary.
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data, so objects from either may be related.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
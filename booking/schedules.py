@@ -0,0 +1,120 @@
+# booking/schedules.py
+"""
+Bulk reading and writing of weekly working hours (Availability).
+
+save_availability() is the one write path: the staff availability form and
+the import_availability command both hand it the rows to save and delete,
+and it applies them with at most one DELETE, one INSERT and one UPDATE in a
+single transaction, however many days or staff members change.
+"""
+from datetime import datetime
+from django.db import transaction
+from .db import retry_on_lock
+from .models import Availability, Staff
+from .rollups import forget_available_minutes
+from .slot_cache import bump_staff_version
+
+EXPORT_FIELDS = ('staff', 'day_of_week', 'start_time', 'end_time')
+DAY_NUMBERS = {name.lower(): number for number, name in Availability.DAY_OF_WEEK_CHOICES}
+
+
+@retry_on_lock
+def save_availability(to_save, to_delete=()):
+    """Creates, updates and deletes Availability rows in bulk, in one transaction."""
+    to_save, to_delete = list(to_save), list(to_delete)
+    new = [availability for availability in to_save if availability.pk is None]
+    changed = [availability for availability in to_save if availability.pk is not None]
+    with transaction.atomic():
+        # Deletes first, so a day that is removed and re-added never clashes
+        # with the (staff, day_of_week) unique constraint.
+        if to_delete:
+            Availability.objects.filter(pk__in=[availability.pk for availability in to_delete]).delete()
+        if new:
+            Availability.objects.bulk_create(new)
+        if changed:
+            Availability.objects.bulk_update(changed, ['day_of_week', 'start_time', 'end_time'])
+    # Bulk writes skip the post_save signal, so refresh the slot cache and rollups by hand.
+    staff_ids = {availability.staff_id for availability in to_save + to_delete}
+    for staff_id in staff_ids:
+        bump_staff_version(staff_id)
+    forget_available_minutes(staff_ids)
+
+
+def export_rows():
+    """Every Availability row as a dict, streamed from the database in staff order."""
+    rows = (
+        Availability.objects.order_by('staff_id', 'day_of_week')
+        .values_list('staff__user_profile__user__username', 'day_of_week', 'start_time', 'end_time')
+        .iterator(chunk_size=2000)
+    )
+    for username, day, start, end in rows:
+        yield {'staff': username, 'day_of_week': day, 'start_time': start.strftime('%H:%M'), 'end_time': end.strftime('%H:%M')}
+
+
+def _parse_day(value):
+    value = str(value).strip()
+    if value.isdigit() and 0 <= int(value) <= 6:
+        return int(value)
+    if value.lower() in DAY_NUMBERS:
+        return DAY_NUMBERS[value.lower()]
+    raise ValueError(f'unknown day {value!r}')
+
+
+def _parse_time(value):
+    value = str(value).strip()
+    for pattern in ('%H:%M', '%H:%M:%S'):
+        try:
+            return datetime.strptime(value, pattern).time()
+        except ValueError:
+            pass
+    raise ValueError(f'bad time {value!r}')
+
+
+def plan_import(rows, replace=False):
+    """Checks imported rows and works out what to save and delete. Nothing is written.
+
+    `rows` is an iterable of dicts with the EXPORT_FIELDS keys; staff are
+    given by username and days by number (0 = Monday) or name. Listed days
+    are created or updated. With `replace`, days not listed are deleted for
+    every staff member that appears in the import.
+    Returns (to_save, to_delete, errors); errors name the row number.
+    """
+    parsed, errors, seen = [], [], set()
+    for number, row in enumerate(rows, start=1):
+        try:
+            username = str(row['staff']).strip()
+            day, start, end = _parse_day(row['day_of_week']), _parse_time(row['start_time']), _parse_time(row['end_time'])
+        except KeyError as error:
+            errors.append(f'Row {number}: missing {error}')
+            continue
+        except (TypeError, ValueError) as error:
+            errors.append(f'Row {number}: {error}')
+            continue
+        if start >= end:
+            errors.append(f'Row {number}: start_time must be before end_time')
+        elif (username, day) in seen:
+            errors.append(f'Row {number}: {username} has {Availability.DAY_OF_WEEK_CHOICES[day][1]} twice')
+        else:
+            seen.add((username, day))
+            parsed.append((number, username, day, start, end))
+
+    # Two queries in total: the staff named in the file, and their current hours.
+    usernames = {username for _, username, _, _, _ in parsed}
+    staff_ids = dict(Staff.objects.filter(user_profile__user__username__in=usernames).values_list('user_profile__user__username', 'id'))
+    existing = {(a.staff_id, a.day_of_week): a for a in Availability.objects.filter(staff_id__in=staff_ids.values())}
+
+    to_save, listed = [], set()
+    for number, username, day, start, end in parsed:
+        if username not in staff_ids:
+            errors.append(f'Row {number}: no staff member with username {username!r}')
+            continue
+        key = (staff_ids[username], day)
+        listed.add(key)
+        availability = existing.get(key)
+        if availability is None:
+            to_save.append(Availability(staff_id=key[0], day_of_week=day, start_time=start, end_time=end))
+        elif (availability.start_time, availability.end_time) != (start, end):
+            availability.start_time, availability.end_time = start, end
+            to_save.append(availability)
+    to_delete = [availability for key, availability in existing.items() if key not in listed] if replace else []
+    return to_save, to_delete, errors
@@ -0,0 +1,48 @@
+# booking/signals.py
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .catalog import bump_catalog_version
+from .models import Availability, Booking, Service, Staff, UserProfile
+from .roles import bump_role_version
+from .rollups import forget_available_minutes
+from .slot_cache import bump_booking_days, bump_staff_version
+
+# These receivers keep the slot cache honest: whenever something that can
+# change a staff member's free time is saved or deleted, the matching cached
+# days are invalidated. They are connected in BookingConfig.ready().
+
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_booking_days(sender, instance, **kwargs):
+    """A booking was created, confirmed, cancelled, moved or removed."""
+    slot = (instance.staff_id, instance.start_time, instance.end_time)
+    bump_booking_days(*slot)
+    loaded_slot = getattr(instance, '_loaded_slot', None)
+    if loaded_slot and loaded_slot != slot and None not in loaded_slot[:2]:
+        bump_booking_days(*loaded_slot) # It moved: the old day (or stylist) has a free slot again.
+    instance._loaded_slot = slot
+
+@receiver([post_save, post_delete], sender=Availability)
+def invalidate_staff_schedule(sender, instance, **kwargs):
+    """Working hours changed, which affects every date on that weekday."""
+    bump_staff_version(instance.staff_id)
+    forget_available_minutes([instance.staff_id])
+
+@receiver([post_save, post_delete], sender=Service)
+@receiver(m2m_changed, sender=Service.staff_members.through)
+def invalidate_service_catalog(sender, **kwargs):
+    """The home page catalog (services and who offers them) changed."""
+    if kwargs.get('action', 'post_').startswith('post_'): # m2m_changed also fires before the change.
+        bump_catalog_version()
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_profile_role(sender, instance, **kwargs):
+    """The user's role changed, so the copy cached in their sessions is stale."""
+    bump_role_version(instance.user_id)
+
+@receiver([post_save, post_delete], sender=Staff)
+def invalidate_staff_role(sender, instance, **kwargs):
+    """A Staff row was added or removed, which changes request.staff_member."""
+    try:
+        bump_role_version(instance.user_profile.user_id)
+    except UserProfile.DoesNotExist:
+        pass # The profile is being deleted too, and its own signal bumps the version.
@@ -0,0 +1,173 @@
+# booking/slot_cache.py
+"""
+A versioned cache around get_available_slots.
+
+Each staff member has a version counter, and so does each of their days. A
+cached slot list is stored under a key that includes both counters, so
+"invalidating" a day is just bumping its counter: old entries are never read
+again and simply expire. Counters are bumped when the change is made and
+again when its transaction commits. Works with any Django cache backend (local memory in
+tests, Redis or Memcached in production).
+"""
+import hashlib
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .booking_logic import compute_day_slots, compute_range_slots
+from .routers import primary_reads
+
+# How long a slot list may live in the cache. Versions make stale reads
+# impossible, so this only bounds memory use.
+SLOT_CACHE_TIMEOUT = getattr(settings, 'SLOT_CACHE_TIMEOUT', 60 * 60)
+
+# Hit/miss counters for this process.
+stats = {'hits': 0, 'misses': 0}
+
+
+def _staff_version_key(staff_id):
+    return f'slots:version:{staff_id}'
+
+
+def _day_version_key(staff_id, day):
+    return f'slots:version:{staff_id}:{day.isoformat()}'
+
+
+def _new_version():
+    # Counters start from the clock rather than 1, so a counter that was
+    # evicted can never come back with a number an old entry already used.
+    return time.time_ns()
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter was never set (or was evicted); start a fresh one.
+        if not cache.add(key, _new_version(), None):
+            cache.incr(key)
+
+
+def _bump(key):
+    _incr(key)
+    # Until the writer's transaction commits, a cache miss elsewhere still
+    # reads the old rows and could store them under the new version. Bumping
+    # again on commit retires anything cached in between.
+    transaction.on_commit(lambda: _incr(key))
+
+
+def bump_staff_version(staff_id):
+    """Invalidates every cached day of a staff member (e.g. their working hours changed)."""
+    _bump(_staff_version_key(staff_id))
+
+
+def bump_day_version(staff_id, day):
+    """Invalidates one cached day of a staff member (e.g. a booking on it changed)."""
+    _bump(_day_version_key(staff_id, day))
+
+
+def bump_booking_days(staff_id, start_time, end_time=None):
+    """Invalidates every day a booking touches. Use it after queryset.update(), which skips signals."""
+    day = timezone.localtime(start_time).date()
+    last_day = timezone.localtime(end_time).date() if end_time else day
+    while day <= last_day:
+        bump_day_version(staff_id, day)
+        day += timedelta(days=1)
+
+
+def _versions(staff_id, *days):
+    """The staff version followed by the version of each day, in one cache round trip."""
+    keys = [_staff_version_key(staff_id)] + [_day_version_key(staff_id, day) for day in days]
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions[key] for key in keys]
+
+
+def _timeout(changes_at):
+    timeout = SLOT_CACHE_TIMEOUT
+    if changes_at is not None:
+        # A hold expiring frees its slot without any save, so the entry must not outlive it.
+        timeout = max(1, min(timeout, int((changes_at - timezone.now()).total_seconds()) + 1))
+    return timeout
+
+
+def cached_available_slots(service, staff, booking_date):
+    """The same result as get_available_slots, served from the cache when possible."""
+    staff_version, day_version = _versions(staff.id, booking_date)
+    key = f'slots:{staff.id}:{booking_date.isoformat()}:{service.duration_minutes}:{staff_version}:{day_version}'
+    slots = cache.get(key)
+    if slots is not None:
+        stats['hits'] += 1
+        return slots
+    stats['misses'] += 1
+    # Fill the cache from the primary: a lagging replica could otherwise store
+    # a pre-write answer under the version that write just created.
+    with primary_reads():
+        slots, changes_at = compute_day_slots(service, staff, booking_date)
+    cache.set(key, slots, _timeout(changes_at))
+    return slots
+
+
+def range_version(staff_id, start_date, days):
+    """A short token that changes whenever any of the days (or the staff member's hours) change.
+
+    Costs one cache round trip and no queries, so it also makes a cheap ETag.
+    """
+    versions = _versions(staff_id, *(start_date + timedelta(days=offset) for offset in range(days)))
+    return hashlib.sha1(':'.join(map(str, versions)).encode()).hexdigest()[:16]
+
+
+def _range_holds_key(staff_id, start_date, days, version):
+    return f'slots:range:holds:{staff_id}:{start_date.isoformat()}:{days}:{version}'
+
+
+def _lapsed(holds_expire_at):
+    # 0 means the window had no live holds, so nothing lapses on its own.
+    return bool(holds_expire_at) and holds_expire_at <= timezone.now().timestamp()
+
+
+def range_validator(staff_id, start_date, days, version=None):
+    """range_version plus when the window's earliest live hold expires, or None when that is not known.
+
+    A hold expiring frees its slot without bumping any version, so the
+    versions alone would keep matching after it lapsed. cached_range_slots
+    records the expiry whenever it computes the window.
+    """
+    version = version or range_version(staff_id, start_date, days)
+    holds_expire_at = cache.get(_range_holds_key(staff_id, start_date, days, version))
+    if holds_expire_at is None or _lapsed(holds_expire_at):
+        return None
+    return f'{version}-{int(holds_expire_at)}'
+
+
+def cached_range_slots(service, staff_id, start_date, days, version=None):
+    """compute_range_slots for `days` days from start_date, served from the cache when possible."""
+    version = version or range_version(staff_id, start_date, days)
+    key = f'slots:range:{staff_id}:{start_date.isoformat()}:{days}:{service.duration_minutes}:{version}'
+    holds_key = _range_holds_key(staff_id, start_date, days, version)
+    cached = cache.get_many([key, holds_key])
+    if key in cached and holds_key in cached and not _lapsed(cached[holds_key]):
+        stats['hits'] += 1
+        return cached[key]
+    stats['misses'] += 1
+    with primary_reads(): # See cached_available_slots.
+        slots, changes_at = compute_range_slots(service, staff_id, start_date, start_date + timedelta(days=days - 1))
+    timeout = _timeout(changes_at)
+    cache.set_many({key: slots, holds_key: changes_at.timestamp() if changes_at else 0}, timeout)
+    return slots
+
+
+def get_stats():
+    """A copy of the hit/miss counters, with the hit rate, for monitoring."""
+    lookups = stats['hits'] + stats['misses']
+    return {**stats, 'hit_rate': stats['hits'] / lookups if lookups else 0.0}
+
+
+def reset_stats():
+    stats['hits'] = stats['misses'] = 0
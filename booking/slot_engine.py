@@ -0,0 +1,149 @@
+# booking/slot_engine.py
+"""
+A bitmap-backed slot engine.
+
+A staff member's day is split into 15-minute "cells" and stored as the bits of
+a plain Python integer: bit 0 is 00:00-00:15, bit 1 is 00:15-00:30, and so on.
+Working hours, bookings and any future breaks or exceptions each become a mask,
+so finding free start times is a handful of bitwise operations instead of a
+loop doing timezone-aware datetime arithmetic on every step.
+"""
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+
+SLOT_MINUTES = 15
+CELLS_PER_DAY = 24 * 60 // SLOT_MINUTES
+# The start time of every cell, built once so results never construct `time` objects.
+CELL_TIMES = tuple(time(minute // 60, minute % 60) for minute in range(0, 24 * 60, SLOT_MINUTES))
+
+
+def _span(first_cell, last_cell):
+    """A mask with cells first_cell..last_cell-1 set (clipped to one day)."""
+    first_cell = max(first_cell, 0)
+    last_cell = min(last_cell, CELLS_PER_DAY)
+    if last_cell <= first_cell:
+        return 0
+    return ((1 << (last_cell - first_cell)) - 1) << first_cell
+
+
+def _minute_of_day(value):
+    return value.hour * 60 + value.minute + value.second / 60
+
+
+def working_mask(start_time, end_time):
+    """Cells that lie completely inside the working hours [start_time, end_time)."""
+    first_cell = -(-_minute_of_day(start_time) // SLOT_MINUTES)  # Round up to the next cell.
+    last_cell = _minute_of_day(end_time) // SLOT_MINUTES  # Round down.
+    return _span(int(first_cell), int(last_cell))
+
+
+def _interval_cells(start, end, tz, first_ordinal):
+    """The (first, last) cells an interval touches, counted from midnight of `first_ordinal`."""
+    # Work in local wall-clock minutes so DST days line up with the working hours.
+    start, end = start.astimezone(tz), end.astimezone(tz)
+    start_minute = (start.toordinal() - first_ordinal) * 1440 + start.hour * 60 + start.minute
+    end_minute = (end.toordinal() - first_ordinal) * 1440 + end.hour * 60 + end.minute
+    if end.second or end.microsecond:
+        end_minute += 1
+    return start_minute // SLOT_MINUTES, -(-end_minute // SLOT_MINUTES)
+
+
+def busy_mask(day, intervals, tz=None):
+    """Cells on `day` touched by any (start, end) datetime interval, e.g. bookings or breaks."""
+    mask = 0
+    first_ordinal = day.toordinal()
+    for start, end in intervals:
+        if tz is None:
+            # Looked up once, and only when needed; it is slower than the whole mask maths.
+            tz = timezone.get_current_timezone()
+        first_cell, last_cell = _interval_cells(start, end, tz, first_ordinal)
+        mask |= _span(first_cell, last_cell)
+    return mask
+
+
+def fit_mask(free, cells):
+    """Start cells from which `cells` consecutive free cells follow."""
+    # Each pass doubles the length of the run we have checked, so even a
+    # long service only needs a few shifts.
+    result, checked = free, 1
+    while checked < cells and result:
+        step = min(checked, cells - checked)
+        result &= result >> step
+        checked += step
+    return result
+
+
+def mask_to_times(mask):
+    """Converts a mask of start cells into a sorted list of `time` objects."""
+    times = []
+    while mask:
+        lowest = mask & -mask
+        times.append(CELL_TIMES[lowest.bit_length() - 1])
+        mask ^= lowest
+    return times
+
+
+def cells_for(duration_minutes):
+    """How many cells a service of this length occupies."""
+    return max(1, -(-duration_minutes // SLOT_MINUTES))
+
+
+def free_start_times(day, work_start, work_end, busy_intervals, duration_minutes, extra_masks=(), tz=None):
+    """All start times on `day` where a service of `duration_minutes` fits.
+
+    `extra_masks` are any further "busy" masks (breaks, holidays, ...) to subtract.
+    """
+    free = working_mask(work_start, work_end) & ~busy_mask(day, busy_intervals, tz)
+    for mask in extra_masks:
+        free &= ~mask
+    return mask_to_times(fit_mask(free, cells_for(duration_minutes)))
+
+
+def free_start_times_for_range(days, hours_by_weekday, busy_intervals, duration_minutes):
+    """Batch version of free_start_times for several days of one staff member.
+
+    `hours_by_weekday` maps a weekday number to a (start, end) pair of times and
+    `busy_intervals` can cover the whole range. Returns a {date: [time, ...]} dict.
+    """
+    if not days:
+        return {}
+    # All days share one long mask, CELLS_PER_DAY bits per day, so every
+    # interval is applied once no matter how many days it spans.
+    first_ordinal = min(days).toordinal()
+    total_cells = (max(days).toordinal() - first_ordinal + 1) * CELLS_PER_DAY
+    tz = timezone.get_current_timezone()
+    busy = 0
+    for start, end in busy_intervals:
+        first_cell, last_cell = _interval_cells(start, end, tz, first_ordinal)
+        first_cell, last_cell = max(first_cell, 0), min(last_cell, total_cells)
+        if last_cell > first_cell:
+            busy |= ((1 << (last_cell - first_cell)) - 1) << first_cell
+
+    cells = cells_for(duration_minutes)
+    slots_by_day = {}
+    for day in days:
+        hours = hours_by_weekday.get(day.weekday())
+        if hours is None:
+            slots_by_day[day] = []  # Staff does not work on this day.
+            continue
+        day_busy = busy >> ((day.toordinal() - first_ordinal) * CELLS_PER_DAY)
+        free = working_mask(hours[0], hours[1]) & ~day_busy
+        slots_by_day[day] = mask_to_times(fit_mask(free, cells))
+    return slots_by_day
+
+
+def loop_free_start_times(day, work_start, work_end, busy_intervals, duration_minutes):
+    """The original step-by-step loop, kept as a reference for tests and benchmarks."""
+    available_slots = []
+    service_duration = timedelta(minutes=duration_minutes)
+    current_time = timezone.make_aware(datetime.combine(day, work_start))
+    end_of_day = timezone.make_aware(datetime.combine(day, work_end))
+    for start, end in sorted(busy_intervals):
+        while current_time + service_duration <= start:
+            available_slots.append(current_time.time())
+            current_time += timedelta(minutes=SLOT_MINUTES)
+        current_time = end
+    while current_time + service_duration <= end_of_day:
+        available_slots.append(current_time.time())
+        current_time += timedelta(minutes=SLOT_MINUTES)
+    return available_slots
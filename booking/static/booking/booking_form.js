@@ -0,0 +1,111 @@
+// booking/static/booking/booking_form.js
+//
+// Swaps in the time slots on the booking form without reloading the page.
+// Picking a stylist or a date asks slots.json for a whole week at once, so
+// moving around that week (and the next one, fetched in the background)
+// needs no further requests. "Any stylist" still submits the form normally,
+// and so does everything when fetch() is not available.
+(function () {
+    var picker = document.getElementById('slot-picker');
+    var panel = document.getElementById('slot-panel');
+    var template = document.getElementById('slot-panel-template');
+    if (!picker || !panel || !template || !window.fetch) {
+        return;
+    }
+    var staffInput = picker.elements.staff;
+    var dateInput = picker.elements.date;
+    var slotsByDay = {}; // "staff|YYYY-MM-DD" -> ["09:00", ...]
+    var windows = {}; // "staff|YYYY-MM-DD" (first day) -> Promise, so a week is only fetched once.
+
+    function addDays(isoDate, days) {
+        var date = new Date(isoDate + 'T00:00:00Z');
+        date.setUTCDate(date.getUTCDate() + days);
+        return date.toISOString().slice(0, 10);
+    }
+
+    function label(slot) {
+        // "14:30" -> "02:30 PM", the way the server-rendered page shows times.
+        var hour = parseInt(slot.slice(0, 2), 10);
+        var hour12 = hour % 12 || 12;
+        return (hour12 < 10 ? '0' : '') + hour12 + ':' + slot.slice(3, 5) + (hour < 12 ? ' AM' : ' PM');
+    }
+
+    function loadWindow(staff, start) {
+        var key = staff + '|' + start;
+        if (!windows[key]) {
+            var url = picker.dataset.slotsUrl + '?staff=' + encodeURIComponent(staff) + '&start=' + encodeURIComponent(start);
+            windows[key] = fetch(url, {credentials: 'same-origin'}).then(function (response) {
+                if (!response.ok) {
+                    throw new Error('Slot lookup failed with ' + response.status);
+                }
+                return response.json();
+            }).then(function (data) {
+                data.days.forEach(function (day) {
+                    slotsByDay[staff + '|' + day.date] = day.slots;
+                });
+                return data;
+            });
+            windows[key].catch(function () {
+                delete windows[key]; // Let a later change try again.
+            });
+        }
+        return windows[key];
+    }
+
+    function slotsFor(staff, date) {
+        var key = staff + '|' + date;
+        if (key in slotsByDay) {
+            return Promise.resolve(slotsByDay[key]);
+        }
+        return loadWindow(staff, date).then(function (data) {
+            // Prefetch the following week while the customer looks at this one.
+            loadWindow(staff, addDays(data.days[0].date, data.days.length)).catch(function () {});
+            return slotsByDay[key] || [];
+        });
+    }
+
+    function render(staff, date, slots) {
+        var content = template.content.cloneNode(true);
+        var form = content.querySelector('form');
+        var empty = content.querySelector('[data-slot-empty]');
+        form.elements.staff.value = staff;
+        form.elements.date.value = date;
+        content.querySelector('[data-slot-date]').textContent = date;
+        var list = content.querySelector('[data-slot-list]');
+        slots.forEach(function (slot) {
+            var button = document.createElement('button');
+            button.type = 'submit';
+            button.name = 'time';
+            button.value = slot + ':00';
+            button.className = 'list-group-item list-group-item-action';
+            button.textContent = label(slot);
+            list.appendChild(button);
+        });
+        (slots.length ? empty : form).remove();
+        panel.replaceChildren(content);
+    }
+
+    function update(event) {
+        var staff = staffInput.value;
+        var date = dateInput.value;
+        if (!/^\d+$/.test(staff) || !date) {
+            return; // "Any stylist" or an incomplete choice: leave it to the normal form.
+        }
+        if (event) {
+            event.preventDefault();
+        }
+        slotsFor(staff, date).then(function (slots) {
+            if (staffInput.value !== staff || dateInput.value !== date) {
+                return; // The choice changed while this was loading.
+            }
+            render(staff, date, slots);
+            history.replaceState(null, '', picker.action + '?staff=' + encodeURIComponent(staff) + '&date=' + encodeURIComponent(date));
+        }).catch(function () {
+            picker.submit(); // Fall back to the full page.
+        });
+    }
+
+    picker.addEventListener('submit', update);
+    staffInput.addEventListener('change', function () { update(); });
+    dateInput.addEventListener('change', function () { update(); });
+})();
@@ -0,0 +1,101 @@
+# booking/stripe_events.py
+"""
+Stripe webhook ingestion.
+
+The webhook view only verifies and records each event (record_stripe_event),
+so Stripe gets its 200 straight away. The process_stripe_events command then
+applies the stored events in the order they arrived, in batches.
+
+An event that cannot be applied (its booking is gone, e.g. reaped after
+the hold ran out, or is no longer pending) usually means a customer paid
+without getting a booking. It is still marked processed, but with a
+`problem` note and a warning in the log, so someone can follow it up; the
+StripeEvent admin lists them under "problem".
+"""
+import logging
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .db import retry_on_lock
+from .emails import render_booking_email
+from .models import Booking, OutboxMessage, StripeEvent
+from .reminders import sync_reminder_jobs
+from .rollups import record_status_changes
+from .slot_cache import bump_booking_days
+
+logger = logging.getLogger(__name__)
+
+# The event types process_stripe_events acts on; the webhook ignores the rest.
+HANDLED_EVENT_TYPES = ('checkout.session.completed',)
+
+
+@retry_on_lock
+def record_stripe_event(event_id, event_type, payload):
+    """Stores an event. Returns False if it was not stored: a redelivery, or a type nothing handles."""
+    if event_type not in HANDLED_EVENT_TYPES:
+        return False
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(event_id=event_id, event_type=event_type, payload=payload)
+    except IntegrityError:
+        return False
+    return True
+
+
+@retry_on_lock
+def process_stripe_events(batch_size=100):
+    """Applies the oldest unprocessed events in one transaction. Returns how many were handled.
+
+    Bookings are confirmed with a single UPDATE and their confirmation emails
+    are queued with a single INSERT, however many events are in the batch.
+    """
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True).order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        booking_ids = {}
+        for event in events:
+            if event.event_type == 'checkout.session.completed':
+                booking_id = event.payload.get('data', {}).get('object', {}).get('metadata', {}).get('booking_id')
+                booking_ids[event.id] = int(booking_id) if booking_id and str(booking_id).isdigit() else None
+
+        bookings = {
+            booking.id: booking for booking in Booking.objects.select_for_update()
+            .filter(id__in=set(booking_ids.values()) - {None})
+            .select_related('customer', 'service', 'staff__user_profile__user')
+        }
+        # Only pending bookings are confirmed, once each, so replayed events change nothing.
+        to_confirm, problems = {}, []
+        for event in events:
+            if event.id not in booking_ids:
+                continue # A type that was stored before it stopped being handled.
+            booking = bookings.get(booking_ids[event.id])
+            if booking is None:
+                event.problem = 'Paid, but the booking no longer exists.' if booking_ids[event.id] else 'No booking id in the metadata.'
+            elif booking.status != 'pending' or booking.id in to_confirm:
+                event.problem = f'Paid, but booking #{booking.id} was already {"confirmed" if booking.id in to_confirm else booking.status}.'
+            else:
+                to_confirm[booking.id] = booking
+                continue
+            problems.append(event)
+            logger.warning('Stripe event %s for booking %s not applied: %s', event.event_id, booking_ids[event.id], event.problem)
+        if problems:
+            StripeEvent.objects.bulk_update(problems, ['problem'])
+
+        to_confirm = list(to_confirm.values())
+        if to_confirm:
+            Booking.objects.filter(id__in=[booking.id for booking in to_confirm]).update(status='confirmed', hold_expires_at=None, updated_at=timezone.now())
+            for booking in to_confirm:
+                booking.status, booking.hold_expires_at = 'confirmed', None
+            record_status_changes((booking, 'pending') for booking in to_confirm)
+            sync_reminder_jobs(to_confirm)
+            OutboxMessage.objects.bulk_create([render_booking_email(booking, 'confirmation') for booking in to_confirm])
+        StripeEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=timezone.now())
+
+    # update() skips the post_save signal, so refresh the slot cache by hand.
+    for booking in to_confirm:
+        bump_booking_days(booking.staff_id, booking.start_time, booking.end_time)
+    return len(events)
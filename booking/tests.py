@@ -1,3 +1,1190 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from datetime import date, datetime, time, timedelta
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, close_old_connections, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from .booking_logic import SlotUnavailable, cancel_booking, find_earliest_slots, get_available_slots, reserve_slot
+from .admin import EstimatedCountPaginator
+from .archive import archive_batch
+from .benchmarks import find_regressions
+from .calendar_feeds import aics_lines, feed_token
+from .catalog import get_catalog_version
+from .db import retry_on_lock
+from .emails import queue_booking_email
+from .payments import PaymentProviderBusy, close_stripe_client, create_checkout_session
+from .reminders import sync_reminder_jobs
+from .rollups import rebuild_rollups
+from .stripe_events import process_stripe_events
+from . import routers
+from .routers import REPLICA_ALIAS, PrimaryReplicaRouter, replica_reads
+from .models import Availability, Booking, BookingArchive, DailyRollup, OutboxMessage, ReminderJob, Service, Staff, StripeEvent, UserProfile
+from .slot_cache import cached_available_slots, get_stats, reset_stats
+from .slot_engine import (
+    busy_mask, fit_mask, free_start_times, free_start_times_for_range, loop_free_start_times, mask_to_times, working_mask,
+)
+
+# A Monday far enough in the future that no test ever looks at a past date.
+MONDAY = date(2030, 1, 7)
+
+
+def aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+def make_staff(username='stylist', **availability):
+    """Creates a staff member, optionally with working hours for one weekday."""
+    user = User.objects.create_user(username=username, first_name=username.title())
+    profile = UserProfile.objects.create(user=user, user_type='staff')
+    staff = Staff.objects.create(user_profile=profile)
+    if availability:
+        Availability.objects.create(staff=staff, **availability)
+    return staff
+
+
+def make_service(*staff, duration_minutes=60, name='Cut'):
+    service = Service.objects.create(name=name, description='', duration_minutes=duration_minutes, price='40.00')
+    service.staff_members.add(*staff)
+    return service
+
+
+def make_customer(username='customer'):
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', first_name=username.title())
+    UserProfile.objects.create(user=user, user_type='customer')
+    return user
+
+
+def post_webhook(client, event):
+    """Posts a Stripe event to the webhook, skipping signature verification."""
+    with mock.patch('stripe.Webhook.construct_event', return_value=event):
+        return client.post(reverse('booking:stripe_webhook'), data=json.dumps(event), content_type='application/json')
+
+
+@contextmanager
+def stub_stripe(wait=None):
+    """Points booking.payments at a local fake Stripe that calls `wait()` before answering each request."""
+    numbers = itertools.count(1)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if wait is not None:
+                wait() # A slow payment provider, held up for as long as the test needs.
+            session_id = f'cs_test_{next(numbers)}'
+            body = json.dumps({'id': session_id, 'object': 'checkout.session', 'url': f'https://checkout.stripe.test/{session_id}'}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with mock.patch('booking.payments.STRIPE_API_BASE', f'http://127.0.0.1:{server.server_port}'):
+            close_stripe_client() # Start a client that talks to the stub, with any patched limits.
+            try:
+                yield
+            finally:
+                close_stripe_client()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def completed_checkout(event_id, booking):
+    return {'id': event_id, 'type': 'checkout.session.completed', 'data': {'object': {'metadata': {'booking_id': str(booking.id)}}}}
+
+
+class SlotEngineTests(SimpleTestCase):
+    def test_working_mask_rounds_inwards(self):
+        mask = working_mask(time(9, 5), time(10, 0))
+        self.assertEqual(mask_to_times(mask), [time(9, 15), time(9, 30), time(9, 45)])
+
+    def test_busy_mask_rounds_outwards(self):
+        mask = busy_mask(MONDAY, [(aware(MONDAY, 9, 10), aware(MONDAY, 9, 20))])
+        self.assertEqual(mask_to_times(mask), [time(9, 0), time(9, 15)])
+
+    def test_fit_mask_requires_a_full_run(self):
+        free = working_mask(time(9, 0), time(10, 0))
+        self.assertEqual(mask_to_times(fit_mask(free, 3)), [time(9, 0), time(9, 15)])
+        self.assertEqual(fit_mask(free, 5), 0)
+
+    def test_matches_the_original_loop_on_aligned_days(self):
+        busy = [(aware(MONDAY, 10), aware(MONDAY, 11)), (aware(MONDAY, 13, 30), aware(MONDAY, 14, 15))]
+        for duration in (15, 30, 45, 60, 90):
+            self.assertEqual(
+                free_start_times(MONDAY, time(9), time(17), busy, duration),
+                loop_free_start_times(MONDAY, time(9), time(17), busy, duration),
+            )
+
+    def test_booking_from_the_previous_day_is_clipped(self):
+        busy = [(aware(MONDAY - timedelta(days=1), 23), aware(MONDAY, 0, 30))]
+        slots = free_start_times(MONDAY, time(0), time(1), busy, 15)
+        self.assertEqual(slots, [time(0, 30), time(0, 45)])
+
+    def test_range_matches_single_days(self):
+        days = [MONDAY + timedelta(days=offset) for offset in range(3)]
+        hours = {MONDAY.weekday(): (time(9), time(12)), (MONDAY.weekday() + 2) % 7: (time(22), time(23, 59))}
+        busy = [(aware(MONDAY, 10), aware(MONDAY, 10, 30)), (aware(days[2], 23), aware(days[2] + timedelta(days=1), 1))]
+        slots = free_start_times_for_range(days, hours, busy, 30)
+        self.assertEqual(slots[MONDAY], free_start_times(MONDAY, time(9), time(12), busy, 30))
+        self.assertEqual(slots[days[1]], [])
+        self.assertEqual(slots[days[2]], [time(22), time(22, 15), time(22, 30)])
+
+
+class GetAvailableSlotsTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(12))
+        self.service = make_service(self.staff, duration_minutes=60)
+        self.customer = make_customer()
+
+    def test_no_availability_means_no_slots(self):
+        self.assertEqual(get_available_slots(self.service, self.staff, MONDAY + timedelta(days=1)), [])
+
+    def test_confirmed_bookings_are_skipped(self):
+        Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='confirmed')
+        self.assertEqual(get_available_slots(self.service, self.staff, MONDAY), [time(9), time(11)])
+
+
+class EarliestSlotsTests(TestCase):
+    def setUp(self):
+        self.alice = make_staff('alice', day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(11))
+        self.bob = make_staff('bob', day_of_week=MONDAY.weekday(), start_time=time(10), end_time=time(12))
+        self.service = make_service(self.alice, self.bob, duration_minutes=60)
+        self.customer = make_customer()
+
+    def test_merges_staff_in_time_order(self):
+        Booking.objects.create(customer=self.customer, staff=self.alice, service=self.service, start_time=aware(MONDAY, 9), status='confirmed')
+        slots = find_earliest_slots(self.service, MONDAY, MONDAY + timedelta(days=6), limit=3)
+        self.assertEqual(
+            [(slot.start_time, slot.staff) for slot in slots],
+            [(aware(MONDAY, 10), self.alice), (aware(MONDAY, 10), self.bob), (aware(MONDAY, 10, 15), self.bob)],
+        )
+
+    def test_query_count_does_not_grow_with_staff_or_days(self):
+        for name in ('carol', 'dave', 'erin'):
+            self.service.staff_members.add(make_staff(name, day_of_week=1, start_time=time(9), end_time=time(17)))
+        with self.assertNumQueries(3):
+            find_earliest_slots(self.service, MONDAY, MONDAY + timedelta(days=30))
+
+    def test_any_stylist_view_and_api(self):
+        self.client.force_login(self.customer)
+        url = reverse('booking:book_service', args=[self.service.id])
+        response = self.client.get(url, {'staff': 'any', 'date': MONDAY.isoformat()})
+        self.assertContains(response, 'with Alice')
+        response = self.client.get(reverse('booking:earliest_slots', args=[self.service.id]), {'start': MONDAY.isoformat(), 'limit': 1})
+        self.assertEqual(response.json()['slots'], [{'start_time': aware(MONDAY, 9).isoformat(), 'staff_id': self.alice.id, 'staff_name': 'Alice'}])
+
+
+class SlotCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_stats()
+        self.staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(12))
+        self.service = make_service(self.staff, duration_minutes=60)
+        self.customer = make_customer()
+
+    def test_second_lookup_is_a_hit_without_queries(self):
+        cached_available_slots(self.service, self.staff, MONDAY)
+        with self.assertNumQueries(0):
+            slots = cached_available_slots(self.service, self.staff, MONDAY)
+        self.assertEqual(slots, [time(9), time(9, 15), time(9, 30), time(9, 45), time(10), time(10, 15), time(10, 30), time(10, 45), time(11)])
+        self.assertEqual(get_stats()['hits'], 1)
+        self.assertEqual(get_stats()['misses'], 1)
+
+    def test_booking_status_change_invalidates_the_day(self):
+        booking = Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10))
+        self.assertIn(time(10), cached_available_slots(self.service, self.staff, MONDAY))
+        booking.status = 'confirmed'
+        booking.save()
+        self.assertEqual(cached_available_slots(self.service, self.staff, MONDAY), [time(9), time(11)])
+        booking.status = 'cancelled'
+        booking.save()
+        self.assertIn(time(10), cached_available_slots(self.service, self.staff, MONDAY))
+        self.assertEqual(get_stats()['hits'], 0)
+
+    def test_versions_are_bumped_again_when_the_write_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='confirmed')
+            # Stands in for a lookup elsewhere that still sees the rows from before the commit.
+            cached_available_slots(self.service, self.staff, MONDAY)
+        cached_available_slots(self.service, self.staff, MONDAY)
+        self.assertEqual(get_stats()['misses'], 2)
+
+    def test_moving_a_booking_frees_the_day_it_left(self):
+        booking = Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='confirmed')
+        self.assertEqual(cached_available_slots(self.service, self.staff, MONDAY), [time(9), time(11)])
+        booking = Booking.objects.get(pk=booking.pk) # As the admin would load it.
+        booking.start_time, booking.end_time = aware(MONDAY + timedelta(days=7), 10), aware(MONDAY + timedelta(days=7), 11)
+        booking.save()
+        self.assertIn(time(10), cached_available_slots(self.service, self.staff, MONDAY))
+
+    def test_availability_change_invalidates_the_staff_member(self):
+        cached_available_slots(self.service, self.staff, MONDAY)
+        Availability.objects.filter(staff=self.staff).get().delete()
+        self.assertEqual(cached_available_slots(self.service, self.staff, MONDAY), [])
+
+
+class SlotWindowApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(12))
+        Availability.objects.create(staff=self.staff, day_of_week=2, start_time=time(14), end_time=time(16)) # Wednesdays.
+        self.service = make_service(self.staff, duration_minutes=60)
+        self.customer = make_customer()
+        self.url = reverse('booking:slot_window', args=[self.service.id])
+        self.params = {'staff': self.staff.id, 'start': MONDAY.isoformat()}
+
+    def test_a_week_of_slots_in_one_response(self):
+        Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='confirmed')
+        with self.assertNumQueries(4): # Service, stylist check, working hours, bookings.
+            response = self.client.get(self.url, self.params)
+        days = response.json()['days']
+        self.assertEqual([day['date'] for day in days], [(MONDAY + timedelta(days=offset)).isoformat() for offset in range(7)])
+        self.assertEqual(days[0]['slots'], ['09:00', '11:00'])
+        self.assertEqual(days[2]['slots'], ['14:00', '14:15', '14:30', '14:45', '15:00'])
+        self.assertEqual(days[1]['slots'], [])
+        for offset, day in enumerate(days): # The same answer as the one-day lookup.
+            slots = get_available_slots(self.service, self.staff, MONDAY + timedelta(days=offset))
+            self.assertEqual(day['slots'], [slot.strftime('%H:%M') for slot in slots])
+
+    def test_unchanged_windows_answer_304_without_queries(self):
+        etag = self.client.get(self.url, self.params)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY + timedelta(days=2), 14), status='confirmed')
+        response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['days'][2]['slots'], ['15:00'])
+
+    def test_an_expired_hold_stops_the_old_etag_matching(self):
+        Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='pending', hold_expires_at=timezone.now() + timedelta(minutes=5))
+        response = self.client.get(self.url, self.params)
+        self.assertEqual(response.json()['days'][0]['slots'], ['09:00', '11:00'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # The hold lapses without any save, so no version is bumped.
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(minutes=6)):
+            response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('10:00', response.json()['days'][0]['slots'])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(self.url, {'staff': 'any'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'staff': self.staff.id, 'start': 'soon'}).status_code, 400)
+        other = make_staff('other')
+        self.assertEqual(self.client.get(self.url, {'staff': other.id}).status_code, 404)
+
+    def test_booking_form_points_the_script_at_the_api(self):
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('booking:book_service', args=[self.service.id]))
+        self.assertContains(response, f'data-slots-url="{self.url}"')
+        self.assertContains(response, 'booking/booking_form.js')
+
+
+class ReserveSlotTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(12))
+        self.service = make_service(self.staff, duration_minutes=60)
+        self.customer = make_customer()
+
+    def test_only_offered_future_times_can_be_held(self):
+        for start in (aware(MONDAY, 8), aware(MONDAY, 11, 30), aware(MONDAY, 10, 5), aware(MONDAY + timedelta(days=1), 10), aware(date(2020, 1, 6), 10)):
+            with self.subTest(start=start), self.assertRaises(SlotUnavailable):
+                reserve_slot(self.customer, self.staff, self.service, start)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_live_hold_blocks_overlapping_times(self):
+        hold = reserve_slot(self.customer, self.staff, self.service, aware(MONDAY, 10))
+        self.assertEqual(hold.status, 'pending')
+        self.assertEqual(get_available_slots(self.service, self.staff, MONDAY), [time(9), time(11)])
+        with self.assertRaises(SlotUnavailable):
+            reserve_slot(self.customer, self.staff, self.service, aware(MONDAY, 10, 30))
+
+    def test_expired_hold_is_released(self):
+        hold = reserve_slot(self.customer, self.staff, self.service, aware(MONDAY, 10))
+        Booking.objects.filter(pk=hold.pk).update(hold_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIn(time(10), get_available_slots(self.service, self.staff, MONDAY))
+        again = reserve_slot(self.customer, self.staff, self.service, aware(MONDAY, 10))
+        self.assertFalse(Booking.objects.filter(pk=hold.pk).exists())
+        self.assertEqual(Booking.objects.get().pk, again.pk)
+
+    def test_database_rejects_a_second_live_booking_for_the_same_start(self):
+        reserve_slot(self.customer, self.staff, self.service, aware(MONDAY, 10))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='confirmed')
+
+
+class ReserveSlotStressTests(TransactionTestCase):
+    """Many threads race for the same few slots; exactly one hold per slot may win."""
+
+    def test_concurrent_reservations_never_overlap(self):
+        staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(12))
+        service = make_service(staff, duration_minutes=60)
+        customers = [make_customer(f'customer{i}') for i in range(8)]
+        starts = [aware(MONDAY, 10), aware(MONDAY, 10, 30), aware(MONDAY, 11)]
+        outcomes, errors = [], []
+
+        def attempt(customer):
+            try:
+                for start in starts * 3:
+                    try:
+                        reserve_slot(customer, staff, service, start)
+                        outcomes.append('held')
+                    except SlotUnavailable:
+                        outcomes.append('rejected')
+            except Exception as exc:  # Anything else (e.g. a lock error) fails the test.
+                errors.append(exc)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=attempt, args=(customer,)) for customer in customers]
+        started = timezone.now()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = (timezone.now() - started).total_seconds()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(outcomes), len(customers) * len(starts) * 3)
+        holds = list(Booking.objects.filter(status='pending').order_by('start_time'))
+        # 10:00 and 11:00 fit side by side; 10:30 overlaps both, so at most two holds.
+        for earlier, later in zip(holds, holds[1:]):
+            self.assertLessEqual(earlier.end_time, later.start_time)
+        self.assertGreaterEqual(len(holds), 1)
+        self.assertEqual(outcomes.count('held'), len(holds))
+        self.assertLess(elapsed, 10, f'{len(outcomes)} reservations took {elapsed:.2f}s')
+
+
+class BookingQueryPlanTests(TestCase):
+    """Runs the hot booking queries for real and checks SQLite's plan for each one."""
+
+    def setUp(self):
+        self.staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(17))
+        self.service = make_service(self.staff, duration_minutes=60)
+        self.customer = make_customer()
+        Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='confirmed')
+
+    def assertNoFullScans(self, queries):
+        booking_queries = [query['sql'] for query in queries if 'booking_booking' in query['sql'] and query['sql'].startswith('SELECT')]
+        self.assertTrue(booking_queries)
+        with connection.cursor() as cursor:
+            for sql in booking_queries:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = ' | '.join(row[-1] for row in cursor.fetchall())
+                self.assertFalse(re.search(r'SCAN booking_booking(?! USING)', plan), f'{sql}\n-> {plan}')
+                # The time range itself must be served by an index, not just the foreign key.
+                self.assertRegex(plan, r'INDEX booking_\w+ \([^)]*start_time[<>]', sql)
+
+    def test_slot_queries_use_indexes(self):
+        with CaptureQueriesContext(connection) as queries:
+            get_available_slots(self.service, self.staff, MONDAY)
+            find_earliest_slots(self.service, MONDAY, MONDAY + timedelta(days=6))
+            reserve_slot(self.customer, self.staff, self.service, aware(MONDAY, 14))
+        self.assertNoFullScans(queries)
+
+    def test_page_queries_use_indexes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.force_login(self.customer)
+            self.client.get(reverse('booking:my_bookings'))
+            self.client.force_login(self.staff.user_profile.user)
+            self.client.get(reverse('booking:staff_dashboard'))
+        self.assertNoFullScans(queries)
+
+    def test_reminder_claim_uses_the_due_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command('send_reminders', stdout=io.StringIO())
+        [claim] = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {claim}')
+            plan = ' | '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('SEARCH booking_reminderjob USING INDEX reminder_due (due_at<?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan) # Already in due order; no sort.
+
+
+class ReapPendingBookingsTests(TestCase):
+    def test_only_old_expired_holds_are_deleted_in_chunks(self):
+        staff = make_staff()
+        service = make_service(staff)
+        customer = make_customer()
+        now = timezone.now()
+        def booking(hour, status='pending', hold_expires_at=None, age=timedelta(hours=3)):
+            created = Booking.objects.create(customer=customer, staff=staff, service=service, start_time=aware(MONDAY, hour), status=status, hold_expires_at=hold_expires_at)
+            Booking.objects.filter(pk=created.pk).update(created_at=now - age)
+            return created
+        abandoned = [booking(hour, hold_expires_at=now - timedelta(hours=2)) for hour in (8, 9, 10, 11, 12)]
+        kept = [
+            booking(13, hold_expires_at=now - timedelta(minutes=5), age=timedelta(minutes=40)), # Too young.
+            booking(14, hold_expires_at=now + timedelta(minutes=5)), # Hold still live.
+            booking(15, status='confirmed'),
+        ]
+
+        out = io.StringIO()
+        call_command('reap_pending_bookings', '--chunk-size', '2', '--pause', '0', stdout=out)
+        self.assertIn('Removed 5 abandoned', out.getvalue())
+        self.assertFalse(Booking.objects.filter(pk__in=[b.pk for b in abandoned]).exists())
+        self.assertEqual(Booking.objects.filter(pk__in=[b.pk for b in kept]).count(), 3)
+
+
+class SendRemindersTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(17))
+        self.service = make_service(self.staff)
+        tomorrow = timezone.now() + timedelta(hours=30)
+        self.bookings = [
+            Booking.objects.create(customer=make_customer(f'customer{i}'), staff=self.staff, service=self.service, start_time=tomorrow + timedelta(hours=i), status='confirmed')
+            for i in range(5)
+        ]
+        self.later = Booking.objects.create(customer=make_customer('later'), staff=self.staff, service=self.service, start_time=tomorrow + timedelta(days=3), status='confirmed')
+        sync_reminder_jobs(self.bookings + [self.later])
+
+    def test_jobs_follow_confirmation_and_cancellation(self):
+        booking = reserve_slot(make_customer('new'), self.staff, self.service, aware(MONDAY, 9))
+        self.assertFalse(ReminderJob.objects.filter(booking=booking).exists())
+        post_webhook(self.client, completed_checkout('evt_1', booking))
+        process_stripe_events()
+        self.assertEqual(ReminderJob.objects.get(booking=booking).due_at, aware(MONDAY, 9) - timedelta(hours=24))
+        cancel_booking(Booking.objects.get(pk=booking.pk))
+        self.assertFalse(ReminderJob.objects.filter(booking=booking).exists())
+
+    def test_due_reminders_are_queued_once(self):
+        ReminderJob.objects.filter(booking__in=self.bookings).update(due_at=timezone.now() - timedelta(minutes=1))
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('send_reminders', '--batch-size', '2', stdout=out)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 3) # One per batch.
+        self.assertIn('5 queued, 0 skipped', out.getvalue())
+        self.assertFalse(ReminderJob.objects.filter(booking=self.later, sent_at__isnull=False).exists())
+
+        # Running again (cron firing twice, a second worker) finds nothing to do.
+        out = io.StringIO()
+        with self.assertNumQueries(3): # Savepoint, the claim query, release.
+            call_command('send_reminders', stdout=out)
+        self.assertIn('0 queued, 0 skipped', out.getvalue())
+
+        call_command('deliver_outbox', '--once', stdout=io.StringIO())
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), [f'customer{i}@example.com' for i in range(5)])
+
+    def test_old_bulk_mode_options_still_run(self):
+        ReminderJob.objects.filter(booking__in=self.bookings).update(due_at=timezone.now() - timedelta(minutes=1))
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('send_reminders', '--bulk', '--chunk-size', '2', stdout=out)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 3) # Same batches as --batch-size 2.
+        self.assertIn('5 queued, 0 skipped', out.getvalue())
+
+    def test_daemon_sleeps_until_the_next_reminder(self):
+        ReminderJob.objects.filter(booking__in=self.bookings).update(due_at=timezone.now() + timedelta(seconds=20))
+        with mock.patch('booking.management.commands.send_reminders.time.sleep', side_effect=KeyboardInterrupt) as sleep:
+            call_command('send_reminders', '--daemon', stdout=io.StringIO())
+        self.assertAlmostEqual(sleep.call_args[0][0], 20, delta=2)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        staff = make_staff()
+        self.booking = Booking.objects.create(customer=make_customer(), staff=staff, service=make_service(staff), start_time=aware(MONDAY, 10))
+
+    def test_confirmation_goes_to_the_outbox_not_the_mail_server(self):
+        post_webhook(self.client, completed_checkout('evt_1', self.booking))
+        call_command('process_stripe_events', '--once', stdout=io.StringIO())
+        self.assertEqual(mail.outbox, [])
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.booking, message.to_email), (self.booking, 'customer@example.com'))
+
+        call_command('deliver_outbox', '--once', stdout=io.StringIO())
+        self.assertEqual(mail.outbox[0].subject, 'Your StyleSync appointment is confirmed!')
+
+    def test_failures_are_retried_with_backoff(self):
+        queue_booking_email(self.booking, 'reminder')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('SMTP down')):
+            call_command('deliver_outbox', '--once', stdout=io.StringIO())
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.attempts, message.last_error), ('pending', 1, 'SMTP down'))
+        self.assertGreater(message.next_attempt_at, timezone.now())
+
+        # Once it is due again, the next run delivers it.
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+        call_command('deliver_outbox', '--once', stdout=io.StringIO())
+        self.assertEqual(OutboxMessage.objects.get().status, 'sent')
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_an_unreachable_mail_server_stops_the_batch_without_losing_track(self):
+        for _ in range(3):
+            queue_booking_email(self.booking, 'reminder')
+        # The first email goes out, the second fails, and reconnecting fails too.
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=[1, OSError('SMTP down')]), \
+                mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=[None, OSError('Connection refused')]):
+            call_command('deliver_outbox', '--once', stdout=io.StringIO())
+        first, second, third = OutboxMessage.objects.order_by('id')
+        self.assertEqual(first.status, 'sent') # Not resent when the claim runs out.
+        self.assertEqual((second.status, second.attempts), ('pending', 1))
+        self.assertEqual((third.status, third.attempts), ('pending', 0))
+        self.assertGreater(third.next_attempt_at, timezone.now())
+
+
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(17))
+        service = make_service(staff)
+        self.bookings = [
+            reserve_slot(make_customer(f'customer{i}'), staff, service, aware(MONDAY, 9 + i)) for i in range(3)
+        ]
+
+    def test_webhook_only_stores_the_event(self):
+        with self.assertNumQueries(3): # Savepoint, insert, release.
+            response = post_webhook(self.client, completed_checkout('evt_1', self.bookings[0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Booking.objects.get(pk=self.bookings[0].pk).status, 'pending')
+
+    def test_redelivered_events_are_stored_once(self):
+        for _ in range(3):
+            self.assertEqual(post_webhook(self.client, completed_checkout('evt_1', self.bookings[0])).status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+    def test_worker_confirms_a_batch_in_a_fixed_number_of_queries(self):
+        for i, booking in enumerate(self.bookings):
+            post_webhook(self.client, completed_checkout(f'evt_{i}', booking))
+        post_webhook(self.client, completed_checkout('evt_again', self.bookings[0])) # Same booking, new event id.
+        # 7 for the batch itself, 1 to note the duplicate payment, 7 to add the
+        # three bookings to their one daily rollup row, and 1 to schedule their reminders.
+        with self.assertNumQueries(16), self.assertLogs('booking.stripe_events', 'WARNING'):
+            self.assertEqual(process_stripe_events(), 4)
+        self.assertEqual(set(Booking.objects.values_list('status', flat=True)), {'confirmed'})
+        self.assertEqual(OutboxMessage.objects.count(), 3)
+        self.assertEqual(process_stripe_events(), 0)
+
+    def test_payments_for_missing_bookings_are_flagged(self):
+        post_webhook(self.client, completed_checkout('evt_1', self.bookings[0]))
+        self.bookings[0].delete() # The hold ran out and was reaped before the payment arrived.
+        with self.assertLogs('booking.stripe_events', 'WARNING') as logs:
+            process_stripe_events()
+        event = StripeEvent.objects.get()
+        self.assertIsNotNone(event.processed_at)
+        self.assertEqual(event.problem, 'Paid, but the booking no longer exists.')
+        self.assertIn('evt_1', logs.output[0])
+
+    def test_unhandled_event_types_are_not_stored(self):
+        response = post_webhook(self.client, {'id': 'evt_1', 'type': 'charge.refunded', 'data': {'object': {}}})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(StripeEvent.objects.exists())
+
+
+class AsyncCheckoutTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(17))
+        self.service = make_service(self.staff)
+        self.url = reverse('booking:checkout', args=[self.service.id])
+
+    async def checkout(self, hour):
+        return await self.async_client.post(self.url, {'staff': self.staff.id, 'date': MONDAY.isoformat(), 'time': f'{hour:02}:00:00'})
+
+    async def test_checkout_holds_the_slot_and_redirects_to_stripe(self):
+        await self.async_client.aforce_login(await sync_to_async(make_customer)())
+        with stub_stripe():
+            response = await self.checkout(10)
+        self.assertEqual((response.status_code, response['Location']), (302, 'https://checkout.stripe.test/cs_test_1'))
+        booking = await Booking.objects.aget()
+        self.assertEqual((booking.status, booking.stripe_session_id), ('pending', 'cs_test_1'))
+
+    async def test_waiting_on_stripe_does_not_hold_up_other_checkouts(self):
+        await self.async_client.aforce_login(await sync_to_async(make_customer)())
+        hours = range(9, 17)
+        # The stub only answers once all eight calls are waiting on it at the same time.
+        with stub_stripe(wait=threading.Barrier(len(hours), timeout=30).wait):
+            responses = await asyncio.gather(*(self.checkout(hour) for hour in hours))
+        self.assertTrue(all(response['Location'].startswith('https://checkout.stripe.test/') for response in responses))
+        self.assertEqual(await Booking.objects.filter(status='pending').acount(), len(hours))
+
+    async def test_a_busy_payment_provider_releases_the_hold(self):
+        await self.async_client.aforce_login(await sync_to_async(make_customer)())
+        with mock.patch('booking.views.create_checkout_session', side_effect=PaymentProviderBusy):
+            response = await self.checkout(10)
+        self.assertEqual(response['Location'], reverse('booking:book_service', args=[self.service.id]))
+        self.assertEqual(await Booking.objects.acount(), 0) # The slot is free again.
+
+    def test_the_concurrency_limit_covers_every_event_loop_in_the_process(self):
+        # Under WSGI each async view runs in its own event loop, like each thread here.
+        release = threading.Event()
+        with stub_stripe(wait=lambda: release.wait(30)), mock.patch('booking.payments.STRIPE_MAX_CONCURRENT_REQUESTS', 2), \
+                mock.patch('booking.payments.STRIPE_QUEUE_TIMEOUT_SECONDS', 0.1), ThreadPoolExecutor(4) as pool:
+            calls = [pool.submit(async_to_sync(create_checkout_session), {}) for _ in range(4)]
+            try:
+                # Two calls hold the only slots until released, so the first two to finish were turned away.
+                finished = as_completed(calls, timeout=30)
+                turned_away = [next(finished), next(finished)]
+            finally:
+                release.set()
+            served = list(finished)
+        self.assertTrue(all(isinstance(call.exception(), PaymentProviderBusy) for call in turned_away))
+        self.assertTrue(all(call.result().url.startswith('https://checkout.stripe.test/') for call in served))
+
+
+class MyBookingsTests(TestCase):
+    def setUp(self):
+        staff = make_staff()
+        self.service = make_service(staff)
+        self.customer = make_customer()
+        start = timezone.now() - timedelta(days=60)
+        for i in range(45):
+            Booking.objects.create(customer=self.customer, staff=staff, service=self.service, start_time=start + timedelta(days=i), status='completed')
+        # Two bookings at the same time must both appear exactly once.
+        Booking.objects.create(customer=self.customer, staff=make_staff('other'), service=self.service, start_time=start + timedelta(days=10), status='cancelled')
+        Booking.objects.create(customer=self.customer, staff=staff, service=self.service, start_time=timezone.now() + timedelta(days=2), status='confirmed')
+        self.client.force_login(self.customer)
+
+    def test_pages_through_all_past_bookings_in_constant_queries(self):
+        self.client.get(reverse('booking:home')) # Stores the user's role in the session.
+        seen, url = [], reverse('booking:my_bookings')
+        while url:
+            with self.assertNumQueries(5): # Session, user, upcoming, one page each from bookings and the archive.
+                response = self.client.get(url)
+            seen += [booking.id for booking in response.context['past_bookings']]
+            cursor = response.context['next_cursor']
+            url = f"{reverse('booking:my_bookings')}?before={cursor}" if cursor else None
+        expected = Booking.objects.filter(start_time__lt=timezone.now()).order_by('-start_time', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_history_reads_through_into_the_archive(self):
+        expected = list(Booking.objects.filter(start_time__lt=timezone.now()).order_by('-start_time', '-id').values_list('id', flat=True))
+        old = Booking.objects.filter(end_time__lt=timezone.now() - timedelta(days=30)).count()
+        first_page = self.client.get(reverse('booking:my_bookings'))
+        # Archive the oldest bookings while the customer is paging.
+        out = io.StringIO()
+        call_command('archive_bookings', '--days', '30', '--batch-size', '7', '--pause', '0', stdout=out)
+        self.assertIn(f'Archived {old} booking(s)', out.getvalue())
+        self.assertEqual(BookingArchive.objects.count(), old)
+        self.assertFalse(Booking.objects.filter(end_time__lt=timezone.now() - timedelta(days=30)).exists())
+
+        seen = [booking.id for booking in first_page.context['past_bookings']]
+        cursor = first_page.context['next_cursor']
+        while cursor:
+            response = self.client.get(reverse('booking:my_bookings'), {'before': cursor})
+            seen += [booking.id for booking in response.context['past_bookings']]
+            cursor = response.context['next_cursor']
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_shows_the_first_page(self):
+        response = self.client.get(reverse('booking:my_bookings'), {'before': 'nonsense'})
+        self.assertTrue(response.context['is_first_page'])
+
+
+class StaffScheduleApiTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff()
+        service = make_service(self.staff)
+        soon = timezone.now() + timedelta(days=1)
+        self.bookings = [
+            Booking.objects.create(customer=make_customer(f'customer{i}'), staff=self.staff, service=service, start_time=soon + timedelta(hours=i), status='confirmed')
+            for i in range(3)
+        ]
+        self.client.force_login(self.staff.user_profile.user)
+        self.url = reverse('booking:staff_schedule_api')
+
+    def test_full_schedule_then_not_modified(self):
+        response = self.client.get(self.url)
+        data = response.json()
+        self.assertTrue(data['full'])
+        self.assertEqual([booking['id'] for booking in data['bookings']], [booking.id for booking in self.bookings])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_since_returns_only_changes(self):
+        cursor = self.client.get(self.url).json()['cursor']
+        old_rows = Booking.objects.filter(pk__in=[self.bookings[0].pk, self.bookings[1].pk])
+        old_rows.update(updated_at=timezone.now() - timedelta(minutes=5)) # Long before the cursor.
+        cursor = self.client.get(self.url).json()['cursor']
+
+        delta = self.client.get(self.url, {'since': cursor})
+        self.assertEqual(self.client.get(self.url, {'since': cursor}, HTTP_IF_NONE_MATCH=delta['ETag']).status_code, 304)
+
+        cancelled = Booking.objects.get(pk=self.bookings[0].pk)
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        changes = self.client.get(self.url, {'since': cursor}, HTTP_IF_NONE_MATCH=delta['ETag']).json()['bookings']
+        statuses = {row['id']: row['status'] for row in changes}
+        self.assertEqual(statuses[cancelled.id], 'cancelled')
+        self.assertNotIn(self.bookings[1].id, statuses) # Unchanged since the cursor.
+
+    def test_malformed_cursors_are_rejected(self):
+        for since in ('soon', '-5', '\u0661\u0662', '9' * 30, str(253_402_300_800 * 10**6)): # The last two are past the year 9999.
+            with self.subTest(since=since):
+                response = self.client.get(self.url, {'since': since})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid since cursor.'})
+
+    def test_customers_cannot_read_schedules(self):
+        self.client.force_login(make_customer('nosy'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class StaffRoleTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff()
+        self.client.force_login(self.staff.user_profile.user)
+        self.client.get(reverse('booking:home')) # Stores the role in the session.
+
+    def test_staff_pages_resolve_the_staff_member_once(self):
+        with self.assertNumQueries(4): # Session, user, profile with its staff row (the role check), bookings.
+            response = self.client.get(reverse('booking:staff_dashboard'))
+        self.assertEqual(response.context['staff_member'], self.staff)
+        self.assertContains(response, 'Welcome, Stylist')
+
+    def test_a_profile_change_reaches_existing_sessions(self):
+        profile = self.staff.user_profile
+        profile.user_type = 'customer'
+        profile.save()
+        self.assertEqual(self.client.get(reverse('booking:staff_dashboard')).status_code, 403)
+        self.assertContains(self.client.get(reverse('booking:home')), 'My Bookings')
+
+    def test_staff_pages_check_the_role_in_the_database(self):
+        # update() skips the signal, like a worker whose own cache never saw the bump.
+        UserProfile.objects.filter(pk=self.staff.user_profile.pk).update(user_type='customer')
+        self.assertEqual(self.client.get(reverse('booking:staff_dashboard')).status_code, 403)
+        self.assertEqual(self.client.post(reverse('booking:manage_availability'), {}).status_code, 403)
+
+
+class AvailabilityImportExportTests(TestCase):
+    def setUp(self):
+        self.anna = make_staff('anna', day_of_week=0, start_time=time(9), end_time=time(17))
+        self.ben = make_staff('ben', day_of_week=1, start_time=time(10), end_time=time(18))
+
+    def import_file(self, text, *args):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as source:
+            source.write(text)
+        self.addCleanup(os.remove, path)
+        out = io.StringIO()
+        call_command('import_availability', path, *args, stdout=out)
+        return out.getvalue()
+
+    def hours(self, staff):
+        return list(staff.availabilities.order_by('day_of_week').values_list('day_of_week', 'start_time', 'end_time'))
+
+    def test_import_creates_updates_and_replaces(self):
+        csv_text = 'staff,day_of_week,start_time,end_time\nanna,Monday,08:00,16:00\nanna,2,09:00,17:00\nben,Friday,12:00,20:00\n'
+        self.assertIn('2 created, 1 updated, 1 deleted', self.import_file(csv_text, '--replace'))
+        self.assertEqual(self.hours(self.anna), [(0, time(8), time(16)), (2, time(9), time(17))])
+        self.assertEqual(self.hours(self.ben), [(4, time(12), time(20))]) # Tuesday was not listed.
+
+    def test_a_bad_file_changes_nothing(self):
+        csv_text = 'staff,day_of_week,start_time,end_time\nanna,Monday,08:00,16:00\nanna,Funday,09:00,17:00\nnobody,0,09:00,17:00\n'
+        with self.assertRaisesMessage(CommandError, 'Row 2: unknown day'):
+            self.import_file(csv_text)
+        self.assertEqual(self.hours(self.anna), [(0, time(9), time(17))])
+
+    def test_export_round_trips(self):
+        out = io.StringIO()
+        call_command('export_availability', '--format', 'jsonl', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(rows[0], {'staff': 'anna', 'day_of_week': 0, 'start_time': '09:00', 'end_time': '17:00'})
+        self.assertIn('0 created, 0 updated, 0 deleted', self.import_file('staff,day_of_week,start_time,end_time\n' + ''.join(
+            f"{row['staff']},{row['day_of_week']},{row['start_time']},{row['end_time']}\n" for row in rows
+        )))
+
+    def test_the_availability_form_saves_in_bulk(self):
+        self.client.force_login(self.anna.user_profile.user)
+        self.client.get(reverse('booking:home')) # Stores the role in the session.
+        existing = self.anna.availabilities.get()
+
+        def post(days, opening):
+            data = {'form-TOTAL_FORMS': str(1 + len(days)), 'form-INITIAL_FORMS': '1', 'form-MIN_NUM_FORMS': '0', 'form-MAX_NUM_FORMS': '7',
+                    'form-0-id': str(existing.id), 'form-0-day_of_week': '0', 'form-0-start_time': opening, 'form-0-end_time': '15:00'}
+            for index, day in enumerate(days, start=1):
+                data.update({f'form-{index}-day_of_week': str(day), f'form-{index}-start_time': '09:00', f'form-{index}-end_time': '17:00'})
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('booking:manage_availability'), data)
+            return len(queries)
+
+        one_day = post([1], '08:00')
+        Availability.objects.filter(staff=self.anna, day_of_week__gt=0).delete()
+        self.assertEqual(post([1, 2, 3, 4, 5], '07:00'), one_day)
+        self.assertEqual(len(self.hours(self.anna)), 6)
+        self.assertEqual(self.hours(self.anna)[0], (0, time(7), time(15)))
+
+
+class BookingAdminTests(TestCase):
+    def setUp(self):
+        self.staff = staff = make_staff()
+        self.service = service = make_service(staff)
+        self.customer = make_customer()
+        self.bookings = [
+            Booking.objects.create(customer=self.customer, staff=staff, service=service, start_time=aware(MONDAY, hour), status='pending', hold_expires_at=aware(MONDAY, 0))
+            for hour in range(8, 14)
+        ]
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        self.url = reverse('admin:booking_booking_changelist')
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        staff, service = make_staff('second'), make_service(name='Colour')
+        for hour in range(8, 18):
+            Booking.objects.create(customer=make_customer(f'c{hour}'), staff=staff, service=service, start_time=aware(MONDAY, hour), status='confirmed')
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(self.url)
+        self.assertEqual(len(many), len(few))
+
+    def test_reminder_job_changelist_queries_do_not_grow_with_rows(self):
+        url = reverse('admin:booking_reminderjob_changelist')
+        for booking in self.bookings[:2]:
+            ReminderJob.objects.get_or_create(booking=booking, defaults={'due_at': aware(MONDAY, 0)})
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        for booking in self.bookings[2:]:
+            ReminderJob.objects.get_or_create(booking=booking, defaults={'due_at': aware(MONDAY, 0)})
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(many), len(few))
+
+    def test_status_actions_are_one_update_per_chunk(self):
+        data = {'action': 'mark_cancelled', '_selected_action': [booking.id for booking in self.bookings]}
+        with mock.patch('booking.admin.STATUS_ACTION_CHUNK_SIZE', 4), CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, data)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "booking_booking"')]), 2)
+        self.assertEqual(Booking.objects.filter(status='cancelled', hold_expires_at__isnull=True).count(), 6)
+
+    def test_confirming_skips_bookings_that_overlap_a_live_one(self):
+        Booking.objects.create(customer=make_customer('other'), staff=self.staff, service=self.service, start_time=aware(MONDAY, 10, 30), status='confirmed')
+        late = Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 8, 30), status='pending', hold_expires_at=timezone.now())
+        data = {'action': 'mark_confirmed', '_selected_action': [booking.id for booking in self.bookings] + [late.id]}
+        self.client.post(self.url, data)
+        # 10:00 and 11:00 overlap the other customer's 10:30; 8:30 overlaps the 8:00 confirmed with it.
+        left = Booking.objects.filter(customer=self.customer, status='pending').order_by('start_time').values_list('start_time', flat=True)
+        self.assertEqual(list(left), [aware(MONDAY, 8, 30), aware(MONDAY, 10), aware(MONDAY, 11)])
+        self.assertEqual(Booking.objects.filter(customer=self.customer, status='confirmed').count(), 4)
+
+    def test_unfiltered_counts_use_the_table_estimate(self):
+        with mock.patch('booking.admin.estimated_row_count', return_value=2_000_000):
+            self.assertEqual(EstimatedCountPaginator(Booking.objects.order_by('-id'), 50).count, 2_000_000)
+            self.assertEqual(EstimatedCountPaginator(Booking.objects.filter(status='pending').order_by('-id'), 50).count, 6)
+        with mock.patch('booking.admin.estimated_row_count', return_value=None):
+            self.assertEqual(EstimatedCountPaginator(Booking.objects.order_by('-id'), 50).count, 6)
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff()
+        service = make_service(self.staff, name='Cut, wash; style')
+        self.customer = make_customer()
+        self.booking = Booking.objects.create(customer=self.customer, staff=self.staff, service=service, start_time=aware(MONDAY, 10), status='confirmed')
+        Booking.objects.create(customer=self.customer, staff=self.staff, service=service, start_time=aware(MONDAY, 12), status='cancelled')
+        self.url = reverse('booking:calendar_feed', args=[feed_token('customer', self.customer.id)])
+
+    def test_feed_streams_the_bookings(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 1) # The cancelled booking is left out.
+        self.assertIn(f'UID:booking-{self.booking.id}@testserver', body)
+        self.assertIn('DTSTART:20300107T100000Z', body)
+        self.assertIn('SUMMARY:Cut\\, wash\\; style with Stylist', body)
+        staff_feed = self.client.get(reverse('booking:calendar_feed', args=[feed_token('staff', self.staff.id)]))
+        self.assertIn('SUMMARY:Cut\\, wash\\; style - Customer', b''.join(staff_feed.streaming_content).decode())
+
+    def test_unchanged_feeds_answer_304(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(2): # One aggregate each for live and archived bookings.
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.booking.status = 'cancelled'
+        self.booking.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_archived_bookings_stay_in_the_feed(self):
+        earlier = Booking.objects.create(customer=self.customer, staff=self.staff, service=self.booking.service, start_time=aware(MONDAY - timedelta(days=7), 10), status='completed')
+        etag = self.client.get(self.url)['ETag']
+        archive_batch(aware(MONDAY, 0))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200) # Moving a booking to the archive changes the ETag.
+        body = b''.join(response.streaming_content).decode()
+        self.assertLess(body.index(f'UID:booking-{earlier.id}@'), body.index(f'UID:booking-{self.booking.id}@'))
+        # The async stream used under ASGI yields the same feed.
+        async def read_async():
+            return ''.join([chunk async for chunk in aics_lines('customer', self.customer.id, 'testserver', batch_size=2)])
+        self.assertEqual(async_to_sync(read_async)(), body)
+
+    def test_tampered_tokens_are_rejected(self):
+        token = feed_token('customer', self.customer.id)
+        self.assertEqual(self.client.get(reverse('booking:calendar_feed', args=[token.replace('customer-', 'staff-')])).status_code, 404)
+
+
+class DailyRollupTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff(day_of_week=0, start_time=time(9), end_time=time(17)) # 480 minutes on Mondays.
+        self.service = make_service(self.staff)
+        self.customer = make_customer()
+
+    def totals(self):
+        return list(DailyRollup.objects.order_by('service_id').values_list('service_id', 'bookings', 'booked_minutes', 'revenue', 'available_minutes'))
+
+    def test_status_changes_update_the_rollup(self):
+        booking = reserve_slot(self.customer, self.staff, self.service, aware(MONDAY, 10))
+        self.assertEqual(self.totals(), []) # Pending bookings do not count.
+        post_webhook(self.client, completed_checkout('evt_1', booking))
+        process_stripe_events()
+        self.assertEqual(self.totals(), [(None, 0, 0, 0, 480), (self.service.id, 1, 60, 40, 0)])
+
+        self.client.force_login(self.customer)
+        self.client.post(reverse('booking:cancel_booking', args=[booking.id]))
+        self.assertEqual(self.totals(), [(None, 0, 0, 0, 480), (self.service.id, 0, 0, 0, 0)])
+        # Cancelling again changes nothing, so the booking is not subtracted twice.
+        self.client.post(reverse('booking:cancel_booking', args=[booking.id]))
+        self.assertEqual(self.totals(), [(None, 0, 0, 0, 480), (self.service.id, 0, 0, 0, 0)])
+
+    def test_completed_bookings_cannot_be_cancelled(self):
+        booking = Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='completed')
+        self.assertFalse(cancel_booking(booking))
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'completed')
+
+    def test_backfill_matches_the_bookings(self):
+        Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 10), status='confirmed')
+        Booking.objects.create(customer=self.customer, staff=self.staff, service=self.service, start_time=aware(MONDAY, 12), status='cancelled')
+        BookingArchive.objects.create(
+            id=999, customer=self.customer, staff=self.staff, service=self.service, status='completed',
+            start_time=aware(MONDAY - timedelta(days=7), 10), end_time=aware(MONDAY - timedelta(days=7), 11, 30),
+            created_at=timezone.now(), updated_at=timezone.now(),
+        )
+        call_command('backfill_rollups', '--batch-days', '3', '--pause', '0', stdout=io.StringIO())
+        rows = DailyRollup.objects.filter(service=self.service).order_by('day').values_list('day', 'bookings', 'booked_minutes')
+        self.assertEqual(list(rows), [(MONDAY - timedelta(days=7), 1, 90), (MONDAY, 1, 60)])
+        # Every day in the range has its available minutes, working or not.
+        self.assertEqual(DailyRollup.objects.filter(service=None).count(), 8)
+        self.assertEqual(DailyRollup.objects.get(service=None, day=MONDAY).available_minutes, 480)
+
+    def test_utilization_report_reads_only_rollups(self):
+        DailyRollup.objects.create(staff=self.staff, service=self.service, day=MONDAY, bookings=2, booked_minutes=120, revenue='80.00')
+        self.client.force_login(self.staff.user_profile.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('booking:staff_utilization'), {'start': MONDAY.isoformat(), 'end': MONDAY.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'booking_booking' in query['sql']])
+        self.assertFalse([query for query in queries if 'booking_dailyrollup' in query['sql'] and not query['sql'].startswith('SELECT')])
+        [row] = response.context['staff_rows']
+        self.assertEqual((row['booked_minutes'], row['available_minutes'], row['utilization']), (120, 480, 25.0))
+        self.assertEqual(response.context['service_rows'][0]['revenue'], 80)
+
+    def test_stored_available_minutes_outlive_new_working_hours(self):
+        call_command('backfill_rollups', '--available-only', '--start', MONDAY.isoformat(), stdout=io.StringIO())
+        Availability.objects.filter(staff=self.staff).update(end_time=time(13)) # update() skips the signal, as for a past day.
+        rebuild_rollups(MONDAY, MONDAY)
+        self.assertEqual(DailyRollup.objects.get(service=None, day=MONDAY).available_minutes, 480)
+        rebuild_rollups(MONDAY, MONDAY, reset_available=True)
+        self.assertEqual(DailyRollup.objects.get(service=None, day=MONDAY).available_minutes, 240)
+
+    def test_new_working_hours_reach_future_days(self):
+        self.client.force_login(self.staff.user_profile.user)
+        url = reverse('booking:staff_utilization')
+        self.client.get(url, {'start': MONDAY.isoformat(), 'end': MONDAY.isoformat()})
+        availability = Availability.objects.get(staff=self.staff)
+        availability.end_time = time(13)
+        availability.save()
+        response = self.client.get(url, {'start': MONDAY.isoformat(), 'end': MONDAY.isoformat()})
+        self.assertEqual(response.context['staff_rows'][0]['available_minutes'], 240)
+
+
+class HomeCatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = make_staff()
+        self.service = make_service(self.staff, name='Colour')
+
+    def test_warm_home_page_runs_no_queries(self):
+        self.client.get(reverse('booking:home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('booking:home'))
+        self.assertContains(response, 'Colour')
+
+    def test_service_and_staff_changes_refresh_the_catalog(self):
+        self.client.get(reverse('booking:home'))
+        self.service.name = 'Balayage'
+        self.service.save()
+        self.assertContains(self.client.get(reverse('booking:home')), 'Balayage')
+
+        version = get_catalog_version()
+        self.service.staff_members.remove(self.staff)
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+class RetryOnLockTests(TransactionTestCase):
+    def test_lock_errors_are_retried_a_bounded_number_of_times(self):
+        calls = []
+
+        @retry_on_lock
+        def write():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        self.assertEqual(write(), 'done')
+        self.assertEqual(len(calls), 3)
+
+        @retry_on_lock
+        def always_locked():
+            calls.append(1)
+            raise OperationalError('database is locked')
+
+        calls.clear()
+        with mock.patch('booking.db.WRITE_RETRY_ATTEMPTS', 4), self.assertRaises(OperationalError):
+            always_locked()
+        self.assertEqual(len(calls), 4)
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        @retry_on_lock
+        def broken():
+            calls.append(1)
+            raise OperationalError('no such table: nope')
+
+        with self.assertRaises(OperationalError):
+            broken()
+        self.assertEqual(len(calls), 1)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """Uses a temporary SQLite file as the 'replica', kept deliberately out of sync."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The test runner only knows about 'default', so the replica alias is
+        # added here and then allowed for this test case.
+        handle, cls.replica_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        connections.settings[REPLICA_ALIAS] = dict(connections.settings['default'], NAME=cls.replica_path)
+        cls.databases = {'default', REPLICA_ALIAS}
+        call_command('migrate', database=REPLICA_ALIAS, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA_ALIAS].close()
+        del connections[REPLICA_ALIAS]
+        del connections.settings[REPLICA_ALIAS]
+        os.remove(cls.replica_path)
+
+    def setUp(self):
+        staff = make_staff()
+        self.service = make_service(staff)
+        self.customer = make_customer()
+        self.booking = Booking.objects.create(customer=self.customer, staff=staff, service=self.service, start_time=timezone.now() + timedelta(days=3), status='confirmed')
+        # Copy everything to the replica, then let it "lag" by one extra booking
+        # that the primary does not have.
+        for model in (User, UserProfile, Staff, Service, Service.staff_members.through, Booking):
+            model.objects.using(REPLICA_ALIAS).bulk_create(model.objects.using('default').all())
+        self.replica_only = Booking.objects.using(REPLICA_ALIAS).create(customer=self.customer, staff=staff, service=self.service, start_time=timezone.now() + timedelta(days=4), status='confirmed')
+        self.client.force_login(self.customer)
+
+    def upcoming_ids(self):
+        response = self.client.get(reverse('booking:my_bookings'))
+        return {booking.id for booking in response.context['upcoming_bookings']}
+
+    def test_read_only_pages_read_the_replica(self):
+        self.assertEqual(self.upcoming_ids(), {self.booking.id, self.replica_only.id})
+
+    def test_a_write_pins_the_browser_to_the_primary(self):
+        response = self.client.post(reverse('booking:cancel_booking', args=[self.booking.id]))
+        self.assertEqual(response.cookies['db_pin'].value, '1')
+        # The replica still shows the booking as confirmed; the primary knows better.
+        self.assertEqual(self.upcoming_ids(), set())
+
+    def test_reads_after_a_write_use_the_primary(self):
+        router = PrimaryReplicaRouter()
+        token = routers._wrote.set(False) # As at the start of a request.
+        try:
+            with replica_reads():
+                self.assertEqual(router.db_for_read(Booking), REPLICA_ALIAS)
+                self.assertEqual(router.db_for_write(Booking), 'default')
+                self.assertEqual(router.db_for_read(Booking), 'default')
+        finally:
+            routers._wrote.reset(token)
+
+
+class BenchSuiteTests(TestCase):
+    def test_generated_salon_can_be_benchmarked(self):
+        call_command('generate_salon_data', '--staff', '3', '--services', '2', '--customers', '5', '--bookings', '300', '--future-days', '3', stdout=io.StringIO())
+        self.assertEqual(Booking.objects.count(), 300)
+        self.assertTrue(Booking.objects.filter(start_time__gt=timezone.now(), status='confirmed').exists())
+
+        out = io.StringIO()
+        call_command('bench_suite', '--requests', '3', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['scenarios']), {'home', 'booking_slots', 'slot_window', 'my_bookings', 'staff_dashboard', 'stripe_webhook', 'send_reminders'})
+        self.assertGreater(report['scenarios']['my_bookings']['queries_max'], 0)
+        # The benchmark cleans up the webhook events and emails it caused.
+        self.assertFalse(StripeEvent.objects.exists())
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_regressions_are_reported(self):
+        baseline = {'scenarios': {'home': {'p95_ms': 10.0, 'queries_max': 2}}}
+        self.assertEqual(find_regressions({'scenarios': {'home': {'p95_ms': 12.0, 'queries_max': 2}}}, baseline), [])
+        problems = find_regressions({'scenarios': {'home': {'p95_ms': 30.0, 'queries_max': 3}}}, baseline)
+        self.assertEqual(len(problems), 2)
+
+
+@mock.patch('booking.profiling.PROFILING_SAMPLE_RATE', 1)
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.staff = make_staff(day_of_week=MONDAY.weekday(), start_time=time(9), end_time=time(17))
+        self.service = make_service(self.staff)
+        self.client.force_login(make_customer())
+
+    def test_sampled_requests_get_a_server_timing_header(self):
+        with mock.patch('booking.profiling.PROFILING_SLOW_REQUEST_MS', 10_000):
+            response = self.client.get(reverse('booking:my_bookings'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+;.*total;dur=')
+
+    async def test_sync_views_served_over_asgi_still_report_database_time(self):
+        with mock.patch('booking.profiling.PROFILING_SLOW_REQUEST_MS', 10_000):
+            response = await self.async_client.get(reverse('booking:home'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        # The hook is taken off again, so later queries are not counted.
+        self.assertEqual(connection.execute_wrappers, [])
+
+    async def test_async_views_leave_out_the_database_figures_they_cannot_measure(self):
+        event = {'id': 'evt_1', 'type': 'checkout.session.completed', 'data': {'object': {'metadata': {}}}}
+        with mock.patch('stripe.Webhook.construct_event', return_value=event), \
+                mock.patch('booking.profiling.PROFILING_SLOW_REQUEST_MS', 0), self.assertLogs('booking.profiling', 'WARNING') as logs:
+            response = await self.async_client.post(reverse('booking:stripe_webhook'), data=json.dumps(event), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('db;', response['Server-Timing'])
+        self.assertNotIn('queries', json.loads(logs.records[0].getMessage()))
+
+    def test_slow_requests_are_logged_with_outbound_calls_and_repeated_queries(self):
+        post = {'staff': self.staff.id, 'date': MONDAY.isoformat(), 'time': '10:00:00'}
+        with mock.patch('booking.profiling.PROFILING_SLOW_REQUEST_MS', 0), stub_stripe(), \
+                mock.patch('booking.profiling.PROFILING_DUPLICATE_QUERIES', 2), \
+                self.assertLogs('booking.profiling', 'WARNING') as logs:
+            response = self.client.post(reverse('booking:checkout', args=[self.service.id]), post)
+        self.assertEqual(response['Location'], 'https://checkout.stripe.test/cs_test_1')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['path'], reverse('booking:checkout', args=[self.service.id]))
+        self.assertEqual(entry['outbound_calls'], {'stripe': 1})
+        self.assertGreater(entry['queries'], 0)
+        self.assertTrue(all(item['count'] >= 2 for item in entry['duplicate_queries']))
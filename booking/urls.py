@@ -15,6 +15,9 @@ urlpatterns = [
 
     # URLs for the booking and payment process
     path('book/service/<int:service_id>/', views.booking_view, name='book_service'),
+    path('book/service/<int:service_id>/checkout/', views.checkout_view, name='checkout'),
+    path('book/service/<int:service_id>/slots.json', views.slot_window_api, name='slot_window'),
+    path('book/service/<int:service_id>/earliest/', views.earliest_slots_api, name='earliest_slots'),
     path('payment/success/', views.payment_success_view, name='payment_success'),
     path('payment/cancelled/', views.payment_cancelled_view, name='payment_cancelled'),
     path('stripe/webhook/', views.stripe_webhook_view, name='stripe_webhook'),
@@ -24,4 +27,7 @@ urlpatterns = [
     path('cancel-booking/<int:booking_id>/', views.cancel_booking_view, name='cancel_booking'),
     path('staff/dashboard/', views.staff_dashboard_view, name='staff_dashboard'),
     path('staff/availability/', views.manage_availability_view, name='manage_availability'),
+    path('staff/utilization/', views.staff_utilization_view, name='staff_utilization'),
+    path('staff/schedule.json', views.staff_schedule_api, name='staff_schedule_api'),
+    path('calendar/<str:token>.ics', views.calendar_feed_view, name='calendar_feed'),
 ]
\ No newline at end of file
@@ -1,33 +1,74 @@
 # booking/views.py
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, aget_object_or_404, get_object_or_404
 from django.contrib.auth import login
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.urls import reverse
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from datetime import datetime
+from django.views.decorators.http import condition, require_GET, require_POST
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag
+from django.db.models import Count, Max
+from datetime import datetime, timedelta, timezone as dt_timezone
 from collections import defaultdict
+import json
 import stripe
 
 # We import all our custom components
 from .models import Service, Staff, Booking, UserProfile, Availability
 from .forms import CustomerRegistrationForm, AvailabilityFormSet
-from .booking_logic import get_available_slots
-from .emails import send_booking_email
+from .catalog import CATALOG_CACHE_TIMEOUT, get_catalog_version, get_service_catalog
+from .archive import past_bookings_page
+from .calendar_feeds import aics_lines, feed_bookings, feed_url, ics_lines, read_feed_token
+from .booking_logic import cancel_booking, day_range, find_earliest_slots, reserve_slot, SlotUnavailable
+from .slot_cache import cached_available_slots, cached_range_slots, range_validator, range_version
+from .stripe_events import record_stripe_event
 from .decorators import staff_required
+from .payments import PaymentProviderBusy, create_checkout_session
+from .schedules import save_availability
+from .rollups import revenue_by_service, staff_utilization
+from .routers import read_from_replica
 
-# Set up Stripe with our secret key from settings.py
+# Set up Stripe with our secret key from settings.py (checkouts use the
+# async client in payments.py, which reads the key itself).
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# The "Any stylist" option on the booking form searches this many days ahead.
+ANY_STYLIST = 'any'
+ANY_STYLIST_SEARCH_DAYS = 14
+
+# The slot API answers for this many days at once, so the booking form can
+# move around a week without asking the server again.
+SLOT_WINDOW_DAYS = 7
+
+# How many past bookings "My Bookings" shows per page.
+PAST_BOOKINGS_PAGE_SIZE = 20
+
+# Page and sync cursors are microseconds since this moment.
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# How far before a `since` cursor the schedule API looks for changes.
+SCHEDULE_SYNC_OVERLAP = timedelta(seconds=5)
+
+# The utilization report covers this many days unless asked otherwise, and never more than the maximum.
+UTILIZATION_DEFAULT_DAYS = 30
+UTILIZATION_MAX_DAYS = 366
+
 # --- Page Views ---
 
+@read_from_replica # Read-only pages may be served by the replica database.
 def home(request):
     """View for the homepage, which lists all services."""
-    services = Service.objects.filter(is_active=True).order_by('name')
-    return render(request, 'booking/home.html', {'services': services})
+    # The template caches the rendered catalog under this version, and only
+    # calls get_service_catalog when that fragment has to be rebuilt.
+    version = get_catalog_version()
+    context = {'catalog_version': version, 'services': lambda: get_service_catalog(version), 'catalog_timeout': CATALOG_CACHE_TIMEOUT}
+    return render(request, 'booking/home.html', context)
 
 def register_view(request):
     """Handles the user registration page."""
@@ -45,30 +86,202 @@ def register_view(request):
         form = CustomerRegistrationForm()
     return render(request, 'booking/register.html', {'form': form})
 
+def encode_booking_cursor(booking):
+    """A compact "resume after this booking" marker: microsecond timestamp and id."""
+    return f"{(booking.start_time - EPOCH) // timedelta(microseconds=1)}-{booking.id}"
+
+def decode_booking_cursor(cursor):
+    """The (start_time, id) pair in a cursor, or None if it is missing or malformed."""
+    try:
+        micros, booking_id = (int(part) for part in cursor.split('-'))
+        return EPOCH + timedelta(microseconds=micros), booking_id
+    except (AttributeError, ValueError, OverflowError, OSError):
+        return None
+
 @login_required # This decorator ensures only logged-in users can access this page.
+@read_from_replica
 def my_bookings_view(request):
     """Shows a logged-in customer their upcoming and past bookings."""
     now = timezone.now()
-    upcoming = Booking.objects.filter(customer=request.user, start_time__gte=now, status='confirmed').order_by('start_time')
-    past = Booking.objects.filter(customer=request.user, start_time__lt=now).order_by('-start_time')
-    return render(request, 'booking/my_bookings.html', {'upcoming_bookings': upcoming, 'past_bookings': past})
+    # Everything the template shows (service name, stylist's name) is joined
+    # in, so each list costs one query however many rows it has.
+    related = ('service', 'staff__user_profile__user')
+    upcoming = Booking.objects.filter(customer=request.user, start_time__gte=now, status='confirmed').select_related(*related).order_by('start_time')
+
+    # Past bookings are paged with a keyset cursor on (start_time, id): each
+    # page is an index range scan that starts where the last one ended,
+    # instead of an OFFSET that re-reads every earlier row. Old bookings live
+    # in the archive table, which is read the same way and merged in.
+    cursor = decode_booking_cursor(request.GET.get('before'))
+    past = past_bookings_page(request.user, now, cursor, PAST_BOOKINGS_PAGE_SIZE)
+    next_cursor = encode_booking_cursor(past[PAST_BOOKINGS_PAGE_SIZE - 1]) if len(past) > PAST_BOOKINGS_PAGE_SIZE else None
+    past = past[:PAST_BOOKINGS_PAGE_SIZE]
+
+    context = {
+        'upcoming_bookings': upcoming, 'past_bookings': past, 'next_cursor': next_cursor, 'is_first_page': cursor is None,
+        'calendar_feed_url': feed_url(request, 'customer', request.user.id),
+    }
+    return render(request, 'booking/my_bookings.html', context)
 
 # --- Staff-Only Views ---
 
+def get_staff_member_or_404(request):
+    """The logged-in staff member's Staff row, resolved once per request (see roles.py)."""
+    if not request.staff_member: # Set lazily by StaffMemberMiddleware.
+        raise Http404("No staff record for this user.")
+    return request.staff_member
+
 @staff_required # Our custom decorator to protect this page.
+@read_from_replica
 def staff_dashboard_view(request):
     """The main dashboard for staff to see their schedule."""
-    staff_member = get_object_or_404(Staff, user_profile__user=request.user)
-    bookings = Booking.objects.filter(staff=staff_member, status='confirmed', start_time__gte=timezone.now().date()).order_by('start_time')
+    staff_member = get_staff_member_or_404(request)
+    today_start, _ = day_range(timezone.localdate())
+    bookings = Booking.objects.filter(staff=staff_member, status='confirmed', start_time__gte=today_start).select_related('service', 'customer').order_by('start_time')
     bookings_by_date = defaultdict(list)
     for booking in bookings:
         bookings_by_date[booking.start_time.date()].append(booking)
-    return render(request, 'booking/staff_dashboard.html', {'bookings_by_date': dict(bookings_by_date), 'staff_member': staff_member})
+    context = {'bookings_by_date': dict(bookings_by_date), 'staff_member': staff_member, 'calendar_feed_url': feed_url(request, 'staff', staff_member.id)}
+    return render(request, 'booking/staff_dashboard.html', context)
+
+def _report_range(request):
+    """The (first_day, last_day) asked for in ?start= and ?end=, or the last 30 days."""
+    today = timezone.localdate()
+    try:
+        last_day = datetime.strptime(request.GET['end'], '%Y-%m-%d').date() if request.GET.get('end') else today
+        first_day = datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if request.GET.get('start') else last_day - timedelta(days=UTILIZATION_DEFAULT_DAYS - 1)
+    except ValueError:
+        messages.error(request, "Dates must look like 2024-01-31; showing the last 30 days instead.")
+        return today - timedelta(days=UTILIZATION_DEFAULT_DAYS - 1), today
+    if first_day > last_day or (last_day - first_day).days >= UTILIZATION_MAX_DAYS:
+        messages.error(request, f"Pick a range of 1 to {UTILIZATION_MAX_DAYS} days; showing the last 30 days instead.")
+        return today - timedelta(days=UTILIZATION_DEFAULT_DAYS - 1), today
+    return first_day, last_day
+
+@staff_required
+@read_from_replica
+def staff_utilization_view(request):
+    """Booked vs. available time and revenue per stylist, read from the daily rollups."""
+    first_day, last_day = _report_range(request)
+    context = {
+        'first_day': first_day, 'last_day': last_day,
+        'staff_rows': staff_utilization(first_day, last_day),
+        'service_rows': revenue_by_service(first_day, last_day),
+    }
+    return render(request, 'booking/staff_utilization.html', context)
+
+def _schedule_state(request):
+    """Last change time and row count of the staff member's schedule, looked up once per request.
+
+    Any save to a booking moves updated_at, and the count catches rows that
+    disappear, so together they make a cheap validator for the schedule.
+    """
+    if not hasattr(request, '_schedule_state'):
+        today_start, _ = day_range(timezone.localdate())
+        request._schedule_state = Booking.objects.filter(
+            staff__user_profile__user=request.user, start_time__gte=today_start
+        ).aggregate(last_modified=Max('updated_at'), count=Count('id'))
+    return request._schedule_state
+
+def _schedule_etag(request):
+    state = _schedule_state(request)
+    last_modified = state['last_modified'].timestamp() if state['last_modified'] else 0
+    return f"{request.user.id}-{last_modified}-{state['count']}-{request.GET.get('since', '')}"
+
+def _schedule_last_modified(request):
+    return _schedule_state(request)['last_modified']
+
+def _booking_json(booking):
+    return {
+        'id': booking.id,
+        'start_time': booking.start_time.isoformat(),
+        'end_time': booking.end_time.isoformat(),
+        'status': booking.status,
+        'service': booking.service.name,
+        'duration_minutes': booking.service.duration_minutes,
+        'customer': booking.customer.get_full_name() or booking.customer.username,
+        'updated_at': booking.updated_at.isoformat(),
+    }
+
+@staff_required
+@read_from_replica
+@condition(etag_func=_schedule_etag, last_modified_func=_schedule_last_modified)
+def staff_schedule_api(request):
+    """The staff member's upcoming schedule as JSON, for front-desk tablets that poll it.
+
+    Without `since` it returns every upcoming confirmed booking. With
+    `since=<cursor>` (the `cursor` of an earlier response) it returns only
+    bookings created, changed or cancelled after that point, so the client
+    can apply them as a delta. Unchanged schedules get a 304 via ETag or
+    Last-Modified.
+    """
+    staff_member = get_staff_member_or_404(request)
+    today_start, _ = day_range(timezone.localdate())
+    bookings = Booking.objects.filter(staff=staff_member, start_time__gte=today_start).select_related('service', 'customer')
+    since = request.GET.get('since')
+    if since:
+        try:
+            if not (since.isascii() and since.isdigit()): # int() would also take '-5', ' 5' or '1_0'.
+                raise ValueError(since)
+            # Look back a little: a transaction that started earlier may commit a
+            # change stamped just before the cursor. Clients apply rows by id, so
+            # seeing one twice is harmless.
+            since_time = EPOCH + timedelta(microseconds=int(since)) - SCHEDULE_SYNC_OVERLAP
+        except (ValueError, OverflowError): # OverflowError: a number past the year 9999.
+            return JsonResponse({'error': 'Invalid since cursor.'}, status=400)
+        bookings = bookings.filter(updated_at__gt=since_time).order_by('updated_at', 'id')
+    else:
+        bookings = bookings.filter(status='confirmed').order_by('start_time')
+
+    last_modified = _schedule_last_modified(request)
+    return JsonResponse({
+        'staff': staff_member.id,
+        'full': not since,
+        # Cursors are microsecond timestamps, so they need no URL escaping.
+        'cursor': str((last_modified - EPOCH) // timedelta(microseconds=1)) if last_modified else (since or None),
+        'bookings': [_booking_json(booking) for booking in bookings],
+    })
+
+# --- Calendar Feeds ---
+
+def _feed_state(request, token):
+    """The feed's owner plus its last change time and row count, looked up once per request."""
+    if not hasattr(request, '_feed_state'):
+        owner = read_feed_token(token)
+        if owner is None:
+            raise Http404("Unknown calendar feed.")
+        # Per-table counts, so archiving a booking (which moves it) still changes the ETag.
+        states = [bookings.aggregate(last_modified=Max('updated_at'), count=Count('id')) for bookings in feed_bookings(*owner)]
+        changes = [state['last_modified'] for state in states if state['last_modified']]
+        request._feed_state = {'owner': owner, 'last_modified': max(changes, default=None), 'counts': [state['count'] for state in states]}
+    return request._feed_state
+
+def _feed_etag(request, token):
+    state = _feed_state(request, token)
+    kind, owner_id = state['owner']
+    last_modified = state['last_modified'].timestamp() if state['last_modified'] else 0
+    return f"{kind}-{owner_id}-{last_modified}-" + '-'.join(map(str, state['counts']))
+
+@require_GET
+@read_from_replica
+@condition(etag_func=_feed_etag)
+def calendar_feed_view(request, token):
+    """An iCalendar feed of a staff member's or customer's bookings, for calendar apps.
+
+    The body is streamed booking by booking. Calendar apps poll these feeds
+    every few minutes, and most polls end in a 304 from the ETag, which
+    costs one aggregate query per table.
+    """
+    kind, owner_id = _feed_state(request, token)['owner']
+    lines = aics_lines if isinstance(request, ASGIRequest) else ics_lines # See calendar_feeds.py.
+    response = StreamingHttpResponse(lines(kind, owner_id, request.get_host()), content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = 'inline; filename="stylesync.ics"'
+    return response
 
 @staff_required
 def manage_availability_view(request):
     """Allows staff to edit their weekly work schedule."""
-    staff_member = get_object_or_404(Staff, user_profile__user=request.user)
+    staff_member = get_staff_member_or_404(request)
     queryset = Availability.objects.filter(staff=staff_member).order_by('day_of_week')
     if request.method == 'POST':
         formset = AvailabilityFormSet(request.POST, queryset=queryset)
@@ -76,9 +289,8 @@ def manage_availability_view(request):
             instances = formset.save(commit=False)
             for instance in instances:
                 instance.staff = staff_member
-                instance.save()
-            for obj in formset.deleted_objects:
-                obj.delete()
+            # All changes in bulk: the same few queries however many days changed.
+            save_availability(instances, formset.deleted_objects)
             messages.success(request, "Availability updated.")
             return redirect('booking:staff_dashboard')
     else:
@@ -88,70 +300,169 @@ def manage_availability_view(request):
 # --- Booking & Payment Process Views ---
 
 @login_required
+@require_GET # Choosing a time posts to checkout_view.
+@read_from_replica
 def booking_view(request, service_id):
-    """The main view for the multi-step booking process."""
+    """The main view for the multi-step booking process: pick a stylist, a date and a time."""
     service = get_object_or_404(Service, id=service_id)
-    staff_members = service.staff_members.all()
+    staff_members = service.staff_members.select_related('user_profile__user') # Staff names need the user.
     
     # Step 1: Check for available slots if staff/date are selected
     available_slots = []
+    earliest_slots = []
     selected_date_str = request.GET.get('date')
     selected_staff_id = request.GET.get('staff')
     if selected_date_str and selected_staff_id:
         try:
             selected_date = datetime.strptime(selected_date_str, '%Y-%m-%d').date()
-            selected_staff = get_object_or_404(Staff, id=selected_staff_id)
-            available_slots = get_available_slots(service, selected_staff, selected_date)
+            if selected_staff_id == ANY_STYLIST:
+                # "Any stylist": the earliest open times across everyone who offers this service.
+                search_end = selected_date + timedelta(days=ANY_STYLIST_SEARCH_DAYS - 1)
+                earliest_slots = find_earliest_slots(service, selected_date, search_end)
+            else:
+                selected_staff = get_object_or_404(Staff, id=selected_staff_id)
+                available_slots = cached_available_slots(service, selected_staff, selected_date)
         except (ValueError, Staff.DoesNotExist):
             messages.error(request, "Invalid date or staff selection.")
-            
-    # Step 2: Handle the final submission to create the booking and go to payment
-    if request.method == 'POST':
-        staff_id = request.POST.get('staff')
-        date_str = request.POST.get('date')
-        time_str = request.POST.get('time')
-        try:
-            staff = get_object_or_404(Staff, id=staff_id)
-            # Combine date and time, and make it timezone-aware
-            booking_datetime_naive = datetime.strptime(f"{date_str} {time_str}", '%Y-%m-%d %H:%M:%S')
-            booking_datetime = timezone.make_aware(booking_datetime_naive)
-
-            # Create a booking with 'pending' status
-            booking = Booking.objects.create(customer=request.user, staff=staff, service=service, start_time=booking_datetime, status='pending')
-
-            # Create a Stripe Checkout Session for payment
-            checkout_session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'usd',
-                        'product_data': {'name': f"{service.name} with {staff}"},
-                        'unit_amount': int(service.price * 100), # Price in cents
-                    }, 'quantity': 1
-                }],
-                mode='payment',
-                success_url=request.build_absolute_uri(reverse('booking:payment_success')),
-                cancel_url=request.build_absolute_uri(reverse('booking:payment_cancelled')),
-                metadata={'booking_id': booking.id} # Pass our booking ID to Stripe
-            )
-            booking.stripe_session_id = checkout_session.id
-            booking.save()
-            return redirect(checkout_session.url, code=303) # Redirect to Stripe's payment page
-        except Exception as e:
-            messages.error(request, f"An error occurred: {str(e)}")
-            return redirect('booking:book_service', service_id=service.id)
 
-    context = {'service': service, 'staff_members': staff_members, 'selected_date': selected_date_str, 'selected_staff_id': int(selected_staff_id) if selected_staff_id else None, 'available_slots': available_slots}
+    if selected_staff_id and selected_staff_id != ANY_STYLIST:
+        selected_staff_id = int(selected_staff_id) if selected_staff_id.isdigit() else None
+    context = {'service': service, 'staff_members': staff_members, 'selected_date': selected_date_str, 'selected_staff_id': selected_staff_id or None, 'available_slots': available_slots, 'earliest_slots': earliest_slots}
     return render(request, 'booking/booking_form.html', context)
 
+@login_required
+@require_POST
+async def checkout_view(request, service_id):
+    """Holds the chosen slot and sends the customer to Stripe to pay.
+
+    Async, so under ASGI the wait for Stripe does not tie up a worker;
+    database work runs in Django's thread pool (async ORM, sync_to_async).
+    """
+    service = await aget_object_or_404(Service, id=service_id)
+    try:
+        staff = await Staff.objects.select_related('user_profile__user').aget(id=request.POST.get('staff'))
+        # Combine date and time, and make it timezone-aware
+        booking_datetime_naive = datetime.strptime(f"{request.POST.get('date')} {request.POST.get('time')}", '%Y-%m-%d %H:%M:%S')
+        booking_datetime = timezone.make_aware(booking_datetime_naive)
+
+        # Atomically hold the slot with a 'pending' booking. This fails if
+        # someone else confirmed or is paying for an overlapping time.
+        booking = await sync_to_async(reserve_slot)(await request.auser(), staff, service, booking_datetime)
+    except SlotUnavailable:
+        messages.error(request, "Sorry, that time was just taken. Please choose another slot.")
+        return redirect('booking:book_service', service_id=service.id)
+    except Exception as e:
+        messages.error(request, f"An error occurred: {str(e)}")
+        return redirect('booking:book_service', service_id=service.id)
+    try:
+        # Create a Stripe Checkout Session for payment. It expires together
+        # with our hold, so nobody can pay for a slot that was released.
+        checkout_session = await create_checkout_session({
+            'payment_method_types': ['card'],
+            'line_items': [{
+                'price_data': {
+                    'currency': 'usd',
+                    'product_data': {'name': f"{service.name} with {staff}"},
+                    'unit_amount': int(service.price * 100), # Price in cents
+                }, 'quantity': 1
+            }],
+            'mode': 'payment',
+            'success_url': request.build_absolute_uri(reverse('booking:payment_success')),
+            'cancel_url': request.build_absolute_uri(reverse('booking:payment_cancelled')),
+            'metadata': {'booking_id': booking.id}, # Pass our booking ID to Stripe
+            'expires_at': int(booking.hold_expires_at.timestamp()),
+        })
+        booking.stripe_session_id = checkout_session.id
+        await booking.asave(update_fields=['stripe_session_id', 'updated_at'])
+        return redirect(checkout_session.url, code=303) # Redirect to Stripe's payment page
+    except Exception as e:
+        await booking.adelete() # Release the hold straight away; the customer never reached payment.
+        if isinstance(e, PaymentProviderBusy):
+            messages.error(request, "Our payment provider is busy right now. Please try again in a moment.")
+        else:
+            messages.error(request, f"An error occurred: {str(e)}")
+        return redirect('booking:book_service', service_id=service.id)
+
+def _slot_window(request):
+    """The (staff_id, start_date) asked for in ?staff= and ?start=, or None if they are invalid."""
+    staff_id = request.GET.get('staff', '')
+    try:
+        start_date = datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if 'start' in request.GET else timezone.localdate()
+    except ValueError:
+        return None
+    return (int(staff_id), start_date) if staff_id.isdigit() else None
+
+def _slot_window_etag(request, service_id, version=None):
+    # Built from the cache only, so an unchanged window answers 304 without a query.
+    window = _slot_window(request)
+    if window is None:
+        return None
+    staff_id, start_date = window
+    validator = range_validator(staff_id, start_date, SLOT_WINDOW_DAYS, version)
+    if validator is None:
+        return None # Not computed since it last changed; the view adds the ETag once it is.
+    return f"{service_id}-{get_catalog_version()}-{staff_id}-{start_date}-{validator}"
+
+@require_GET
+@read_from_replica
+@condition(etag_func=_slot_window_etag)
+def slot_window_api(request, service_id):
+    """Free slots for one stylist over SLOT_WINDOW_DAYS days as compact JSON, for the booking form."""
+    window = _slot_window(request)
+    if window is None:
+        return JsonResponse({'error': 'Invalid staff or start.'}, status=400)
+    staff_id, start_date = window
+    service = get_object_or_404(Service, id=service_id, is_active=True)
+    if not service.staff_members.filter(pk=staff_id).exists():
+        raise Http404("This stylist does not offer this service.")
+    version = range_version(staff_id, start_date, SLOT_WINDOW_DAYS)
+    slots_by_day = cached_range_slots(service, staff_id, start_date, SLOT_WINDOW_DAYS, version)
+    response = JsonResponse({
+        'service': service.id,
+        'staff': staff_id,
+        'days': [
+            {'date': day.isoformat(), 'slots': [slot.strftime('%H:%M') for slot in slots]}
+            for day, slots in sorted(slots_by_day.items())
+        ],
+    })
+    # The ETag of the version these slots were computed for (it may be newer
+    # than the one @condition looked at before the view ran).
+    etag = _slot_window_etag(request, service_id, version)
+    if etag:
+        response['ETag'] = quote_etag(etag)
+    # Browsers may keep the answer but must check the ETag before reusing it.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+@require_GET
+@read_from_replica
+def earliest_slots_api(request, service_id):
+    """Returns the earliest open slots for a service across all its stylists as JSON."""
+    service = get_object_or_404(Service, id=service_id, is_active=True)
+    try:
+        start_date = datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if 'start' in request.GET else timezone.localdate()
+        days = min(max(int(request.GET.get('days', ANY_STYLIST_SEARCH_DAYS)), 1), 31)
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start, days or limit.'}, status=400)
+    slots = find_earliest_slots(service, start_date, start_date + timedelta(days=days - 1), limit=limit)
+    return JsonResponse({
+        'service': service.id,
+        'slots': [
+            {'start_time': slot.start_time.isoformat(), 'staff_id': slot.staff.id, 'staff_name': str(slot.staff)}
+            for slot in slots
+        ],
+    })
+
 @login_required
 def cancel_booking_view(request, booking_id):
     """Allows a user to cancel their own booking."""
     booking = get_object_or_404(Booking, id=booking_id, customer=request.user)
     if request.method == 'POST':
-        booking.status = 'cancelled'
-        booking.save()
-        messages.success(request, "Your booking has been cancelled.")
+        if cancel_booking(booking):
+            messages.success(request, "Your booking has been cancelled.")
+        else:
+            messages.error(request, "This booking can no longer be cancelled.")
     return redirect('booking:my_bookings')
 
 # --- Stripe Integration Views ---
@@ -163,12 +474,14 @@ def payment_success_view(request):
 
 def payment_cancelled_view(request):
     """Page the user sees if they cancel the payment process."""
-    # It's good practice to find and delete the 'pending' booking here.
+    # The pending booking's hold simply runs out; the reap_pending_bookings
+    # command deletes the leftover row later.
     messages.error(request, "Payment was cancelled. Please try again.")
     return redirect('booking:home')
 
 @csrf_exempt # Stripe sends data here without a CSRF token, so we must exempt this view.
-def stripe_webhook_view(request):
+@require_POST
+async def stripe_webhook_view(request):
     """An endpoint for Stripe to send us notifications (e.g., 'payment successful')."""
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
@@ -176,19 +489,10 @@ def stripe_webhook_view(request):
         event = stripe.Webhook.construct_event(payload, sig_header, settings.STRIPE_WEBHOOK_SECRET)
     except (ValueError, stripe.error.SignatureVerificationError):
         return HttpResponse(status=400) # Bad request
-    
-    # Handle the 'checkout.session.completed' event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        booking_id = session.get('metadata', {}).get('booking_id')
-        if booking_id:
-            try:
-                booking = Booking.objects.get(id=booking_id)
-                # Check status to prevent processing twice
-                if booking.status == 'pending':
-                    booking.status = 'confirmed'
-                    booking.save()
-                    send_booking_email(booking, 'confirmation') # Send confirmation email
-            except Booking.DoesNotExist:
-                return HttpResponse(status=404) # Not found
-    return HttpResponse(status=200) # Success
\ No newline at end of file
+
+    # Just record the event and answer straight away; the process_stripe_events
+    # worker confirms bookings and queues emails. A redelivered event fails the
+    # unique insert and is acknowledged without being stored twice; types the
+    # worker does not handle are acknowledged without being stored at all.
+    await sync_to_async(record_stripe_event)(event['id'], event['type'], json.loads(payload))
+    return HttpResponse(status=200) # Success
@@ -29,11 +29,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so it times the whole request; see booking/profiling.py.
+    'booking.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # Keeps a browser on the primary database for a moment after it writes.
+    'booking.middleware.ReplicaPinningMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.user_role and request.staff_member, resolved once per request.
+    'booking.middleware.StaffMemberMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -44,7 +50,8 @@ ROOT_URLCONF = 'stylesync.urls'
 # This tells Django how and where to find your HTML files (Templates).
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's template engine plus render timing for the profiling middleware.
+        'BACKEND': 'booking.profiling.ProfilingDjangoTemplates',
         # We will create a global 'templates' folder at the project root.
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
@@ -69,6 +76,65 @@ DATABASES = {
     }
 }
 
+# SQLite concurrency mode, for running on SQLite in production. Turn it on by
+# setting STYLESYNC_SQLITE_CONCURRENCY=1. Every new connection switches to
+# WAL (readers no longer block the writer) with tuned pragmas, waits up to
+# SQLITE_BUSY_TIMEOUT seconds for a lock instead of failing, and starts
+# transactions with BEGIN IMMEDIATE so writers queue up front rather than
+# deadlocking when a read turns into a write.
+SQLITE_CONCURRENCY_MODE = os.environ.get('STYLESYNC_SQLITE_CONCURRENCY') == '1'
+SQLITE_BUSY_TIMEOUT = 20
+SQLITE_CONCURRENCY_OPTIONS = {
+    'timeout': SQLITE_BUSY_TIMEOUT,
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA temp_store=MEMORY;'
+        'PRAGMA cache_size=-20000;'
+        'PRAGMA mmap_size=134217728'
+    ),
+}
+if SQLITE_CONCURRENCY_MODE:
+    DATABASES['default']['OPTIONS'] = SQLITE_CONCURRENCY_OPTIONS
+
+# Read replica. Set STYLESYNC_REPLICA_DB to the replica's database file (or
+# swap in your real replica's settings) and the heavy read-only pages will
+# read from it; see booking/routers.py. Writes always go to 'default'.
+if os.environ.get('STYLESYNC_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['STYLESYNC_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['booking.routers.PrimaryReplicaRouter']
+# How long (seconds) a browser keeps reading the primary after it wrote.
+REPLICA_PIN_SECONDS = 5
+
+# Request profiling: the share of requests that get a Server-Timing header
+# and are checked for repeated queries, and the time (ms) above which any
+# request is logged to the 'booking.profiling' logger.
+PROFILING_SAMPLE_RATE = 0.1
+PROFILING_SLOW_REQUEST_MS = 500
+PROFILING_DUPLICATE_QUERIES = 3
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'booking': {'handlers': ['console'], 'level': 'INFO'}},
+}
+
+# Caching. Local memory is fine for development and tests; in production point
+# this at a shared backend (Redis, Memcached) so every worker sees the same
+# slot cache and invalidations, and the same role versions (booking/roles.py).
+# With more than one worker process this is required, not optional.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -101,4 +167,7 @@ DEFAULT_FROM_EMAIL = 'noreply@stylesync.com'
 # Stripe API Keys (get these from your Stripe.com test dashboard)
 STRIPE_PUBLISHABLE_KEY = 'pk_test_YOUR_PUBLISHABLE_KEY' # Replace with your key
 STRIPE_SECRET_KEY = 'sk_test_YOUR_SECRET_KEY'     # Replace with your key
-STRIPE_WEBHOOK_SECRET = 'whsec_...'             # Replace with your key from the Stripe CLI
\ No newline at end of file
+STRIPE_WEBHOOK_SECRET = 'whsec_...'             # Replace with your key from the Stripe CLI
+
+# How long (in seconds) a computed slot list may stay in the cache.
+SLOT_CACHE_TIMEOUT = 60 * 60
\ No newline at end of file